@@ -2,15 +2,18 @@
 # -*- coding: utf-8 -*-
 
 # import collections
+import atexit
 import multiprocessing
 from multiprocessing import shared_memory, Value
-import multiprocessing.managers
 from multiprocessing.sharedctypes import Synchronized
 import queue
+import signal
 import threading
-from time import sleep
+import uuid
+from contextlib import contextmanager
+from time import perf_counter, sleep
 import traceback
-from typing import Any
+from typing import Any, Callable, Iterator, NamedTuple
 import cv2
 import datetime
 import os
@@ -19,10 +22,6 @@ import os
 import numpy as np  # noqa: F401
 from logging import getLogger, DEBUG, NullHandler
 from loguru import logger
-from icecream import ic
-from video_capture_wrapper import VideoCaptureWrapper
-
-# import signal
 
 multiprocessing.freeze_support()
 
@@ -69,114 +68,245 @@ def _get_save_filespec(filename: str) -> str:
         return os.path.join(CAPTURE_DIR, filename)
 
 
-class CameraController:
-    def __init__(
-        self,
-        finish_flag: Synchronized,
-        camera_process_status: Synchronized,
-        fps: Synchronized,
-        cameraId: int = 0,
-        capture_size: tuple = (1280, 720),
-    ):
-        self.camera: cv2.VideoCapture | None = None
-
-        self.cameraId = cameraId
-        self.fps = fps
-        self.capture_size = capture_size
+def _extract_frame(
+    frame: np.ndarray, copy: bool, roi: list | tuple | None, gray: bool
+) -> np.ndarray:
+    """
+    フレームから必要な部分だけを取り出す。
 
-        self.shared_memory = shared_memory.SharedMemory(name="camera_image")
-        self.image: np.ndarray = np.ndarray(
-            (720, 1280, 3), dtype=np.uint8, buffer=self.shared_memory.buf
-        )
-        ic(self.shared_memory.size)
+    切り出しはビューで行い、グレースケール変換は切り出した範囲に対してのみ行う。
+    copy=Falseで変換もしない場合は読み取り専用のビューをそのまま返す。
 
-        self.finish_flag = finish_flag
-        self.camera_process_status = camera_process_status
+    Args:
+        frame (np.ndarray): 元フレーム(BGR)
+        copy (bool): 書き込み可能なコピーを返すかどうか
+        roi (list | tuple | None): 切り出し範囲 [x1, y1, x2, y2]
+        gray (bool): グレースケールに変換するかどうか
 
-        self.openCamera()
-        self.processCamera()
+    Returns:
+        np.ndarray: 取り出した画像
+    """
+    if roi is not None and len(roi) == 4:
+        frame = frame[roi[1] : roi[3], roi[0] : roi[2]]
+    if gray:
+        # 変換結果は新しい配列なのでコピーは不要
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    if copy:
+        return frame.copy()
+    if frame.flags.writeable:
+        frame = frame.view()
+        frame.flags.writeable = False
+    return frame
+
+
+class FrameInfo(NamedTuple):
+    seq: int  # フレームの通し番号(1始まり、0はフレームなし)
+    timestamp: float  # 取得時刻(time.perf_counter)
+
+
+class CaptureStats(NamedTuple):
+    fps: float  # 実際に配信できているフレームレート
+    target_fps: float  # 設定されているフレームレート
+    latency_ms: float  # フレームの撮影(推定)から配信までの時間
+    skipped: int  # 設定FPSに合わせるためデコードせずに読み捨てたフレーム数
+    drained: int  # ドライバのバッファに溜まっていて読み捨てた古いフレーム数
+    dropped: int  # 読み出し側が全スロットを使用中で配信できなかったフレーム数
+
+
+class FrameGrabber:
+    """
+    grab/retrieveでカメラから最新のフレームを取り出す
 
-    def openCamera(self) -> None:
-        if self.camera and self.camera.isOpened():
-            logger.debug("Camera is already opened")
-            return
+    grabはデバイスから次のフレームが届くまでブロックするので、ループの周期はデバイスが決める。
+    設定FPSより速く届くフレームはretrieve(デコード)せずに読み捨て、
+    配信するときだけretrieveする。常にgrabし続けることでドライバのバッファに
+    フレームが溜まらないようにし、溜まっていた場合(処理が詰まったあとなど)は
+    古いフレームを読み捨ててから配信する。
 
-        if os.name == "nt":
-            logger.debug("NT OS")
-            self.camera = cv2.VideoCapture(self.cameraId, cv2.CAP_DSHOW)  # type: ignore
-        else:
-            logger.debug("Not NT OS")
-            self.camera = cv2.VideoCapture(self.cameraId)  # type: ignore
+    フレームの古さはデバイスのタイムスタンプ(CAP_PROP_POS_MSEC)から推定する。
+    タイムスタンプを返さないバックエンドでは、すぐに返ってくるgrabが続いた場合に
+    バッファに溜まっていたとみなす。
+    """
 
-        if not self.camera.isOpened():
-            print(f"Camera ID {self.cameraId} cannot open.")
-            logger.error(f"Camera ID {self.cameraId} cannot open.")
-            self.camera_process_status.value = False
-            return
-        else:
-            print(f"Camera ID {self.cameraId} opened successfully.")
-            logger.debug(f"Camera ID {self.cameraId} opened successfully.")
-            self.camera_process_status.value = True
+    FAST_GRAB = 0.001  # これより速く返ったgrabはバッファに溜まっていたフレーム
+    MAX_DRAIN = 8
+    EMA_ALPHA = 0.1
 
-            self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.capture_size[0])
-            self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.capture_size[1])
+    def __init__(self, camera: cv2.VideoCapture, fps: Callable[[], float]):
+        self.camera = camera
+        self.fps = fps
+        self.next_due = 0.0
+        self._last_grab = float("inf")
+        self._clock_offset: float | None = None
+        self._last_published = 0.0
+        self._interval = 0.0
+        self._latency = 0.0
+        self.skipped = 0
+        self.drained = 0
+
+    def read(self) -> tuple[np.ndarray | None, float]:
+        """
+        次に配信するフレームを取得する。
+
+        Returns:
+            tuple: (フレーム, 撮影時刻の推定値(perf_counter))。読み込みに失敗した場合フレームはNone
+        """
+        period = 1 / max(float(self.fps()), 1.0)
+        while True:
+            ok, t_grab, age = self._grab()
+            if not ok:
+                sleep(period)
+                return None, perf_counter()
+            # 多少早く届いたフレームは配信する(揺らぎで1フレーム分遅れないように)
+            if t_grab >= self.next_due - period * 0.25:
+                break
+            self.skipped += 1
+            if self._last_grab < self.FAST_GRAB:
+                # ブロックしないバックエンド(動画ファイルなど)で空回りしないようにする
+                sleep(min(self.next_due - t_grab, self.FAST_GRAB))
+
+        ok, t_grab, age = self._drain(ok, t_grab, age, period)
+        self.next_due = max(self.next_due + period, t_grab)
+        ret, frame = self.camera.retrieve()
+        if not ret:
+            return None, perf_counter()
+        return frame, t_grab - (age or 0.0)
+
+    def published(self, timestamp: float) -> None:
+        """フレームを配信したことを記録し、統計を更新する"""
+        now = perf_counter()
+        if self._last_published:
+            self._interval += (now - self._last_published - self._interval) * self.EMA_ALPHA
+        self._latency += (now - timestamp - self._latency) * self.EMA_ALPHA
+        self._last_published = now
+
+    def stats(self, dropped: int = 0) -> CaptureStats:
+        return CaptureStats(
+            fps=1 / self._interval if self._interval > 0 else 0.0,
+            target_fps=float(self.fps()),
+            latency_ms=self._latency * 1000,
+            skipped=self.skipped,
+            drained=self.drained,
+            dropped=dropped,
+        )
 
-    def isOpened(self) -> bool:
-        if not self.camera:
-            return False
+    def _grab(self) -> tuple[bool, float, float | None]:
+        t0 = perf_counter()
+        ok = self.camera.grab()
+        t1 = perf_counter()
+        self._last_grab = t1 - t0
+        return ok, t1, self._frame_age(t1) if ok else None
+
+    def _frame_age(self, now: float) -> float | None:
+        # デバイスの時計とperf_counterの差の最小値を遅延0とみなして、フレームの古さを求める
+        device_ms = self.camera.get(cv2.CAP_PROP_POS_MSEC)
+        if not device_ms or device_ms <= 0:
+            return None
+        offset = now - device_ms / 1000
+        if self._clock_offset is None or offset < self._clock_offset:
+            self._clock_offset = offset
         else:
-            return self.camera.isOpened()
-
-    def processCamera(self) -> None:
-        while not self.finish_flag.value:
-            try:
-                if self.camera is not None and self.camera.isOpened():
-                    ret, frame = self.camera.read()
-                    if ret:
-                        self.image[:] = frame
-                sleep(1 / self.fps.value)
-            except Exception:
-                logger.error("Camera Process Error")
-                logger.error(traceback.format_exc())
-        self.closeCamera()
-
-    def closeCamera(self) -> None:
-        self.finish_flag.value = True
-        if self.camera is not None and self.camera.isOpened():
-            self.camera.release()
-            self.camera = None
+            # 時計のずれで基準が古くなり続けないよう、少しずつ追従させる
+            self._clock_offset += (offset - self._clock_offset) * 0.001
+        return offset - self._clock_offset
+
+    def _drain(
+        self, ok: bool, t_grab: float, age: float | None, period: float
+    ) -> tuple[bool, float, float | None]:
+        fast_before = self._last_grab < self.FAST_GRAB
+        for _ in range(self.MAX_DRAIN):
+            if age is not None:
+                stale = age > period / 2
+            else:
+                stale = fast_before and self._last_grab < self.FAST_GRAB
+            if not stale:
+                break
+            fast_before = self._last_grab < self.FAST_GRAB
+            grabbed, t, a = self._grab()
+            if not grabbed:
+                break
+            ok, t_grab, age = grabbed, t, a
+            self.drained += 1
+        return ok, t_grab, age
 
 
 class CustomQueue(queue.Queue):
     def __init__(self, maxsize: int = 1):
         super().__init__(maxsize=maxsize)
         self.last_frame: Any = None  # 最新フレーム
+        self.seq = 0  # putされたフレームの通し番号
+        self.timestamp = 0.0  # 最新フレームの取得時刻
+        self.frame_arrived = threading.Condition()
 
-    def put(self, frame: Any, block: bool = True, timeout: float | None = None) -> None:
-        if self.full():
-            try:
-                self.get_nowait()  # キューが満杯なら古いフレームを取り出す
-            except Exception as e:
-                logger.error(e)
-        super().put(frame, block, timeout)
-        self.last_frame = frame
+    def put(
+        self,
+        frame: Any,
+        block: bool = True,
+        timeout: float | None = None,
+        timestamp: float | None = None,
+    ) -> None:
+        if isinstance(frame, np.ndarray):
+            # 一度公開したフレームは書き換えないので、ビューを安全に渡せる
+            frame.flags.writeable = False
+        with self.frame_arrived:
+            if self.full():
+                try:
+                    self.get_nowait()  # キューが満杯なら古いフレームを取り出す
+                except Exception as e:
+                    logger.error(e)
+            super().put(frame, block, timeout)
+            self.last_frame = frame
+            self.seq += 1
+            self.timestamp = perf_counter() if timestamp is None else timestamp
+            self.frame_arrived.notify_all()
 
     def get(self, block: bool = True, timeout: float | None = None) -> Any:
         if not self.empty():
             return super().get(block, timeout)
         return self.last_frame  # キューが空なら最新フレームを返す
 
+    def latest(self) -> tuple[Any, FrameInfo]:
+        """最新フレームとその通し番号・取得時刻を組で返す"""
+        with self.frame_arrived:
+            return self.last_frame, FrameInfo(self.seq, self.timestamp)
+
+    def wait_next(self, after_seq: int, timeout: float | None = None) -> bool:
+        """通し番号がafter_seqより新しいフレームが届くまで待つ"""
+        with self.frame_arrived:
+            return self.frame_arrived.wait_for(lambda: self.seq > after_seq, timeout)
+
+    def reset(self) -> None:
+        """保持しているフレームを破棄する。通し番号は引き継ぐ"""
+        with self.frame_arrived:
+            while not self.empty():
+                try:
+                    self.get_nowait()
+                except queue.Empty:
+                    break
+            self.last_frame = None
+
 
 class Camera:
     def __init__(self, fps: int = 45):
-        self.camera: VideoCaptureWrapper | cv2.VideoCapture | None = None
+        self.camera: cv2.VideoCapture | None = None
         self.fps = int(fps)
         self.capture_size = (1280, 720)
         self.capture_dir = "Captures"
         self.frame_queue: CustomQueue = CustomQueue()
+        self.grabber: FrameGrabber | None = None
+
+    def setFps(self, fps: int) -> None:
+        self.fps = int(fps)
+
+    def captureStats(self) -> CaptureStats:
+        """キャプチャの実測FPSと遅延を返す"""
+        if self.grabber is None:
+            return CaptureStats(0.0, float(self.fps), 0.0, 0, 0, 0)
+        return self.grabber.stats()
 
     def openCamera(self, cameraId: int) -> None:
-        self.frame_queue = CustomQueue()
+        # 待機中の呼び出し元が取り残されないよう、キューは作り直さずに中身だけ捨てる
+        self.frame_queue.reset()
         if self.camera is not None and self.camera.isOpened():
             logger.debug("Camera is already opened")
             self.destroy()
@@ -184,10 +314,8 @@ class Camera:
         if os.name == "nt":
             logger.debug("NT OS")
             self.camera = cv2.VideoCapture(cameraId)
-            # self.camera = VideoCaptureWrapper(cameraId, cv2.CAP_DSHOW) # マルチプロセスにする場合
         else:
             logger.debug("Not NT OS")
-            # self.camera = VideoCaptureWrapper(cameraId) # マルチプロセスにする場合
             self.camera = cv2.VideoCapture(cameraId)
 
         if not self.camera.isOpened():
@@ -209,27 +337,89 @@ class Camera:
         logger.debug("Camera is opened")
         if self.camera is None:
             return False
-        if isinstance(self.camera, VideoCaptureWrapper) or isinstance(
-            self.camera, cv2.VideoCapture
-        ):
+        if isinstance(self.camera, cv2.VideoCapture):
             return bool(self.camera.isOpened())
         return False
 
-    def readFrame(self) -> cv2.Mat | None:
-        if isinstance(self.camera, VideoCaptureWrapper) or isinstance(
-            self.camera, cv2.VideoCapture
-        ):
-            if self.frame_queue:
-                frame = self.frame_queue.get()
-                if frame is None:
-                    return None
-                return frame.copy()
-            else:
-                logger.debug("Frame queue is empty")
-                return None
+    def readFrame(
+        self,
+        copy: bool = True,
+        roi: list | tuple | None = None,
+        gray: bool = False,
+    ) -> cv2.Mat | None:
+        """
+        最新フレームを取得する。
+
+        Args:
+            copy (bool): Falseの場合、コピーせず読み取り専用のビューを返す
+            roi (list | tuple | None): 切り出し範囲 [x1, y1, x2, y2]
+            gray (bool): グレースケールに変換して返すかどうか
+
+        Returns:
+            cv2.Mat | None: フレーム。取得できない場合はNone
+        """
+        if isinstance(self.camera, cv2.VideoCapture):
+            frame, _ = self.readFrameWithInfo(copy, roi, gray)
+            return frame
         else:
             return None
 
+    def readFrameWithInfo(
+        self,
+        copy: bool = True,
+        roi: list | tuple | None = None,
+        gray: bool = False,
+    ) -> tuple[cv2.Mat | None, FrameInfo]:
+        """
+        最新フレームを、その通し番号・取得時刻と一緒に取得する。
+
+        引数はreadFrameと同じ。
+
+        Returns:
+            tuple: (フレーム, FrameInfo)。フレームがない場合はNone
+        """
+        frame, info = self.frame_queue.latest()
+        if frame is None:
+            return None, info
+        return _extract_frame(frame, copy, roi, gray), info
+
+    def frameInfo(self) -> FrameInfo:
+        """最新フレームの通し番号と取得時刻を返す"""
+        _, info = self.frame_queue.latest()
+        return info
+
+    def waitNextFrame(
+        self, after_seq: int | None = None, timeout: float | None = None
+    ) -> FrameInfo | None:
+        """
+        新しいフレームが届くまで待つ。
+
+        Args:
+            after_seq (int | None): この通し番号より新しいフレームを待つ。Noneなら現在の最新フレーム
+            timeout (float | None): 最大待ち時間[s]。Noneなら無制限
+
+        Returns:
+            FrameInfo | None: 届いたフレームの情報。タイムアウトした場合はNone
+        """
+        if after_seq is None:
+            after_seq = self.frameInfo().seq
+        if not self.frame_queue.wait_next(after_seq, timeout):
+            return None
+        return self.frameInfo()
+
+    @contextmanager
+    def readFrameView(self) -> Iterator[cv2.Mat | None]:
+        """
+        最新フレームの読み取り専用ビューを貸し出す。
+
+        キャプチャスレッドはフレームごとに新しい配列を作り、公開後は書き換えないので、
+        withブロックの中ではビューの内容が取得時点のフレームのまま保たれる。
+
+        Yields:
+            cv2.Mat | None: 読み取り専用のフレーム。取得できない場合はNone
+        """
+        yield self.readFrame(copy=False)
+
     def saveCapture(
         self,
         filename: str | None = None,
@@ -249,7 +439,8 @@ class Camera:
         else:
             filename = filename + ".png"
 
-        image_bgr = self.readFrame()
+        # 書き出すだけなのでコピーせずに読み取り専用ビューを使う
+        image_bgr = self.readFrame(copy=False)
         if image_bgr is None:
             return
         if crop is None:
@@ -314,66 +505,487 @@ class Camera:
             logger.error("Camera is not opened")
             return
         logger.debug("Camera update thread started")
-        while self.camera.isOpened():
-            _, frame = self.camera.read()
-            self.frame_queue.put(frame)
-            sleep(1 / self.fps)
-            if self.camera is None:
-                break
+        self.grabber = FrameGrabber(self.camera, lambda: self.fps)
+        while self.camera is not None and self.camera.isOpened():
+            frame, timestamp = self.grabber.read()
+            if frame is None:
+                # 読み込みに失敗した場合は配信しない(直前のフレームを残し、統計にも数えない)
+                continue
+            self.frame_queue.put(frame, timestamp=timestamp)
+            self.grabber.published(timestamp)
 
 
-# カメラの読み込み処理をマルチプロセス化する
-# WIP
-class CameraQueue:
-    # using shared memory
-    def __init__(self, fps: int, cameraId: int, capture_size: tuple = (1280, 720)):
-        logger.debug("CameraQueue initializing")
+SHM_PREFIX = "pokecon_cam_"
+
+
+def _unique_segment_name() -> str:
+    # プロセスIDを名前に含めておき、異常終了で残ったセグメントを後から判別できるようにする
+    return f"{SHM_PREFIX}{os.getpid()}_{uuid.uuid4().hex[:8]}"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def cleanup_orphaned_segments() -> None:
+    """
+    異常終了したプロセスが残した共有メモリセグメントを削除する。
+
+    WindowsではハンドルがすべてClosedになった時点で解放されるため、POSIX(/dev/shm)のみ対象。
+    """
+    shm_dir = "/dev/shm"
+    if os.name != "posix" or not os.path.isdir(shm_dir):
+        return
+    for name in os.listdir(shm_dir):
+        if not name.startswith(SHM_PREFIX):
+            continue
+        try:
+            pid = int(name[len(SHM_PREFIX) :].split("_")[0])
+        except ValueError:
+            continue
+        if pid == os.getpid() or _pid_alive(pid):
+            continue
+        try:
+            os.remove(os.path.join(shm_dir, name))
+            logger.info(f"Removed orphaned shared memory: {name}")
+        except OSError as e:
+            logger.warning(f"Failed to remove orphaned shared memory {name}: {e}")
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    # 子プロセス側ではresource_trackerに登録しない(終了時に勝手にunlinkされるのを防ぐ)
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # type: ignore[call-arg]
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+@contextmanager
+def _hold(lock: Any, timeout: float | None) -> Iterator[bool]:
+    # 相手のプロセスがロックを持ったまま落ちても固まらないようにタイムアウト付きで取る
+    acquired = lock.acquire(True, timeout) if timeout is not None else lock.acquire()
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            lock.release()
+
+
+class SharedFrameRing:
+    """
+    共有メモリ上のフレームリングバッファ(既定はトリプルバッファ)
+
+    書き込み側(キャプチャプロセス)は最新スロットと読み出し側がピン留めしているスロット以外に書き込み、
+    書き終わってから最新スロットを切り替える。各スロットにはseqlockのカウンタがあり、
+    書き込み中は奇数になる。コピーで読み出す側はロックを取らずに読み、前後でカウンタが
+    変わっていなければ採用するので、書きかけのフレームを受け取ることはない。
+    ビューで読み出す側はロックを取ってスロットをピン留めし、返却するまで書き換えさせない。
+    """
+
+    MAGIC = 0x504B434D
+    MAX_SLOTS = 8
+    HEADER_SIZE = 4096
+
+    # int64ヘッダ
+    _I_MAGIC = 0
+    _I_HEIGHT = 1
+    _I_WIDTH = 2
+    _I_CHANNELS = 3
+    _I_SLOTS = 4
+    _I_LATEST = 5  # 最新フレームのスロット番号(-1はフレームなし)
+    _I_SEQ = 6  # 最新フレームの通し番号
+    _I_DROPPED = 7  # 空きスロットがなく捨てたフレーム数
+    _I_SLOT_LOCK = 16  # seqlockカウンタ x MAX_SLOTS
+    _I_SLOT_SEQ = 24  # スロットに入っているフレームの通し番号 x MAX_SLOTS
+    _I_SLOT_PINS = 32  # ピン留め数 x MAX_SLOTS
+    _INT_FIELDS = 64
+
+    # float64ヘッダ
+    _F_HEARTBEAT = 0  # 書き込み側が最後に動いた時刻
+    _F_STATS = 1  # CaptureStatsのfps, latency_ms, skipped, drained
+    _F_SLOT_TIME = 8  # フレームの取得時刻 x MAX_SLOTS
+    _FLOAT_OFFSET = 1024
+    _FLOAT_FIELDS = 64
+
+    def __init__(
+        self,
+        name: str | None = None,
+        shape: tuple[int, int, int] = (720, 1280, 3),
+        nslots: int = 3,
+        create: bool = False,
+    ):
+        if create:
+            if not 2 <= nslots <= self.MAX_SLOTS:
+                raise ValueError(f"nslots must be 2..{self.MAX_SLOTS}")
+            size = self.HEADER_SIZE + nslots * int(np.prod(shape))
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=size, name=name or _unique_segment_name()
+            )
+        else:
+            if name is None:
+                raise ValueError("name is required to attach a ring")
+            self.shm = _attach_shared_memory(name)
+        self.name = self.shm.name
+        self.owner = create
+
+        self._ints = np.ndarray((self._INT_FIELDS,), np.int64, buffer=self.shm.buf)
+        self._floats = np.ndarray(
+            (self._FLOAT_FIELDS,),
+            np.float64,
+            buffer=self.shm.buf,
+            offset=self._FLOAT_OFFSET,
+        )
+        if create:
+            self._ints[:] = 0
+            self._floats[:] = 0.0
+            self._ints[self._I_HEIGHT : self._I_CHANNELS + 1] = shape
+            self._ints[self._I_SLOTS] = nslots
+            self._ints[self._I_LATEST] = -1
+            self._ints[self._I_MAGIC] = self.MAGIC
+        elif self._ints[self._I_MAGIC] != self.MAGIC:
+            raise RuntimeError(f"Shared memory {name} is not a frame ring")
+
+        self.shape = tuple(int(v) for v in self._ints[self._I_HEIGHT : self._I_CHANNELS + 1])
+        self.nslots = int(self._ints[self._I_SLOTS])
+        self.slots = np.ndarray(
+            (self.nslots, *self.shape),
+            np.uint8,
+            buffer=self.shm.buf,
+            offset=self.HEADER_SIZE,
+        )
+
+    # 書き込み側 ------------------------------------------------------------
+
+    def write(self, frame: np.ndarray, timestamp: float, cond: Any) -> bool:
+        """
+        フレームを書き込んで公開する。空きスロットがない場合は捨ててFalseを返す。
+        condは読み出し側と共有するmultiprocessing.Condition。
+        """
+        ints = self._ints
+        with cond:
+            latest = int(ints[self._I_LATEST])
+            slot = -1
+            for i in range(1, self.nslots + 1):
+                candidate = (latest + i) % self.nslots
+                if candidate != latest and ints[self._I_SLOT_PINS + candidate] == 0:
+                    slot = candidate
+                    break
+            if slot < 0:
+                ints[self._I_DROPPED] += 1
+                return False
+            ints[self._I_SLOT_LOCK + slot] += 1  # 奇数: 書き込み中
+
+        np.copyto(self.slots[slot], frame)
+
+        with cond:
+            ints[self._I_SLOT_LOCK + slot] += 1  # 偶数: 書き込み完了
+            seq = int(ints[self._I_SEQ]) + 1
+            ints[self._I_SLOT_SEQ + slot] = seq
+            self._floats[self._F_SLOT_TIME + slot] = timestamp
+            ints[self._I_LATEST] = slot
+            ints[self._I_SEQ] = seq
+            cond.notify_all()
+        return True
+
+    def heartbeat(self) -> None:
+        self._floats[self._F_HEARTBEAT] = perf_counter()
+
+    def publish_stats(self, stats: CaptureStats) -> None:
+        self._floats[self._F_STATS : self._F_STATS + 4] = (
+            stats.fps,
+            stats.latency_ms,
+            stats.skipped,
+            stats.drained,
+        )
+
+    def recover(self) -> None:
+        """
+        書き込み側が書き込み途中で落ちた場合に、seqlockカウンタを偶数に戻す。
+        書き込み側が動いていないときにだけ呼ぶこと。
+        """
+        for slot in range(self.nslots):
+            if self._ints[self._I_SLOT_LOCK + slot] & 1:
+                self._ints[self._I_SLOT_LOCK + slot] += 1
+
+    # 読み出し側 ------------------------------------------------------------
+
+    @property
+    def seq(self) -> int:
+        return int(self._ints[self._I_SEQ])
+
+    @property
+    def dropped(self) -> int:
+        return int(self._ints[self._I_DROPPED])
+
+    @property
+    def last_heartbeat(self) -> float:
+        return float(self._floats[self._F_HEARTBEAT])
+
+    def stats(self, target_fps: float) -> CaptureStats:
+        fps, latency_ms, skipped, drained = self._floats[self._F_STATS : self._F_STATS + 4]
+        return CaptureStats(
+            float(fps),
+            float(target_fps),
+            float(latency_ms),
+            int(skipped),
+            int(drained),
+            self.dropped,
+        )
+
+    def info(self) -> FrameInfo:
+        slot = int(self._ints[self._I_LATEST])
+        if slot < 0:
+            return FrameInfo(0, 0.0)
+        return FrameInfo(
+            int(self._ints[self._I_SLOT_SEQ + slot]),
+            float(self._floats[self._F_SLOT_TIME + slot]),
+        )
+
+    def read(
+        self,
+        roi: list | tuple | None = None,
+        gray: bool = False,
+        retries: int = 8,
+    ) -> tuple[np.ndarray | None, FrameInfo] | None:
+        """
+        ロックを取らずに最新フレームを(切り出し・変換して)コピーする。
+        書き込みと重なり続けて一貫した読み出しができなかった場合はNoneを返す。
+        """
+        ints = self._ints
+        for _ in range(retries):
+            slot = int(ints[self._I_LATEST])
+            if slot < 0:
+                return None, FrameInfo(0, 0.0)
+            before = int(ints[self._I_SLOT_LOCK + slot])
+            if before & 1:
+                continue
+            image = _extract_frame(self.slots[slot], True, roi, gray)
+            info = FrameInfo(
+                int(ints[self._I_SLOT_SEQ + slot]),
+                float(self._floats[self._F_SLOT_TIME + slot]),
+            )
+            if int(ints[self._I_SLOT_LOCK + slot]) == before:
+                return image, info
+        return None
+
+    def pin(self, cond: Any, timeout: float | None) -> tuple[int, FrameInfo]:
+        """最新スロットをピン留めする。フレームがない場合やロックが取れない場合は-1を返す"""
+        with _hold(cond, timeout) as acquired:
+            if not acquired:
+                logger.warning("Frame ring lock timeout")
+                return -1, FrameInfo(0, 0.0)
+            slot = int(self._ints[self._I_LATEST])
+            if slot < 0:
+                return -1, FrameInfo(0, 0.0)
+            self._ints[self._I_SLOT_PINS + slot] += 1
+            return slot, FrameInfo(
+                int(self._ints[self._I_SLOT_SEQ + slot]),
+                float(self._floats[self._F_SLOT_TIME + slot]),
+            )
+
+    def unpin(self, slot: int, cond: Any, timeout: float | None) -> None:
+        with _hold(cond, timeout) as acquired:
+            if not acquired:
+                # 書き込み側が異常終了しているので、ロックなしで戻しても競合しない
+                logger.warning("Frame ring lock timeout")
+            if self._ints[self._I_SLOT_PINS + slot] > 0:
+                self._ints[self._I_SLOT_PINS + slot] -= 1
+
+    def close(self) -> None:
+        # 共有メモリを参照している配列を先に手放してからcloseする
+        self._ints = self._floats = self.slots = None  # type: ignore[assignment]
+        try:
+            self.shm.close()
+        except BufferError:
+            logger.warning("Frame views are still referenced; shared memory stays mapped")
+
+    def unlink(self) -> None:
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class CameraController:
+    """
+    キャプチャ用の子プロセスの本体
+
+    カメラからフレームを読み込み、SharedFrameRingに書き込む。
+    cv2.VideoCapture.read()のデコードをこのプロセスで行うので、
+    コマンドやプレビューを動かしているプロセスのGILを占有しない。
+    """
+
+    def __init__(
+        self,
+        ring_name: str,
+        frame_arrived: Any,
+        finish_flag: Synchronized,
+        camera_process_status: Synchronized,
+        fps: Synchronized,
+        cameraId: int = 0,
+        capture_size: tuple = (1280, 720),
+    ):
+        # Ctrl+Cは親プロセス側で処理する
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        self.camera: cv2.VideoCapture | None = None
+
         self.cameraId = cameraId
+        self.fps = fps
         self.capture_size = capture_size
-        self._fps = int(fps)
 
-        self.manager = multiprocessing.Manager()
+        self.ring = SharedFrameRing(ring_name)
+        self.frame_arrived = frame_arrived
 
-        self.capture_dir = "Captures"
+        self.finish_flag = finish_flag
+        self.camera_process_status = camera_process_status
 
-        self.init_shared_memory()
+        try:
+            self.openCamera()
+            self.processCamera()
+        finally:
+            self.closeCamera()
+            self.ring.close()
 
-        self.openCamera(self.cameraId)
-        self.startCamera()
-        logger.debug("init CameraQueue")
+    def openCamera(self) -> None:
+        if self.camera and self.camera.isOpened():
+            logger.debug("Camera is already opened")
+            return
 
-    def init_shared_memory(self) -> None:
-        self.shm = shared_memory.SharedMemory(
-            create=True, size=int(np.prod((720, 1280, 3))), name="camera_image"
-        )
-        self.image_bgr: np.ndarray = np.ndarray(
-            (720, 1280, 3), dtype=np.uint8, buffer=self.shm.buf
+        if os.name == "nt":
+            logger.debug("NT OS")
+            self.camera = cv2.VideoCapture(self.cameraId, cv2.CAP_DSHOW)  # type: ignore
+        else:
+            logger.debug("Not NT OS")
+            self.camera = cv2.VideoCapture(self.cameraId)  # type: ignore
+
+        if not self.camera.isOpened():
+            print(f"Camera ID {self.cameraId} cannot open.")
+            logger.error(f"Camera ID {self.cameraId} cannot open.")
+            self.camera_process_status.value = False
+            return
+        else:
+            print(f"Camera ID {self.cameraId} opened successfully.")
+            logger.debug(f"Camera ID {self.cameraId} opened successfully.")
+            self.camera_process_status.value = True
+
+            self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.capture_size[0])
+            self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.capture_size[1])
+
+    def isOpened(self) -> bool:
+        if not self.camera:
+            return False
+        else:
+            return self.camera.isOpened()
+
+    def processCamera(self) -> None:
+        height, width = self.ring.shape[:2]
+        grabber = (
+            FrameGrabber(self.camera, lambda: self.fps.value)
+            if self.camera is not None
+            else None
         )
+        while not self.finish_flag.value:
+            try:
+                self.ring.heartbeat()
+                if grabber is None or not self.camera.isOpened():
+                    sleep(1 / self.fps.value)
+                    continue
+                frame, timestamp = grabber.read()
+                if frame is not None:
+                    if frame.shape[:2] != (height, width):
+                        frame = cv2.resize(frame, (width, height))
+                    self.ring.write(frame, timestamp, self.frame_arrived)
+                    grabber.published(timestamp)
+                    self.ring.publish_stats(grabber.stats())
+            except Exception:
+                logger.error("Camera Process Error")
+                logger.error(traceback.format_exc())
+
+    def closeCamera(self) -> None:
+        self.camera_process_status.value = False
+        if self.camera is not None and self.camera.isOpened():
+            self.camera.release()
+            self.camera = None
+
 
-        self.fps: Synchronized = Value("i", self._fps)
+def _run_camera_controller(*args: Any) -> None:
+    CameraController(*args)
+
+
+# カメラの読み込み処理をマルチプロセス化する
+class CameraQueue:
+    """
+    キャプチャを子プロセスで行うカメラ
+
+    Cameraと同じインターフェースを持ち、Settingsのcapture_backendを"process"にすると使われる。
+    フレームは共有メモリ上のSharedFrameRingで受け渡す。
+    子プロセスが異常終了した場合は監視スレッドが再起動する。
+    """
+
+    LOCK_TIMEOUT = 1.0
+    MAX_RESTARTS = 5
+
+    def __init__(self, fps: int = 45, capture_size: tuple = (1280, 720), nslots: int = 3):
+        logger.debug("CameraQueue initializing")
+        self.cameraId = 0
+        self.capture_size = capture_size
+        self.capture_dir = "Captures"
+        self.nslots = nslots
+
+        self.ring: SharedFrameRing | None = None
+        self.frame_arrived = multiprocessing.Condition()
+        self.fps: Synchronized = Value("i", int(fps))
         self.finish_flag: Synchronized = Value("b", False)
         self.camera_process_status: Synchronized = Value("b", False)
         self.camera_process: multiprocessing.Process | None = None
 
-    def openCamera(self, camera_id: int) -> None:
-        self.cameraId = camera_id
+        self._restarts = 0
+        self._watchdog: threading.Thread | None = None
+        self._watchdog_stop = threading.Event()
 
-        if self.camera_process is not None and self.camera_process.is_alive():
-            logger.debug("Camera is already opened")
-            self.finish_flag.value = True
-            self.camera_process.join()
-            # self.camera_process.terminate()
-            self.camera_process = None
+        cleanup_orphaned_segments()
+        atexit.register(self.destroy)
+        logger.debug("init CameraQueue")
 
-        # try:
-        #     self.init_shared_memory()
-        # except Exception:
-        #     logger.error("Shared Memory Error")
-        #     pass
+    def openCamera(self, cameraId: int) -> None:
+        self.cameraId = cameraId
+        self.stopCamera()
+
+        if self.ring is None:
+            width, height = self.capture_size
+            self.ring = SharedFrameRing(
+                shape=(height, width, 3), nslots=self.nslots, create=True
+            )
+            logger.debug(f"Created shared memory: {self.ring.name}")
+
+        self._restarts = 0
+        self.startCamera()
 
+        self._watchdog_stop.clear()
+        if self._watchdog is None or not self._watchdog.is_alive():
+            self._watchdog = threading.Thread(
+                target=self._watch, name="CameraWatchdog", daemon=True
+            )
+            self._watchdog.start()
+
+    def startCamera(self) -> None:
+        if self.ring is None:
+            logger.error("Shared memory is not initialized")
+            return
+        self.ring.recover()
+        self.finish_flag.value = False
         self.camera_process = multiprocessing.Process(
-            target=CameraController,
+            target=_run_camera_controller,
             args=(
+                self.ring.name,
+                self.frame_arrived,
                 self.finish_flag,
                 self.camera_process_status,
                 self.fps,
@@ -381,23 +993,177 @@ class CameraQueue:
                 self.capture_size,
             ),
             name="CameraController",
+            daemon=True,
         )
+        self.camera_process.start()
 
-    def startCamera(self) -> None:
+    def stopCamera(self) -> None:
+        self._watchdog_stop.set()
         if self.camera_process is None:
-            logger.error("Camera Process is not initialized")
             return
-        self.camera_process.start()
+        self.finish_flag.value = True
+        self.camera_process.join(timeout=3)
+        if self.camera_process.is_alive():
+            logger.warning("Camera process did not stop; terminating")
+            self.camera_process.terminate()
+            self.camera_process.join(timeout=1)
+        self.camera_process = None
+        self.camera_process_status.value = False
+
+    def _watch(self) -> None:
+        # 子プロセスが異常終了したら再起動する
+        while not self._watchdog_stop.wait(1.0):
+            process = self.camera_process
+            if process is None or process.is_alive() or self.finish_flag.value:
+                continue
+            logger.error(f"Camera process exited unexpectedly (code {process.exitcode})")
+            if self._restarts >= self.MAX_RESTARTS:
+                logger.error("Camera process restart limit reached")
+                self.camera_process = None
+                return
+            self._restarts += 1
+            # ロックを持ったまま落ちた可能性があるので作り直す
+            old = self.frame_arrived
+            self.frame_arrived = multiprocessing.Condition()
+            # 古い条件で待っているwaitNextFrameを起こし、新しい条件で待ち直させる
+            # (ロックが取れない場合は、待っている側のタイムアウトまで待つことになる)
+            if old.acquire(True, self.LOCK_TIMEOUT):
+                try:
+                    old.notify_all()
+                finally:
+                    old.release()
+            self.startCamera()
+
+    def setFps(self, fps: int) -> None:
+        self.fps.value = int(fps)
+
+    def captureStats(self) -> CaptureStats:
+        """キャプチャの実測FPSと遅延を返す"""
+        if self.ring is None:
+            return CaptureStats(0.0, float(self.fps.value), 0.0, 0, 0, 0)
+        return self.ring.stats(self.fps.value)
 
     def isOpened(self) -> bool:
-        if self.camera_process_status.value:
-            return True
-        else:
-            return False
+        return bool(
+            self.camera_process is not None
+            and self.camera_process.is_alive()
+            and self.camera_process_status.value
+        )
 
-    def readFrame(self) -> cv2.Mat | None:
-        logger.debug("Reading Frame")
-        return self.image_bgr
+    def readFrame(
+        self,
+        copy: bool = True,
+        roi: list | tuple | None = None,
+        gray: bool = False,
+    ) -> cv2.Mat | None:
+        """
+        共有メモリ上の最新フレームを取得する。
+
+        スロットはいずれ書き換えられるので、copy=Falseでも返すのは(切り出した範囲の)コピーになる。
+        コピーせずに参照したい場合はreadFrameViewを使う。
+
+        Args:
+            copy (bool): Cameraとの互換のための引数
+            roi (list | tuple | None): 切り出し範囲 [x1, y1, x2, y2]
+            gray (bool): グレースケールに変換して返すかどうか
+
+        Returns:
+            cv2.Mat | None: フレーム。取得できない場合はNone
+        """
+        frame, _ = self.readFrameWithInfo(copy, roi, gray)
+        return frame
+
+    def readFrameWithInfo(
+        self,
+        copy: bool = True,
+        roi: list | tuple | None = None,
+        gray: bool = False,
+    ) -> tuple[cv2.Mat | None, FrameInfo]:
+        """最新フレームを、その通し番号・取得時刻と一緒に取得する"""
+        if self.ring is None:
+            return None, FrameInfo(0, 0.0)
+        result = self.ring.read(roi, gray)
+        if result is not None:
+            return result
+        # 書き込みと重なり続けた場合はピン留めして読む
+        with self._pinnedFrame() as (frame, info):
+            if frame is None:
+                return None, info
+            return _extract_frame(frame, True, roi, gray), info
+
+    @contextmanager
+    def readFrameView(self) -> Iterator[cv2.Mat | None]:
+        """
+        共有メモリ上の最新フレームの読み取り専用ビューを貸し出す。
+
+        withブロックの間はスロットをピン留めし、キャプチャプロセスに書き換えさせない。
+
+        Yields:
+            cv2.Mat | None: 読み取り専用のフレーム。取得できない場合はNone
+        """
+        with self._pinnedFrame() as (frame, _):
+            yield frame
+
+    @contextmanager
+    def _pinnedFrame(self) -> Iterator[tuple[cv2.Mat | None, FrameInfo]]:
+        ring = self.ring
+        if ring is None:
+            yield None, FrameInfo(0, 0.0)
+            return
+        cond = self.frame_arrived
+        slot, info = ring.pin(cond, self.LOCK_TIMEOUT)
+        if slot < 0:
+            yield None, info
+            return
+        try:
+            view = ring.slots[slot].view()
+            view.flags.writeable = False
+            yield view, info
+        finally:
+            ring.unpin(slot, cond, self.LOCK_TIMEOUT)
+
+    def frameInfo(self) -> FrameInfo:
+        """最新フレームの通し番号と取得時刻を返す"""
+        if self.ring is None:
+            return FrameInfo(0, 0.0)
+        return self.ring.info()
+
+    def waitNextFrame(
+        self, after_seq: int | None = None, timeout: float | None = None
+    ) -> FrameInfo | None:
+        """
+        新しいフレームが届くまで待つ。
+
+        Args:
+            after_seq (int | None): この通し番号より新しいフレームを待つ。Noneなら現在の最新フレーム
+            timeout (float | None): 最大待ち時間[s]。Noneなら無制限
+
+        Returns:
+            FrameInfo | None: 届いたフレームの情報。タイムアウトした場合はNone
+        """
+        ring = self.ring
+        if ring is None:
+            return None
+        if after_seq is None:
+            after_seq = ring.seq
+        deadline = None if timeout is None else perf_counter() + timeout
+        while True:
+            # 子プロセスを再起動するとframe_arrivedが作り直されるので、その場合は待ち直す
+            cond = self.frame_arrived
+            remaining = None if deadline is None else max(0.0, deadline - perf_counter())
+            if not cond.acquire(True, remaining):
+                return None
+            try:
+                cond.wait_for(
+                    lambda: ring.seq > after_seq or self.frame_arrived is not cond,
+                    remaining,
+                )
+            finally:
+                cond.release()
+            if ring.seq > after_seq:
+                return ring.info()
+            if self.frame_arrived is cond:
+                return None  # タイムアウト
 
     def saveCapture(
         self,
@@ -418,19 +1184,22 @@ class CameraQueue:
         else:
             filename = filename + ".png"
 
+        image_bgr = self.readFrame()
+        if image_bgr is None:
+            return
         if crop is None:
-            image = self.image_bgr
+            image = image_bgr
         elif crop == 1 or crop == "1":
-            image = self.image_bgr[crop_ax[1] : crop_ax[3], crop_ax[0] : crop_ax[2]]
+            image = image_bgr[crop_ax[1] : crop_ax[3], crop_ax[0] : crop_ax[2]]
         elif crop == 2 or crop == "2":
-            image = self.image_bgr[
+            image = image_bgr[
                 crop_ax[1] : crop_ax[1] + crop_ax[3],
                 crop_ax[0] : crop_ax[0] + crop_ax[2],
             ]
         elif img is not None:
             image = img
         else:
-            image = self.image_bgr
+            image = image_bgr
 
         save_path = _get_save_filespec(filename)
 
@@ -450,19 +1219,14 @@ class CameraQueue:
             logger.error(f"Capture Failed :{e}")
 
     def destroy(self) -> None:
-        if self.isOpened() and self.camera_process is not None:
-            # self.camera_process.terminate()
-            self.finish_flag.value = True
-            self.camera_process = None
+        self.stopCamera()
+        if self.ring is not None:
+            ring, self.ring = self.ring, None
+            ring.close()
+            ring.unlink()
             logger.debug("Camera destroyed")
 
 
 if __name__ == "__main__":
     c = Camera(60)
     c.openCamera(2)
-
-    # c.finish_flag.value = True
-    # if c.camera_process is not None:
-    #     c.camera_process.terminate
-    # c.shm.close()
-    # c.shm.unlink()
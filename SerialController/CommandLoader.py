@@ -1,47 +1,388 @@
+import ast
+import hashlib
 import importlib
+import json
+import os
 import sys
+import time
+from collections import namedtuple
+
+from loguru import logger
 
 import Utility as util
 
+INDEX_VERSION = 2
+
+
+class CommandEntry:
+    """
+    A command found by scanning the source, without importing its module.
+    load() imports the module the first time and returns the command class.
+    """
+
+    __slots__ = ('NAME', 'module_name', 'class_name', '_loader')
+
+    def __init__(self, name, module_name, class_name, loader):
+        self.NAME = name
+        self.module_name = module_name
+        self.class_name = class_name
+        self._loader = loader
+
+    def load(self):
+        return self._loader.loadClass(self)
+
+    def __repr__(self):
+        return f"CommandEntry({self.NAME!r}, {self.module_name}.{self.class_name})"
+
+
+class ReloadReport(namedtuple('ReloadReport', ['reloaded', 'removed', 'rescanned',
+                                                'elapsed_ms'])):
+    """
+    What CommandLoader.reload did.
+    reloaded: [(module name, milliseconds)] in the order the modules were reloaded,
+    removed: the modules unloaded because their file was deleted,
+    rescanned: the number of files parsed again, elapsed_ms: the whole reload.
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        return (f"reloaded {len(self.reloaded)} module(s), removed {len(self.removed)}, "
+                f"rescanned {self.rescanned} file(s) in {self.elapsed_ms:.1f} ms")
+
+
+def _scanSource(source, filename, mod_name):
+    """
+    Find the classes in a module and the modules it imports without running it.
+
+    Returns:
+        tuple: ([(class name, NAME or None, [base names])], dynamic, [imported modules]).
+            dynamic is True when a NAME is not a string literal, so the module has to be
+            imported to know it. Only the imports in the same top-level package are listed
+    """
+    tree = ast.parse(source, filename)
+    classes = []
+    dynamic = False
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        # "PythonCommandBase.ImageProcPythonCommand" -> "ImageProcPythonCommand"
+        bases = [base.attr if isinstance(base, ast.Attribute) else getattr(base, 'id', None)
+                 for base in node.bases]
+        name = None
+        for stmt in node.body:
+            if isinstance(stmt, ast.Assign):
+                targets, value = stmt.targets, stmt.value
+            elif isinstance(stmt, ast.AnnAssign) and stmt.value is not None:
+                targets, value = [stmt.target], stmt.value
+            else:
+                continue
+            if not any(isinstance(t, ast.Name) and t.id == 'NAME' for t in targets):
+                continue
+            if isinstance(value, ast.Constant) and isinstance(value.value, (str, type(None))):
+                name = value.value
+            else:
+                dynamic = True
+        classes.append((node.name, name, [base for base in bases if base]))
+    return classes, dynamic, _scanImports(tree, mod_name)
+
+
+def _scanImports(tree, mod_name):
+    # "from Commands.PythonCommands import helper" may import the module helper, so both
+    # the package and package.helper are listed
+    package = mod_name.rpartition('.')[0].split('.')
+    imports = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ''
+            if node.level:
+                parent = '.'.join(package[:len(package) - node.level + 1])
+                base = '.'.join(name for name in (parent, base) if name)
+            imports.add(base)
+            imports.update(f"{base}.{alias.name}" for alias in node.names)
+    top = mod_name.split('.')[0] + '.'
+    return sorted(name for name in imports if name.startswith(top))
+
 
 class CommandLoader:
+    """
+    Lists the commands under base_path.
+
+    The modules are parsed instead of imported, so listing the commands does not pull in
+    their dependencies (scipy, pyaudio, ...). A module is imported when one of its commands
+    is loaded (CommandEntry.load). The scan result is cached per file in
+    <base_path>/__pycache__/commands.json and reused while the file's mtime and size match,
+    or while its content hash matches when only the mtime changed.
+
+    reload() reloads the modules whose content changed since they were imported and the
+    loaded modules under base_path that import them, and keeps a ReloadReport in
+    last_report.
+    """
+
     def __init__(self, base_path, base_class):
         self.path = base_path
         self.base_type = base_class
         self.modules = []
+        self.entries = []
+        self.index_path = os.path.join(base_path, '__pycache__', 'commands.json')
+        self.last_report = None
+        self._index = None
+        self._files = {}  # module name -> scan result of its file
+        self._imported = {}  # module name -> content hash when it was (re)loaded
 
     def load(self):
-        if not self.modules:  # load if empty
-            self.modules = util.importAllModules(self.path)
+        if not self.entries:  # load if empty
+            self.entries = self.scan()
 
-        # return command class types
-        return self.getCommandClasses()
+        # return command entries (the classes are imported on demand)
+        return self.entries
 
     def reload(self):
-        loaded_module_dic = {mod.__name__: mod for mod in self.modules}
-        cur_module_names = util.getModuleNames(self.path)
-
-        # Load only not loaded modules
-        not_loaded_module_names = list(set(cur_module_names) - set(loaded_module_dic.keys()))
-        if len(not_loaded_module_names) > 0:
-            self.modules.extend(util.importAllModules(self.path, not_loaded_module_names))
-
-        # Reload commands except deleted ones
-        for mod_name in list(set(cur_module_names) & set(loaded_module_dic.keys())):
-            importlib.reload(loaded_module_dic[mod_name])
+        start = time.perf_counter()
+        previous = self._files
+        rescanned = self._scanFiles()
+        files = self._files
 
         # Unload deleted commands
-        for mod_name in list(set(loaded_module_dic.keys()) - set(cur_module_names)):
-            self.modules.remove(loaded_module_dic[mod_name])
-            sys.modules.pop(loaded_module_dic[mod_name].__name__)  # Un-import module forcefully
+        removed = []
+        for module in list(self.modules):
+            if module.__name__ not in files:
+                self.modules.remove(module)
+                sys.modules.pop(module.__name__, None)  # Un-import module forcefully
+                self._imported.pop(module.__name__, None)
+                removed.append(module.__name__)
 
-        # return command class types
-        return self.getCommandClasses()
+        # Reload the modules edited since they were imported, and the modules using them.
+        # A module imported by a command (not through this loader) is compared with the
+        # previous scan
+        loaded = {mod_name for mod_name in files if mod_name in sys.modules}
+        changed = {mod_name for mod_name in loaded
+                   if self._imported.get(mod_name, previous.get(mod_name, {}).get('hash'))
+                   != files[mod_name]['hash']}
+        reloaded = []
+        for mod_name in self._reloadOrder(changed, loaded):
+            begin = time.perf_counter()
+            importlib.reload(sys.modules[mod_name])
+            self._imported[mod_name] = files[mod_name]['hash']
+            reloaded.append((mod_name, (time.perf_counter() - begin) * 1000))
+            logger.debug(f"Reloaded {mod_name} in {reloaded[-1][1]:.1f} ms")
+
+        # New modules are found by the scan and imported when selected
+        self.entries = self._resolve(list(files.values()))
+        self.last_report = ReloadReport(reloaded, removed, rescanned,
+                                        (time.perf_counter() - start) * 1000)
+        logger.debug(f"{self.path}: {self.last_report}")
+        return self.entries
 
     def getCommandClasses(self):
-        classes = []
-        for mod in self.modules:
-            classes.extend([c for c in util.getClassesInModule(mod) \
-                            if issubclass(c, self.base_type) and hasattr(c, 'NAME') and c.NAME])
+        # import every command (the behaviour before the lazy scan)
+        return [entry.load() for entry in self.load()]
+
+    def loadClass(self, entry):
+        module = sys.modules.get(entry.module_name)
+        if module is None:
+            logger.debug(f"Import module: {entry.module_name}")
+            module = importlib.import_module(entry.module_name)
+        self._addModule(module)
+        cls = getattr(module, entry.class_name)
+        if not issubclass(cls, self.base_type):
+            raise TypeError(f"{entry.module_name}.{entry.class_name} "
+                            f"is not a {self.base_type.__name__}")
+        return cls
+
+    def scan(self):
+        """
+        Returns:
+            list[CommandEntry]: the commands in the same order as the eager loader
+                (modules in file order, classes sorted by name)
+        """
+        self._scanFiles()
+        return self._resolve(list(self._files.values()))
+
+    def _scanFiles(self):
+        # updates self._files and the index, and returns the number of files parsed
+        index = self._loadIndex()
+        files = {}
+        changed = False
+        parsed = 0
+        for mod_name in util.getModuleNames(self.path):
+            filename = mod_name.replace('.', os.sep) + '.py'
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            cached = index.get(filename)
+            key = (stat.st_mtime_ns, stat.st_size)
+            if cached is None or (cached['mtime_ns'], cached['size']) != key:
+                cached, reparsed = self._scanFile(filename, mod_name, stat, cached)
+                parsed += reparsed
+                changed = True
+            files[mod_name] = dict(cached, module=mod_name, filename=filename)
+        self._files = files
+        self._index = {f['filename']: {k: v for k, v in f.items()
+                                       if k not in ('module', 'filename')}
+                       for f in files.values()}
+        if changed or len(index) != len(files):
+            self._saveIndex()
+        return parsed
+
+    def _scanFile(self, filename, mod_name, stat, cached):
+        # returns (scan result, whether the file was parsed)
+        try:
+            with open(filename, 'rb') as f:
+                source = f.read()
+        except OSError as e:
+            logger.error(f"Cannot read {filename}: {e}")
+            source = b''
+        digest = hashlib.sha1(source).hexdigest()
+        fingerprint = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'hash': digest}
+        if cached is not None and cached.get('hash') == digest:
+            # only touched (e.g. checked out again); the content is the same
+            return dict(cached, **fingerprint), False
+        try:
+            classes, dynamic, imports = _scanSource(source, filename, mod_name)
+        except (SyntaxError, ValueError) as e:
+            # importing it would fail in the same way; report it and skip the module
+            logger.error(f"Cannot parse {filename}: {e}")
+            classes, dynamic, imports = [], False, []
+        return dict(fingerprint, classes=classes, dynamic=dynamic, imports=imports), True
+
+    def _reloadOrder(self, changed, loaded):
+        # the changed modules and the loaded modules importing them (directly or through
+        # another one), each one after the modules it imports
+        imports = {mod_name: set(self._files[mod_name]['imports']) & loaded
+                   for mod_name in loaded}
+        stale = set()
+        pending = set(changed)
+        while pending:
+            stale |= pending
+            pending = {mod_name for mod_name in loaded
+                       if mod_name not in stale and imports[mod_name] & stale}
+
+        order = []
+        visited = set()
+
+        def visit(mod_name):
+            if mod_name in visited:
+                return
+            visited.add(mod_name)
+            for dependency in sorted(imports[mod_name] & stale):
+                visit(dependency)
+            order.append(mod_name)
+
+        for mod_name in sorted(stale):
+            visit(mod_name)
+        return order
+
+    def _addModule(self, module):
+        if module not in self.modules:
+            self.modules.append(module)
+        if module.__name__ not in self._imported and module.__name__ in self._files:
+            self._imported[module.__name__] = self._files[module.__name__]['hash']
+
+    def _baseNames(self):
+        # the base class and the subclasses commands inherit from (e.g. ImageProcPythonCommand)
+        names = set()
+        pending = [self.base_type]
+        while pending:
+            cls = pending.pop()
+            names.add(cls.__name__)
+            pending.extend(cls.__subclasses__())
+        return names
+
+    def _resolve(self, files):
+        recognized, names = self._recognize(files)
+        if self._importBases(files, recognized):
+            recognized, names = self._recognize(files)
+
+        entries = []
+        for f in files:
+            if f['dynamic']:
+                # NAME is computed at import time; fall back to importing the module
+                entries.extend(self._importEntries(f['module']))
+                continue
+            for class_name, name, bases in sorted(f['classes'], key=lambda c: c[0]):
+                if class_name not in recognized:
+                    continue
+                name = name or next((names[base] for base in bases if names.get(base)), None)
+                if name:
+                    entries.append(CommandEntry(name, f['module'], class_name, self))
+        return entries
+
+    def _recognize(self, files):
+        # the command classes, and class name -> NAME (also for classes inheriting NAME
+        # from another command)
+        recognized = self._baseNames()
+        names = {}
+        changed = True
+        while changed:
+            changed = False
+            for f in files:
+                for class_name, name, bases in f['classes']:
+                    if class_name not in recognized and recognized & set(bases):
+                        recognized.add(class_name)
+                        changed = True
+                    if name is None:
+                        name = next((names[base] for base in bases if names.get(base)), None)
+                    if name and class_name in recognized and class_name not in names:
+                        names[class_name] = name
+                        changed = True
+        return recognized, names
+
+    def _importBases(self, files, recognized):
+        # A class may inherit from a base defined outside base_path that nothing has imported
+        # yet (e.g. "from Commands.McuSequence import McuSequenceCommand"), so _baseNames
+        # does not know it. Import those modules; returns True if any was imported
+        local = {f['module'] for f in files}
+        imported = False
+        for f in files:
+            imports = set(f.get('imports', ()))
+            for class_name, name, bases in f['classes']:
+                if class_name in recognized:
+                    continue
+                for base in bases:
+                    for mod_name in sorted(imports):
+                        if (f"{mod_name}.{base}" not in imports or mod_name in local
+                                or mod_name in sys.modules):
+                            continue
+                        logger.debug(f"Import module: {mod_name}")
+                        try:
+                            importlib.import_module(mod_name)
+                            imported = True
+                        except Exception as e:
+                            logger.error(f"Cannot import {mod_name}: {e}")
+        return imported
+
+    def _importEntries(self, mod_name):
+        try:
+            module = sys.modules.get(mod_name) or importlib.import_module(mod_name)
+        except Exception as e:
+            logger.error(f"Cannot import {mod_name}: {e}")
+            return []
+        self._addModule(module)
+        return [CommandEntry(c.NAME, mod_name, c.__name__, self)
+                for c in util.getClassesInModule(module)
+                if issubclass(c, self.base_type) and hasattr(c, 'NAME') and c.NAME
+                and c.__module__ == mod_name]
+
+    def _loadIndex(self):
+        if self._index is not None:
+            return self._index
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if index.get('version') != INDEX_VERSION:
+            return {}
+        return index.get('files', {})
 
-        return classes
+    def _saveIndex(self):
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            with open(self.index_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': INDEX_VERSION, 'files': self._index}, f, ensure_ascii=False)
+        except OSError as e:
+            logger.debug(f"Cannot save the command index: {e}")
@@ -4,10 +4,22 @@
 import math
 import time
 from collections import OrderedDict
+from contextlib import contextmanager
+from typing import NamedTuple
 from enum import Enum, IntEnum, IntFlag, auto
 import queue
 from logging import getLogger, DEBUG, NullHandler
 
+import numpy as np
+
+from Commands.SerialProtocol import ReportEncoder, ReportState
+
+# shared by every KeyPress / SendFormat (creating a logger per instance is not free)
+logger = getLogger(__name__)
+logger.addHandler(NullHandler())
+logger.setLevel(DEBUG)
+logger.propagate = True
+
 
 class Button(IntFlag):
     Y = auto()
@@ -64,81 +76,101 @@ max = 255
 class SendFormat:
     def __init__(self):
 
-        self._logger = getLogger(__name__)
-        self._logger.addHandler(NullHandler())
-        self._logger.setLevel(DEBUG)
-        self._logger.propagate = True
+        self._logger = logger
 
         # This format structure needs to be the same as the one written in Joystick.c
-        self.format = OrderedDict([
-            ('btn', 0),  # send bit array for buttons
-            ('hat', Hat.CENTER),
-            ('lx', center),
-            ('ly', center),
-            ('rx', center),
-            ('ry', center),
+        # (btn, hat, lx, ly, rx, ry) is held in ReportState and encoded by ReportEncoder
+        self.state = ReportState()
+        self.encoder = ReportEncoder()
+        self.Hat_pos = Hat.CENTER
+
+    @property
+    def format(self):
+        # snapshot of the current state (kept for compatibility)
+        state = self.state
+        return OrderedDict([
+            ('btn', state.btn),
+            ('hat', state.hat),
+            ('lx', state.lx),
+            ('ly', state.ly),
+            ('rx', state.rx),
+            ('ry', state.ry),
         ])
 
-        self.L_stick_changed = False
-        self.R_stick_changed = False
-        self.Hat_pos = Hat.CENTER
+    @property
+    def L_stick_changed(self):
+        return self.state.l_changed
+
+    @L_stick_changed.setter
+    def L_stick_changed(self, value):
+        self.state.l_changed = value
+
+    @property
+    def R_stick_changed(self):
+        return self.state.r_changed
+
+    @R_stick_changed.setter
+    def R_stick_changed(self, value):
+        self.state.r_changed = value
 
     def setButton(self, btns):
         for btn in btns:
-            self.format['btn'] |= btn
+            self.state.btn |= btn
 
     def unsetButton(self, btns):
         for btn in btns:
-            self.format['btn'] &= ~btn
+            self.state.btn &= ~btn
 
     def resetAllButtons(self):
-        self.format['btn'] = 0
+        self.state.btn = 0
 
     def setHat(self, btns):
         # self._logger.debug(btns)
         if not btns:
-            self.format['hat'] = self.Hat_pos
+            self.state.hat = self.Hat_pos
         else:
             self.Hat_pos = btns[0]
-            self.format['hat'] = btns[0]  # takes only first element
+            self.state.hat = btns[0]  # takes only first element
 
     def unsetHat(self):
         # if self.Hat_pos is not Hat.CENTER:
         self.Hat_pos = Hat.CENTER
-        self.format['hat'] = self.Hat_pos
+        self.state.hat = self.Hat_pos
 
     def setAnyDirection(self, dirs):
+        state = self.state
         for dir in dirs:
+            x = dir.x
+            y = 255 - dir.y  # NOTE: y axis directs under
             if dir.stick == Stick.LEFT:
-                if self.format['lx'] != dir.x or self.format['ly'] != 255 - dir.y:
-                    self.L_stick_changed = True
-
-                self.format['lx'] = dir.x
-                self.format['ly'] = 255 - dir.y  # NOTE: y axis directs under
+                if state.lx != x or state.ly != y:
+                    state.l_changed = True
+                state.lx = x
+                state.ly = y
             elif dir.stick == Stick.RIGHT:
-                if self.format['rx'] != dir.x or self.format['ry'] != 255 - dir.y:
-                    self.R_stick_changed = True
-
-                self.format['rx'] = dir.x
-                self.format['ry'] = 255 - dir.y
+                if state.rx != x or state.ry != y:
+                    state.r_changed = True
+                state.rx = x
+                state.ry = y
 
     def unsetDirection(self, dirs):
+        state = self.state
         if Tilt.UP in dirs or Tilt.DOWN in dirs:
-            self.format['ly'] = center
-            self.format['lx'] = self.fixOtherAxis(self.format['lx'])
-            self.L_stick_changed = True
+            state.ly = center
+            state.lx = self.fixOtherAxis(state.lx)
+            state.l_changed = True
         if Tilt.RIGHT in dirs or Tilt.LEFT in dirs:
-            self.format['lx'] = center
-            self.format['ly'] = self.fixOtherAxis(self.format['ly'])
-            self.L_stick_changed = True
+            state.lx = center
+            state.ly = self.fixOtherAxis(state.ly)
+            state.l_changed = True
         if Tilt.R_UP in dirs or Tilt.R_DOWN in dirs:
-            self.format['ry'] = center
-            self.format['rx'] = self.fixOtherAxis(self.format['rx'])
-            self.R_stick_changed = True
+            state.ry = center
+            state.rx = self.fixOtherAxis(state.rx)
+            state.r_changed = True
         if Tilt.R_RIGHT in dirs or Tilt.R_LEFT in dirs:
-            self.format['rx'] = center
-            self.format['ry'] = self.fixOtherAxis(self.format['ry'])
-            self.R_stick_changed = True
+            state.rx = center
+            state.ry = self.fixOtherAxis(state.ry)
+            state.r_changed = True
 
     # Use this to fix an either tilt to max when the other axis sets to 0
     def fixOtherAxis(self, fix_target):
@@ -148,58 +180,45 @@ class SendFormat:
             return 0 if fix_target < center else 255
 
     def resetAllDirections(self):
-        self.format['lx'] = center
-        self.format['ly'] = center
-        self.format['rx'] = center
-        self.format['ry'] = center
-        self.L_stick_changed = True
-        self.R_stick_changed = True
+        state = self.state
+        state.lx = center
+        state.ly = center
+        state.rx = center
+        state.ry = center
+        state.l_changed = True
+        state.r_changed = True
         self.Hat_pos = Hat.CENTER
 
+    def encode(self, binary=False):
+        # bytes to send, including the line terminator (valid until the next encode)
+        # binary=True: a binary frame for firmware that accepted the handshake
+        if binary:
+            return self.encoder.encode_frame(self.state)
+        return self.encoder.encode(self.state)
+
     def convert2str(self):
-        str_format = ''
-        str_L = ''
-        str_R = ''
-        str_Hat = ''
-        space = ' '
-
-        # set bits array with stick flags
-        send_btn = int(self.format['btn']) << 2
-        # send_btn |= 0x3
-        if self.L_stick_changed:
-            send_btn |= 0x2
-            str_L = format(self.format['lx'], 'x') + space + format(self.format['ly'], 'x')
-        if self.R_stick_changed:
-            send_btn |= 0x1
-            str_R = format(self.format['rx'], 'x') + space + format(self.format['ry'], 'x')
-        # if self.Hat_changed:
-        str_Hat = str(int(self.format['hat']))
-        # format(send_btn, 'x') + \
-        # print(hex(send_btn))
-        str_format = format(send_btn, '#06x') + \
-                     (space + str_Hat) + \
-                     (space + str_L if self.L_stick_changed else '') + \
-                     (space + str_R if self.R_stick_changed else '')
-
-        self.L_stick_changed = False
-        self.R_stick_changed = False
-
-        # print(str_format)
-        return str_format  # the last space is not needed
+        # the same row as encode() as a str, without the line terminator
+        return self.encoder.encode_str(self.state)
+
+
+# Direction.of quantizes the angle and the magnification before looking up the cache.
+# x and y are 0-255, so a step of 0.1 degree / 0.001 hardly changes them.
+ANGLE_STEPS_PER_DEGREE = 10
+MAG_STEPS = 1000
+DIRECTION_CACHE_SIZE = 65536
 
 
 # This class handle L stick and R stick at any angles
 class Direction:
-    def __init__(self, stick, angle, magnification=1.0, isDegree=True, showName=None):
+    __slots__ = ('stick', 'angle_for_show', 'showName', 'mag', 'x', 'y', '_tilting')
 
-        self._logger = getLogger(__name__)
-        self._logger.addHandler(NullHandler())
-        self._logger.setLevel(DEBUG)
-        self._logger.propagate = True
+    _cache = {}
 
+    def __init__(self, stick, angle, magnification=1.0, isDegree=True, showName=None):
         self.stick = stick
         self.angle_for_show = angle
         self.showName = showName
+        self._tilting = None
         if magnification > 1.0:
             self.mag = 1.0
         elif magnification < 0:
@@ -212,7 +231,6 @@ class Direction:
             self.x = angle[0]
             self.y = angle[1]
             self.showName = '(' + str(self.x) + ', ' + str(self.y) + ')'
-            print('押し込み量', self.showName)
         else:
             angle = math.radians(angle) if isDegree else angle
 
@@ -222,6 +240,52 @@ class Direction:
             self.x = math.ceil(127.5 * math.cos(angle) * self.mag + 127.5)
             self.y = math.floor(127.5 * math.sin(angle) * self.mag + 127.5)
 
+    @classmethod
+    def of(cls, stick, angle, magnification=1.0):
+        """
+        Return an interned Direction for (stick, angle[deg], magnification).
+
+        The angle is rounded to 1 / ANGLE_STEPS_PER_DEGREE degree and the
+        magnification to 1 / MAG_STEPS, so stick-heavy code (mouse, recorded logs)
+        reuses the same objects instead of creating one per sample.
+        The returned object is shared: do not modify it.
+        """
+        key = (stick, round(angle * ANGLE_STEPS_PER_DEGREE), round(magnification * MAG_STEPS))
+        direction = cls._cache.get(key)
+        if direction is None:
+            if len(cls._cache) >= DIRECTION_CACHE_SIZE:
+                cls._cache.clear()
+            direction = cls(stick, key[1] / ANGLE_STEPS_PER_DEGREE, key[2] / MAG_STEPS)
+            cls._cache[key] = direction
+        return direction
+
+    @staticmethod
+    def stickValues(angles, magnifications=1.0, isDegree=True, out=None):
+        """
+        Convert arrays of angles / magnifications to stick values in one go.
+
+        The values are rounded like Direction and returned as sent to Joystick.c
+        (the same as SendFormat: y directs under).
+
+        Args:
+            angles: angles (array-like)
+            magnifications: magnifications (array-like or a scalar), clipped to 0-1
+            isDegree (bool): whether the angles are in degrees
+            out (np.ndarray | None): uint8 array of shape (..., 2) to write into
+
+        Returns:
+            np.ndarray: uint8 array of (x, y) pairs, shape angles.shape + (2,)
+        """
+        angles = np.asarray(angles, dtype=np.float64)
+        if isDegree:
+            angles = np.radians(angles)
+        mag = np.clip(np.asarray(magnifications, dtype=np.float64), 0.0, 1.0)
+        if out is None:
+            out = np.empty(np.broadcast(angles, mag).shape + (2,), dtype=np.uint8)
+        out[..., 0] = np.ceil(127.5 * np.cos(angles) * mag + 127.5)
+        out[..., 1] = 255 - np.floor(127.5 * np.sin(angles) * mag + 127.5)
+        return out
+
     def __repr__(self):
         if self.showName:
             return "<{}, {}>".format(self.stick, self.showName)
@@ -238,6 +302,9 @@ class Direction:
             return False
 
     def getTilting(self):
+        # computed once; the returned tuple is shared
+        if self._tilting is not None:
+            return self._tilting
         tilting = []
         if self.stick == Stick.LEFT:
             if self.x < center:
@@ -259,7 +326,8 @@ class Direction:
                 tilting.append(Tilt.R_DOWN)
             elif self.y > center - 1:
                 tilting.append(Tilt.R_UP)
-        return tilting
+        self._tilting = tuple(tilting)
+        return self._tilting
 
 
 # Left stick for ease of use
@@ -283,14 +351,17 @@ Direction.R_DOWN_LEFT = Direction(Stick.RIGHT, -135, showName='DOWN_LEFT')
 Direction.R_UP_LEFT = Direction(Stick.RIGHT, 135, showName='UP_LEFT')
 
 
+class ReportCounters(NamedTuple):
+    sent: int  # reports written to the serial port
+    suppressed: int  # reports not sent because the state was the same as the last one
+    merged: int  # state changes folded into another report inside transaction()
+
+
 # handles serial input to Joystick.c
 class KeyPress:
-    def __init__(self, ser):
+    def __init__(self, ser, suppress_redundant=True):
 
-        self._logger = getLogger(__name__)
-        self._logger.addHandler(NullHandler())
-        self._logger.setLevel(DEBUG)
-        self._logger.propagate = True
+        self._logger = logger
 
         self.q = queue.Queue()
         self.ser = ser
@@ -300,10 +371,17 @@ class KeyPress:
 
         self.pushing_to_show = None
         self.pushing = None
-        self.pushing2 = None
-        self._pushing = None
         self._chk_neutral = None
-        self.NEUTRAL = dict(self.format.format)
+
+        # skip reports that would not change the state on Joystick.c
+        self.suppress_redundant = suppress_redundant
+        self._last_values = None
+        self._last_write_count = None
+        self._batch_depth = 0
+        self._batch_pending = 0
+        self.sent = 0
+        self.suppressed = 0
+        self.merged = 0
 
         self.input_time_0 = time.perf_counter()
         self.input_time_1 = time.perf_counter()
@@ -311,7 +389,6 @@ class KeyPress:
         self.was_neutral = True
 
     def input(self, btns, ifPrint=True):
-        self._pushing = dict(self.format.format)
         if not isinstance(btns, list):
             btns = [btns]
 
@@ -319,37 +396,84 @@ class KeyPress:
             if not btn in btns:
                 btns.append(btn)
 
-        self.format.setButton([btn for btn in btns if type(btn) is Button])
-        self.format.setHat([btn for btn in btns if type(btn) is Hat])
-        self.format.setAnyDirection([btn for btn in btns if type(btn) is Direction])
-
-        self.ser.writeRow(self.format.convert2str())
+        buttons, hats, dirs = [], [], []
+        for btn in btns:
+            t = type(btn)
+            if t is Button:
+                buttons.append(btn)
+            elif t is Hat:
+                hats.append(btn)
+            elif t is Direction:
+                dirs.append(btn)
+        self.format.setButton(buttons)
+        self.format.setHat(hats)
+        self.format.setAnyDirection(dirs)
+
+        self._send()
         self.input_time_0 = time.perf_counter()
 
         # self._logger.debug(f": {list(map(str,self.format.format.values()))}")
 
     def inputEnd(self, btns, ifPrint=True, unset_hat=True):
         # self._logger.debug(f"input end: {btns}")
-        self.pushing2 = dict(self.format.format)
-
         self.ed = time.perf_counter()
         if not isinstance(btns, list):
             btns = [btns]
         # self._logger.debug(btns)
 
         # get tilting direction from angles
-        tilts = []
-        for dir in [btn for btn in btns if type(btn) is Direction]:
-            tiltings = dir.getTilting()
-            for tilting in tiltings:
-                tilts.append(tilting)
+        buttons, tilts = [], []
+        for btn in btns:
+            t = type(btn)
+            if t is Button:
+                buttons.append(btn)
+            elif t is Direction:
+                tilts.extend(btn.getTilting())
         # self._logger.debug(tilts)
 
-        self.format.unsetButton([btn for btn in btns if type(btn) is Button])
+        self.format.unsetButton(buttons)
         if unset_hat:
             self.format.unsetHat()
         self.format.unsetDirection(tilts)
-        self.ser.writeRow(self.format.convert2str())
+        self._send()
+
+    def _send(self):
+        if self._batch_depth:
+            self._batch_pending += 1
+            return
+
+        state = self.format.state
+        values = (int(state.btn), int(state.hat), state.lx, state.ly, state.rx, state.ry)
+        # any other write (mouse stick, 'end', another KeyPress, reconnection) may have
+        # changed the state on Joystick.c, so only compare while nobody else has written
+        write_count = getattr(self.ser, 'write_count', None)
+        if (self.suppress_redundant and values == self._last_values
+                and write_count is not None and write_count == self._last_write_count):
+            state.l_changed = False
+            state.r_changed = False
+            self.suppressed += 1
+            return
+
+        self.ser.writeEncoded(self.format.encode(getattr(self.ser, 'binary', False)))
+        self._last_values = values
+        self._last_write_count = getattr(self.ser, 'write_count', None)
+        self.sent += 1
+
+    @contextmanager
+    def transaction(self):
+        # apply several input/inputEnd calls and send only the resulting state once
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0 and self._batch_pending:
+                self.merged += self._batch_pending - 1
+                self._batch_pending = 0
+                self._send()
+
+    def counters(self):
+        return ReportCounters(self.sent, self.suppressed, self.merged)
 
     def hold(self, btns):
         if not isinstance(btns, list):
@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# PythonCommandの入力をマイコン側で再生する時刻表(MCUシーケンス)
+#
+# Sequenceや記録したスティックのログをバイナリの時刻表に変換し、マイコンに転送して再生させる。
+# 再生中はPC側のスケジューリングの影響を受けないので、タイミングが重要な入力を正確に再現できる。
+#
+# 転送の手順(改行はCRLF):
+#   PC : "seq_upload <バイト数> <CRC32(16進数8桁)>"
+#   MCU: "ready"
+#   PC : データをUPLOAD_CHUNKバイトずつ送る。MCUはチャンクごとに "ack <受け取った合計バイト数>" を返す
+#   MCU: "ok"(CRCが一致) / "ng <理由>"
+#   PC : "seq_play" で再生を始め、"end" で止める(McuCommandと同じ)
+#
+# 時刻表の形式(リトルエンディアン):
+#   ヘッダ: b"PCSQ", バージョン(u8), 予約(u8), 1tickの長さ[us](u16), イベント数(u16), 全体のtick数(u32)
+#   イベント: 前のイベントからのtick数(LEB128), 変化した値のマスク(u8), 変化した値
+#             マスクのビット0から順にbtn(u16), hat, lx, ly, rx, ry(u8)
+#   末尾: ヘッダからイベントまでのCRC32(u32)
+#
+# NOTE: 対応するファームウェアはこのリポジトリには含まれていない。
+#       McuEmulatorがファームウェアと同じ動作をするので、実機なしで確認できる。
+
+import math
+import struct
+import zlib
+from typing import Iterable, NamedTuple
+
+from loguru import logger
+
+from Commands.Keys import KeyPress
+from Commands.McuCommandBase import McuCommand
+from Commands.Sequencer import Sequence
+from Commands.SerialProtocol import ReportState, apply_report
+
+MAGIC = b"PCSQ"
+VERSION = 1
+DEFAULT_TICK_US = 1000
+MAX_PROGRAM_SIZE = 2048  # マイコンのRAMに置ける大きさ
+UPLOAD_CHUNK = 32
+
+_HEADER = struct.Struct("<4sBBHHI")
+_FIELDS = ("btn", "hat", "lx", "ly", "rx", "ry")
+_NEUTRAL = (0, 8, 128, 128, 128, 128)
+
+
+class McuUploadError(Exception):
+    pass
+
+
+class McuFrame(NamedTuple):
+    tick: int  # 開始からのtick数
+    values: tuple[int, int, int, int, int, int]  # (btn, hat, lx, ly, rx, ry)
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+class McuProgram:
+    """
+    マイコンで再生する時刻表
+
+    framesは開始からのtick数と、その時点で送る入力の全ての値。
+    """
+
+    def __init__(
+        self, frames: list[McuFrame], total_ticks: int, tick_us: int = DEFAULT_TICK_US
+    ):
+        self.frames = frames
+        self.total_ticks = total_ticks
+        self.tick_us = tick_us
+
+    @property
+    def duration(self) -> float:
+        return self.total_ticks * self.tick_us / 1e6
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def encode(self) -> bytes:
+        """
+        バイナリの時刻表に変換する。
+
+        Raises:
+            ValueError: MAX_PROGRAM_SIZEを超える場合
+        """
+        body = bytearray(
+            _HEADER.pack(
+                MAGIC, VERSION, 0, self.tick_us, len(self.frames), self.total_ticks
+            )
+        )
+        previous_tick = 0
+        previous = _NEUTRAL
+        for frame in self.frames:
+            mask = 0
+            fields = bytearray()
+            for bit, (value, before) in enumerate(zip(frame.values, previous)):
+                if value != before:
+                    mask |= 1 << bit
+                    fields += struct.pack("<H", value) if bit == 0 else bytes((value,))
+            body += _varint(frame.tick - previous_tick)
+            body.append(mask)
+            body += fields
+            previous_tick = frame.tick
+            previous = frame.values
+        body += struct.pack("<I", zlib.crc32(body))
+        if len(body) > MAX_PROGRAM_SIZE:
+            raise ValueError(
+                f"MCU sequence is too large: {len(body)} bytes (max {MAX_PROGRAM_SIZE})"
+            )
+        return bytes(body)
+
+    @classmethod
+    def decode(cls, data: bytes) -> "McuProgram":
+        if len(data) < _HEADER.size + 4 or data[:4] != MAGIC:
+            raise ValueError("Not an MCU sequence")
+        (crc,) = struct.unpack_from("<I", data, len(data) - 4)
+        if zlib.crc32(data[:-4]) != crc:
+            raise ValueError("MCU sequence CRC mismatch")
+        _, version, _, tick_us, count, total_ticks = _HEADER.unpack_from(data)
+        if version != VERSION:
+            raise ValueError(f"Unsupported MCU sequence version: {version}")
+
+        frames = []
+        pos = _HEADER.size
+        tick = 0
+        values = list(_NEUTRAL)
+        for _ in range(count):
+            delta, pos = _read_varint(data, pos)
+            tick += delta
+            mask = data[pos]
+            pos += 1
+            for bit in range(len(_FIELDS)):
+                if mask & (1 << bit):
+                    if bit == 0:
+                        (values[0],) = struct.unpack_from("<H", data, pos)
+                        pos += 2
+                    else:
+                        values[bit] = data[pos]
+                        pos += 1
+            frames.append(McuFrame(tick, tuple(values)))
+        return cls(frames, total_ticks, tick_us)
+
+
+class _ReportRecorder:
+    # KeyPressの送信先の代わりに、送られた行をマイコン側の状態として記録する
+    def __init__(self):
+        self.state = ReportState()
+        self.values: list[tuple] = []
+
+    def _apply(self, line) -> None:
+        if apply_report(self.state, line):
+            s = self.state
+            self.values.append((int(s.btn), int(s.hat), s.lx, s.ly, s.rx, s.ry))
+
+    def writeEncoded(self, data, is_show=False, send_at=None, coalesce=False) -> None:
+        self._apply(bytes(data))
+
+    def writeRow(self, row, is_show=False, send_at=None, coalesce=False) -> None:
+        self._apply(row)
+
+
+def _ticks(seconds: float, tick_us: int) -> int:
+    return int(round(seconds * 1e6 / tick_us))
+
+
+def compile_sequence(sequence: Sequence, tick_us: int = DEFAULT_TICK_US) -> McuProgram:
+    """
+    Sequenceをマイコンで再生する時刻表に変換する。
+
+    KeyPressと同じ処理で各入力の送信内容を求めるので、PC側で実行した場合と同じ入力になる。
+    時刻は開始からの絶対時刻をtickに丸めるので、丸めの誤差は積み重ならない。
+
+    Args:
+        sequence (Sequence): 変換するシーケンス
+        tick_us (int): 1tickの長さ[us]
+
+    Returns:
+        McuProgram: 時刻表
+    """
+    recorder = _ReportRecorder()
+    keys = KeyPress(recorder)
+    frames = []
+    for event in sequence.events:
+        before = len(recorder.values)
+        getattr(keys, event.action)(event.buttons)
+        tick = _ticks(event.at, tick_us)
+        frames.extend(McuFrame(tick, values) for values in recorder.values[before:])
+    return McuProgram(frames, _ticks(sequence.duration, tick_us), tick_us)
+
+
+def compile_playrec(
+    rows: Iterable[list[float]], tick_us: int = DEFAULT_TICK_US
+) -> McuProgram:
+    """
+    記録したスティックのログ(PlayRecで再生する、角度・倒す量・時間の行)を時刻表に変換する。
+
+    Args:
+        rows (Iterable[list[float]]): [angle, r, duration]の並び
+        tick_us (int): 1tickの長さ[us]
+
+    Returns:
+        McuProgram: 時刻表(最後にLスティックを中央に戻す)
+    """
+    recorder = _ReportRecorder()
+    frames = []
+    elapsed = 0.0
+    for angle, r, duration in rows:
+        x = int(128 + r * 127.5 * math.cos(math.radians(angle)))
+        y = int(128 - r * 127.5 * math.sin(math.radians(angle)))
+        recorder.writeRow(f"2 8 {x:x} {y:x}")
+        frames.append(McuFrame(_ticks(elapsed, tick_us), recorder.values[-1]))
+        elapsed += duration
+    recorder.writeRow("2 8 80 80")
+    frames.append(McuFrame(_ticks(elapsed, tick_us), recorder.values[-1]))
+    return McuProgram(frames, _ticks(elapsed, tick_us), tick_us)
+
+
+class McuUploader:
+    """
+    時刻表をマイコンに転送する
+
+    portはpyserialのSerialと同じwrite/read_untilを持つもの(Sender.serやMcuEmulator)。
+    """
+
+    def __init__(self, port, timeout: float = 2.0):
+        self.port = port
+        self.timeout = timeout
+
+    def _readline(self) -> str:
+        line = self.port.read_until(b"\n")
+        if not line:
+            raise McuUploadError("MCU did not respond")
+        return line.decode("ascii", "replace").strip()
+
+    def upload(self, program: McuProgram) -> int:
+        """
+        時刻表を転送する。
+
+        Returns:
+            int: 転送したバイト数
+
+        Raises:
+            McuUploadError: マイコンが応答しない、またはデータが壊れていた場合
+        """
+        data = program.encode()
+        previous_timeout = getattr(self.port, "timeout", None)
+        self.port.timeout = self.timeout
+        try:
+            header = f"seq_upload {len(data)} {zlib.crc32(data):08x}\r\n"
+            self.port.write(header.encode("ascii"))
+            reply = self._readline()
+            if reply != "ready":
+                raise McuUploadError(f"Unexpected reply to seq_upload: {reply!r}")
+            for offset in range(0, len(data), UPLOAD_CHUNK):
+                chunk = data[offset : offset + UPLOAD_CHUNK]
+                self.port.write(chunk)
+                reply = self._readline()
+                if reply != f"ack {offset + len(chunk)}":
+                    raise McuUploadError(f"Unexpected ack at {offset}: {reply!r}")
+            reply = self._readline()
+            if reply != "ok":
+                raise McuUploadError(f"Upload failed: {reply!r}")
+        finally:
+            self.port.timeout = previous_timeout
+        return len(data)
+
+
+class McuEmulator:
+    """
+    MCUシーケンスに対応したファームウェアの動作を再現する
+
+    pyserialのSerialの代わりにSender.serやMcuUploaderに渡せる。
+    通常の入力の行はstateに反映してreportsに残し、転送された時刻表はseq_playで再生する。
+    再生は仮想の時刻で行い、各tickで出力する入力をplaybackに残す。
+    """
+
+    def __init__(self):
+        self.state = ReportState()
+        self.reports: list[tuple] = []
+        self.program: McuProgram | None = None
+        self.playback: list[tuple[float, tuple]] = []
+        self.timeout = None
+        self._line = bytearray()
+        self._responses = bytearray()
+        self._upload: bytearray | None = None
+        self._upload_size = 0
+        self._upload_crc = 0
+
+    def isOpen(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        pass
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        pos = 0
+        while pos < len(data):
+            if self._upload is not None:
+                pos = self._receive(data, pos)
+                continue
+            end = data.find(b"\n", pos)
+            if end < 0:
+                self._line += data[pos:]
+                break
+            self._line += data[pos:end]
+            pos = end + 1
+            line = bytes(self._line).strip().decode("ascii", "replace")
+            self._line.clear()
+            self._command(line)
+        return len(data)
+
+    def read_until(self, expected: bytes = b"\n", size: int | None = None) -> bytes:
+        end = self._responses.find(expected)
+        if end < 0:
+            return b""
+        line = bytes(self._responses[: end + len(expected)])
+        del self._responses[: end + len(expected)]
+        return line
+
+    def _reply(self, line: str) -> None:
+        self._responses += (line + "\r\n").encode("ascii")
+
+    def _command(self, line: str) -> None:
+        tokens = line.split()
+        if not tokens:
+            return
+        if tokens[0] == "seq_upload" and len(tokens) == 3:
+            self._upload = bytearray()
+            self._upload_size = int(tokens[1])
+            self._upload_crc = int(tokens[2], 16)
+            self._reply("ready")
+        elif tokens[0] == "seq_play":
+            self.play()
+        elif tokens[0] == "end":
+            pass
+        elif apply_report(self.state, line):
+            s = self.state
+            self.reports.append((int(s.btn), int(s.hat), s.lx, s.ly, s.rx, s.ry))
+
+    def _receive(self, data: bytes, pos: int) -> int:
+        upload = self._upload
+        take = min(
+            len(data) - pos,
+            self._upload_size - len(upload),
+            UPLOAD_CHUNK - len(upload) % UPLOAD_CHUNK,
+        )
+        upload += data[pos : pos + take]
+        pos += take
+        if len(upload) % UPLOAD_CHUNK == 0 or len(upload) == self._upload_size:
+            self._reply(f"ack {len(upload)}")
+        if len(upload) == self._upload_size:
+            self._upload = None
+            if zlib.crc32(upload) != self._upload_crc:
+                self._reply("ng crc")
+                return pos
+            try:
+                self.program = McuProgram.decode(bytes(upload))
+            except ValueError as e:
+                self._reply(f"ng {e}")
+                return pos
+            self._reply("ok")
+        return pos
+
+    def play(self) -> list[tuple[float, tuple]]:
+        """
+        転送された時刻表を再生する。
+
+        Returns:
+            list[tuple[float, tuple]]: (開始からの秒数, (btn, hat, lx, ly, rx, ry))
+        """
+        self.playback = []
+        if self.program is None:
+            return self.playback
+        tick_s = self.program.tick_us / 1e6
+        for frame in self.program.frames:
+            self.playback.append((frame.tick * tick_s, frame.values))
+            btn, hat, lx, ly, rx, ry = frame.values
+            self.state.btn, self.state.hat = btn, hat
+            self.state.lx, self.state.ly, self.state.rx, self.state.ry = lx, ly, rx, ry
+        return self.playback
+
+
+class McuSequenceCommand(McuCommand):
+    """
+    Sequenceをマイコンに転送して再生するMcuCommand
+
+    サブクラスでsequence()を実装する。変換や転送に失敗した場合は再生を始めず、startはFalseを返す。
+    """
+
+    def __init__(self, sync_name="seq_play"):
+        super().__init__(sync_name)
+        self.program = None
+
+    def sequence(self) -> Sequence:
+        # CommandBaseは抽象クラスとして扱われないので、未実装はstartで報告する
+        return None
+
+    def start(self, ser, postProcess):
+        try:
+            if self.program is None:
+                sequence = self.sequence()
+                if sequence is None:
+                    raise ValueError(
+                        f"{type(self).__name__}.sequence() did not return a Sequence"
+                    )
+                self.program = compile_sequence(sequence)
+            # 大きすぎる時刻表はマイコンとのやり取りを始める前に弾く
+            self.program.encode()
+            with ser.exclusive() as port:
+                McuUploader(port).upload(self.program)
+        except (McuUploadError, ValueError) as e:
+            # シーケンスに対応していないファームウェアや、RAMに収まらない時刻表など
+            print(f"Failed to upload the sequence to the MCU: {e}")
+            logger.error(f"Failed to upload the sequence to the MCU: {e}")
+            return False
+        super().start(ser, postProcess)
+        return True
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 from __future__ import annotations
-from typing import Optional
+from typing import Iterable, Optional
 
 import cv2
 import threading
@@ -14,14 +14,24 @@ import time
 from deprecated import deprecated
 from loguru import logger
 from os import path
-import tkinter as tk
-import tkinter.ttk as ttk
+
+try:
+    import tkinter as tk
+    import tkinter.ttk as ttk
+except ImportError:
+    # headlessで実行する場合はtkinterがなくてもよい
+    tk = ttk = None
 
 import Settings
+from TemplateCache import template_cache
+from TemplateMatcher import MatchJob, TemplateMatch, TemplateSpec, template_matcher
 from LineNotify import Line_Notify
 from DiscordNotify import Discord_Notify
 from Commands import CommandBase
 from .Keys import Button, Direction, KeyPress
+from .Scheduler import HybridScheduler
+from .Sequencer import Sequence, SequenceReport, Sequencer
+from .Trajectory import PlaybackReport, Trajectory, TrajectoryPlayer
 
 import traceback
 
@@ -42,6 +52,10 @@ class PythonCommand(CommandBase.Command):
         self.alive: bool = True
         self.postProcess = None
         self.message_dialogue = None
+        # headlessで実行する場合にダイアログの代わりに答えを返すもの(Headless.DialogueAnswers)
+        self.dialogue_answers = None
+        # wait/short_waitで使う。spin_marginで空回りする時間を調整できる
+        self.scheduler = HybridScheduler()
 
         self.traceback_limit = 5
 
@@ -81,6 +95,14 @@ class PythonCommand(CommandBase.Command):
             self.finish()
             self.keys.end()
             self.alive = False
+        finally:
+            summary = self.scheduler.summary()
+            if summary.count:
+                logger.debug(
+                    f"wait overshoot: mean {summary.mean_us:.0f}us "
+                    f"p99 {summary.p99_us:.0f}us max {summary.max_us:.0f}us "
+                    f"spin {summary.spin_ratio:.1%} ({self.scheduler.histogram})"
+                )
 
     def start(self, ser, postProcess=None):
         self.alive = True
@@ -130,21 +152,43 @@ class PythonCommand(CommandBase.Command):
 
     # do nothing at wait time(s)
     def short_wait(self, wait):
-        current_time = time.perf_counter()
-        while time.perf_counter() < current_time + wait:
-            pass
+        self.scheduler.sleep(wait)
         self.checkIfAlive()
 
     # do nothing at wait time(s)
+    # sleeps until shortly before the deadline and spins only for the rest.
+    # when called right after the previous wait, it is measured from the previous
+    # deadline so that the time to send inputs does not pile up.
     def wait(self, wait):
-        if float(wait) > 0.1:
-            sleep(wait)
-        else:
-            current_time = time.perf_counter()
-            while time.perf_counter() < current_time + wait:
-                pass
+        self.scheduler.sleep(float(wait), chain=True)
         self.checkIfAlive()
 
+    # do nothing until the given time.perf_counter() value
+    def wait_until(self, deadline):
+        self.scheduler.sleep_until(deadline)
+        self.checkIfAlive()
+
+    # run a Sequence of press/hold/wait steps on an absolute timeline
+    def runSequence(self, sequence: Sequence) -> SequenceReport:
+        report = Sequencer(self.keys, self.scheduler, self.checkIfAlive).run(sequence)
+        logger.debug(f"sequence: {report}")
+        return report
+
+    def playTrajectory(
+        self, trajectory: Trajectory | Iterable[Trajectory], rate: float | None = None
+    ) -> PlaybackReport:
+        """
+        記録したスティックの軌跡を再生する。
+
+        Args:
+            trajectory (Trajectory | Iterable[Trajectory]): 軌跡(Trajectory.loadやTrajectory.chunksの結果)
+            rate (float | None): 指定した場合は1秒あたりrate回の送信に揃える
+        """
+        player = TrajectoryPlayer(self.keys.ser, self.scheduler, self.checkIfAlive, rate)
+        report = player.play(trajectory)
+        logger.debug(f"trajectory: {report}")
+        return report
+
     def checkIfAlive(self):
         if not self.alive:
             self.keys.end()
@@ -164,6 +208,8 @@ class PythonCommand(CommandBase.Command):
     def dialogue(
         self, title: str, message: int | str | list, need: type = list
     ) -> list | dict:
+        if self.dialogue_answers is not None:
+            return self.dialogue_answers.answer(title, message, need)
         self.message_dialogue = tk.Toplevel()
         ret = PokeConDialogue(self.message_dialogue, title, message).ret_value(need)
         self.message_dialogue = None
@@ -172,6 +218,8 @@ class PythonCommand(CommandBase.Command):
     def dialogue6widget(
         self, title: str, dialogue_list: list, need: type = list
     ) -> list | dict:
+        if self.dialogue_answers is not None:
+            return self.dialogue_answers.answer(title, dialogue_list, need, mode=1)
         self.message_dialogue = tk.Toplevel()
         ret = PokeConDialogue(
             self.message_dialogue, title, dialogue_list, mode=1
@@ -183,49 +231,54 @@ class PythonCommand(CommandBase.Command):
 
     # Controls the system time and get every-other-day bonus without any punishments
     def timeLeap(self, is_go_back=True):
-        self.press(Button.HOME, wait=1)
-        self.press(Direction.DOWN)
-        self.press(Direction.RIGHT)
-        self.press(Direction.RIGHT)
-        self.press(Direction.RIGHT)
-        self.press(Direction.RIGHT)
-        self.press(Direction.RIGHT)
-        self.press(Button.A, wait=1.5)  # System Settings
-        self.press(Direction.DOWN, duration=2, wait=0.5)
-
-        self.press(Button.A, wait=0.3)  # System Settings > System
-        self.press(Direction.DOWN)
-        self.press(Direction.DOWN)
-        self.press(Direction.DOWN)
-        self.press(Direction.DOWN, wait=0.3)
-        self.press(Button.A, wait=0.2)  # Date and Time
-        self.press(Direction.DOWN, duration=0.7, wait=0.2)
+        self.runSequence(self.timeLeapSequence(is_go_back))
+
+    def timeLeapSequence(self, is_go_back=True) -> Sequence:
+        seq = Sequence()
+        seq.press(Button.HOME, wait=1)
+        seq.press(Direction.DOWN)
+        seq.press(Direction.RIGHT)
+        seq.press(Direction.RIGHT)
+        seq.press(Direction.RIGHT)
+        seq.press(Direction.RIGHT)
+        seq.press(Direction.RIGHT)
+        seq.press(Button.A, wait=1.5)  # System Settings
+        seq.press(Direction.DOWN, duration=2, wait=0.5)
+
+        seq.press(Button.A, wait=0.3)  # System Settings > System
+        seq.press(Direction.DOWN)
+        seq.press(Direction.DOWN)
+        seq.press(Direction.DOWN)
+        seq.press(Direction.DOWN, wait=0.3)
+        seq.press(Button.A, wait=0.2)  # Date and Time
+        seq.press(Direction.DOWN, duration=0.7, wait=0.2)
 
         # increment and decrement
         if is_go_back:
-            self.press(Button.A, wait=0.2)
-            self.press(Direction.UP, wait=0.2)  # Increment a year
-            self.press(Direction.RIGHT, duration=1.5)
-            self.press(Button.A, wait=0.5)
+            seq.press(Button.A, wait=0.2)
+            seq.press(Direction.UP, wait=0.2)  # Increment a year
+            seq.press(Direction.RIGHT, duration=1.5)
+            seq.press(Button.A, wait=0.5)
 
-            self.press(Button.A, wait=0.2)
-            self.press(Direction.LEFT, duration=1.5)
-            self.press(Direction.DOWN, wait=0.2)  # Decrement a year
-            self.press(Direction.RIGHT, duration=1.5)
-            self.press(Button.A, wait=0.5)
+            seq.press(Button.A, wait=0.2)
+            seq.press(Direction.LEFT, duration=1.5)
+            seq.press(Direction.DOWN, wait=0.2)  # Decrement a year
+            seq.press(Direction.RIGHT, duration=1.5)
+            seq.press(Button.A, wait=0.5)
 
         # use only increment
         # for use of faster time leap
         else:
-            self.press(Button.A, wait=0.2)
-            self.press(Direction.RIGHT)
-            self.press(Direction.RIGHT)
-            self.press(Direction.UP, wait=0.2)  # increment a day
-            self.press(Direction.RIGHT, duration=1)
-            self.press(Button.A, wait=0.5)
+            seq.press(Button.A, wait=0.2)
+            seq.press(Direction.RIGHT)
+            seq.press(Direction.RIGHT)
+            seq.press(Direction.UP, wait=0.2)  # increment a day
+            seq.press(Direction.RIGHT, duration=1)
+            seq.press(Button.A, wait=0.5)
 
-        self.press(Button.HOME, wait=1)
-        self.press(Button.HOME, wait=1)
+        seq.press(Button.HOME, wait=1)
+        seq.press(Button.HOME, wait=1)
+        return seq
 
     @deprecated(reason="Use discord instead")
     def LINE_text(self, txt="", token="token"):
@@ -301,6 +354,8 @@ class PythonCommand(CommandBase.Command):
                     + str(Settings.GuiSettings().com_port.get())
                     + " connected successfully"
                 )
+                if Settings.GuiSettings().serial_protocol.get() == "auto":
+                    self.keys.ser.negotiate()
                 # self.keyPress = None (ここでNoneはNGなはず)
 
 
@@ -558,7 +613,26 @@ def _get_template_filespec(template_path: str) -> str:
         return path.join(TEMPLATE_PATH, template_path)
 
 
+def _template_key(template_path, use_gray, crop, mask_path=None) -> tuple:
+    # 学習したROIはcrop内の座標なので、cropもキーに含める
+    return (
+        _get_template_filespec(template_path),
+        use_gray,
+        mask_path,
+        tuple(crop) if len(crop) == 4 else None,
+    )
+
+
 class ImageProcPythonCommand(PythonCommand):
+    # テンプレートマッチングの精度と速度の方針("exact", "balanced", "fast")
+    # balancedは学習したROIと縮小画像で探索範囲を絞る。一致判定は従来とほぼ変わらない
+    # (閾値から遠い場合の相関値は-1.0になる。show_valueを指定した場合は原寸の相関値を求め、
+    # isContainTemplate_maxは常にexactで探索する)
+    match_policy = "balanced"
+    # テンプレートマッチングのバックエンド("opencv", "opencv-threads", "tiled", "cuda")
+    # Noneの場合は共通の設定(template_matcher.backend)を使います
+    match_backend = None
+
     def __init__(self, cam, gui=None):
         super(ImageProcPythonCommand, self).__init__()
 
@@ -573,10 +647,6 @@ class ImageProcPythonCommand(PythonCommand):
 
         self.gui = gui
 
-        self.gsrc = cv2.cuda_GpuMat()
-        self.gtmpl = cv2.cuda_GpuMat()
-        self.gresult = cv2.cuda_GpuMat()
-
     def __post_init__(self):
         self.Line = Line_Notify(self.camera)
         self.Discord = Discord_Notify(camera=self.camera)
@@ -597,29 +667,35 @@ class ImageProcPythonCommand(PythonCommand):
         crop=[],
         mask_path=None,
     ):
-        src = self.camera.readFrame()
-        src = cv2.cvtColor(src, cv2.COLOR_BGR2GRAY) if use_gray else src
-
-        if len(crop) == 4:
-            src = src[crop[1] : crop[3], crop[0] : crop[2]]
+        # 必要な範囲だけを切り出してから変換する(フレーム全体のコピーはしない)
+        src = self.camera.readFrame(
+            copy=False, roi=crop if len(crop) == 4 else None, gray=use_gray
+        )
 
-        template = cv2.imread(
+        # テンプレート画像とmask用画像はキャッシュから取得する
+        template, mask = template_cache.load(
             _get_template_filespec(template_path),
-            cv2.IMREAD_GRAYSCALE if use_gray else cv2.IMREAD_COLOR,
+            use_gray,
+            None if mask_path is None else _get_template_filespec(mask_path),
         )
-
-        # mask用画像読み込み
-        if mask_path == None:
-            mask = None
+        if mask_path is None:
             method = cv2.TM_CCOEFF_NORMED
         else:
-            mask = cv2.imread(_get_template_filespec(mask_path), 0)
             method = cv2.TM_CCORR_NORMED
 
         w, h = template.shape[1], template.shape[0]
 
-        res = cv2.matchTemplate(src, template, method, mask)
-        _, max_val, _, max_loc = cv2.minMaxLoc(res)
+        max_val, max_loc, _ = template_matcher.match(
+            src,
+            template,
+            threshold,
+            method,
+            mask,
+            self.match_policy,
+            _template_key(template_path, use_gray, crop, mask_path),
+            self.match_backend,
+            exact_score=show_value,
+        )
 
         if show_value:
             print(template_path + " ZNCC value: " + str(max_val))
@@ -644,6 +720,7 @@ class ImageProcPythonCommand(PythonCommand):
 
     # 現在のスクリーンショットと指定した複数の画像のテンプレートマッチングを行います
     # 相関値が最も大きい値となった画像のインデックス、各画像のテンプレートマッチングの閾値、閾値判定結果を返します。
+    # 相関値を比べるので、match_policyによらず原寸で全体を探索します
     # 色の違いを考慮しないのであればパフォーマンスの点からuse_grayをTrueにしてグレースケール画像を使うことを推奨します
     def isContainTemplate_max(
         self,
@@ -656,91 +733,153 @@ class ImageProcPythonCommand(PythonCommand):
         ms=2000,
         crop=[],
     ):
-        src = self.camera.readFrame()
-        src = cv2.cvtColor(src, cv2.COLOR_BGR2GRAY) if use_gray else src
-
-        if len(crop) == 4:
-            src = src[crop[1] : crop[3], crop[0] : crop[2]]
-
-        max_val_list = []
-        judge_threshold_list = []
-        for template_path in template_path_list:
-            template = cv2.imread(
-                _get_template_filespec(template_path),
-                cv2.IMREAD_GRAYSCALE if use_gray else cv2.IMREAD_COLOR,
-            )
-            w, h = template.shape[1], template.shape[0]
+        results = self.matchTemplates(
+            [
+                TemplateSpec(template_path, threshold)
+                for template_path in template_path_list
+            ],
+            use_gray=use_gray,
+            show_value=show_value,
+            show_position=show_position,
+            show_only_true_rect=show_only_true_rect,
+            ms=ms,
+            crop=crop,
+            policy="exact",
+        )
+        max_val_list = [result.max_val for result in results]
+        judge_threshold_list = [result.passed for result in results]
+        return np.argmax(max_val_list), max_val_list, judge_threshold_list
 
-            method = cv2.TM_CCOEFF_NORMED
-            res = cv2.matchTemplate(src, template, method)
-            _, max_val, _, max_loc = cv2.minMaxLoc(res)
+    # 現在のスクリーンショット1枚に対して複数の画像のテンプレートマッチングをまとめて行います
+    # フレームの取得・切り出し・グレースケール変換は1回だけ行います
+    # specsには画像パス、(画像パス, 閾値[, mask画像パス])、TemplateSpecを指定できます
+    # 戻り値はspecsと同じ順序のTemplateMatch(画像パス, 相関値, 位置, 大きさ, 判定結果)のリストです
+    # parallel=Trueの場合はテンプレートごとに並列に処理します
+    # policyを指定するとmatch_policyの代わりに使います
+    def matchTemplates(
+        self,
+        specs,
+        use_gray=True,
+        show_value=False,
+        show_position=True,
+        show_only_true_rect=True,
+        ms=2000,
+        crop=[],
+        parallel=False,
+        policy=None,
+    ):
+        specs = [
+            TemplateSpec(spec) if isinstance(spec, str) else TemplateSpec(*spec)
+            for spec in specs
+        ]
+        src = self.camera.readFrame(
+            copy=False, roi=crop if len(crop) == 4 else None, gray=use_gray
+        )
+
+        jobs = []
+        for spec in specs:
+            template, mask = template_cache.load(
+                _get_template_filespec(spec.template_path),
+                use_gray,
+                None
+                if spec.mask_path is None
+                else _get_template_filespec(spec.mask_path),
+            )
+            jobs.append(
+                MatchJob(
+                    template,
+                    spec.threshold,
+                    cv2.TM_CCOEFF_NORMED
+                    if spec.mask_path is None
+                    else cv2.TM_CCORR_NORMED,
+                    mask,
+                    _template_key(spec.template_path, use_gray, crop, spec.mask_path),
+                )
+            )
 
+        results = []
+        for spec, (max_val, max_loc, size) in zip(
+            specs,
+            template_matcher.match_many(
+                src,
+                jobs,
+                policy or self.match_policy,
+                parallel,
+                self.match_backend,
+                exact_score=show_value,
+            ),
+        ):
+            passed = max_val >= spec.threshold
             if show_value:
-                print(template_path + " ZNCC value: " + str(max_val))
-
-            top_left = max_loc
-            bottom_right = (top_left[0] + w + 1, top_left[1] + h + 1)
-            tag = str(time.perf_counter()) + str(random.random())
-            max_val_list.append(max_val)
-            judge_threshold_list.append(max_val >= threshold)
-
-            if max_val >= threshold:
-                if self.gui is not None and show_position:
-                    # self.gui.delete("ImageRecRect")
-                    self.gui.ImgRect(
-                        *top_left, *bottom_right, outline="blue", tag=tag, ms=ms
-                    )
-            else:
-                if self.gui is not None and show_position and not show_only_true_rect:
-                    # self.gui.delete("ImageRecRect")
-                    self.gui.ImgRect(
-                        *top_left, *bottom_right, outline="red", tag=tag, ms=ms
-                    )
+                print(spec.template_path + " ZNCC value: " + str(max_val))
+            self._showMatchRect(
+                max_loc, size, passed, show_position, show_only_true_rect, ms
+            )
+            results.append(
+                TemplateMatch(spec.template_path, max_val, max_loc, size, passed)
+            )
+        return results
 
-        return np.argmax(max_val_list), max_val_list, judge_threshold_list
+    def _showMatchRect(
+        self, top_left, size, passed, show_position, show_only_true_rect, ms
+    ):
+        if self.gui is None or not show_position:
+            return
+        if not passed and show_only_true_rect:
+            return
+        bottom_right = (top_left[0] + size[0] + 1, top_left[1] + size[1] + 1)
+        tag = str(time.perf_counter()) + str(random.random())
+        self.gui.ImgRect(
+            *top_left,
+            *bottom_right,
+            outline="blue" if passed else "red",
+            tag=tag,
+            ms=ms,
+        )
 
-    try:
+    # CUDAバックエンドでテンプレートマッチングを行います
+    # CUDAが使えない環境ではopencvバックエンドで代用します
+    def isContainTemplateGPU(
+        self,
+        template_path,
+        threshold=0.7,
+        use_gray=True,
+        show_value=False,
+        not_show_false=True,
+    ):
+        src = self.camera.readFrame(copy=False, gray=use_gray)
 
-        def isContainTemplateGPU(
-            self,
-            template_path,
-            threshold=0.7,
-            use_gray=True,
-            show_value=False,
-            not_show_false=True,
-        ):
-            src = self.camera.readFrame()
-            src = cv2.cvtColor(src, cv2.COLOR_BGR2GRAY) if use_gray else src
+        template, _ = template_cache.load(
+            _get_template_filespec(template_path), use_gray
+        )
 
-            self.gsrc.upload(src)
+        max_val, _, _ = template_matcher.match(
+            src, template, threshold, policy="exact", backend="cuda"
+        )
 
-            template = cv2.imread(
-                _get_template_filespec(template_path),
-                cv2.IMREAD_GRAYSCALE if use_gray else cv2.IMREAD_COLOR,
-            )
-            self.gtmpl.upload(template)
+        if show_value:
+            print(template_path + " ZNCC value: " + str(max_val))
 
-            method = cv2.TM_CCOEFF_NORMED
-            matcher = cv2.cuda.createTemplateMatching(cv2.CV_8UC1, method)
-            gresult = matcher.match(self.gsrc, self.gtmpl)
-            resultg = gresult.download()
-            _, max_val, _, max_loc = cv2.minMaxLoc(resultg)
+        return max_val >= threshold
 
-            if show_value:
-                print(template_path + " ZNCC value: " + str(max_val))
-
-            if max_val >= threshold:
-                # if use_gray:
-                #     src = cv2.cvtColor(src, cv2.COLOR_GRAY2BGR)
-                #
-                # top_left = max_loc
-                # bottom_right = (top_left[0] + w, top_left[1] + h)
-                # cv2.rectangle(src, top_left, bottom_right, (255, 0, 255), 2)
-                return True
-            else:
-                return False
-    except ModuleNotFoundError:
-        pass
+    # テンプレートの探索範囲[x1, y1, x2, y2]を指定します(cropを指定する場合はcrop内の座標)
+    # 表示位置が決まっている画像を毎回フレーム全体から探さずに済みます
+    # 指定範囲で見つからない場合は、match_policyに従って全体を探索します
+    def setTemplateRoi(self, template_path, roi, use_gray=True, crop=[], mask_path=None):
+        template_matcher.setSearchRoi(
+            _template_key(template_path, use_gray, crop, mask_path), roi
+        )
+
+    # 指定した通し番号より新しいフレームが届くまで待ってから取得します
+    # after_seqがNoneの場合は待たずに最新フレームを返します
+    # 戻り値は(フレーム, 通し番号)です。同じフレームを何度も判定しないために使います
+    def readNextFrame(self, after_seq=None, roi=None, gray=False, timeout=1.0):
+        if after_seq is not None:
+            if self.camera.waitNextFrame(after_seq, timeout) is None:
+                logger.warning("No new frame arrived within timeout")
+            self.checkIfAlive()
+        frame, info = self.camera.readFrameWithInfo(copy=False, roi=roi, gray=gray)
+        return frame, info.seq
 
     # Get interframe difference binarized image
     # フレーム間差分により2値化された画像を取得
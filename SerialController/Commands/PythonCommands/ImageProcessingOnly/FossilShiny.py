@@ -3,6 +3,7 @@
 
 from Commands.Keys import Button, Direction
 from Commands.PythonCommandBase import ImageProcPythonCommand
+from Commands.Sequencer import Sequence
 
 
 class Fossil_shiny(ImageProcPythonCommand):
@@ -15,32 +16,36 @@ class Fossil_shiny(ImageProcPythonCommand):
     '''
 
     def fossil_loop(self, head=0, body=0):
+        # 入力だけの部分は時刻表にして、繰り返してもずれないようにする
+        revive = Sequence()
+        revive.press(Button.A, wait=0.75)
+        revive.press(Button.A, wait=0.75)
+        if head == 1:
+            revive.press(Direction.DOWN, duration=0.07, wait=0.75)  # select fossil
+        revive.press(Button.A, wait=0.75)  # determine fossil
+        if body == 1:
+            revive.press(Direction.DOWN, duration=0.07, wait=0.75)  # select fossil
+        revive.press(Button.A, wait=0.75)  # determine fossil
+        revive.press(Button.A, wait=0.75)  # select "それでよければ"
+
+        # open up pokemon box
+        open_box = Sequence()
+        open_box.press(Button.X, wait=1)
+        open_box.press(Direction.RIGHT, duration=0.07, wait=1)
+        open_box.press(Button.A, wait=2)
+        open_box.press(Button.R, wait=2)
+
         # start = time.time()
         i = 0
         while True:
             for j in range(30):
                 print(str(30 * i + j + 1) + "体目 ({}/30 of a box)".format(j + 1))
-                self.press(Button.A, wait=0.75)
-                self.press(Button.A, wait=0.75)
-
-                if head == 1:
-                    self.press(Direction.DOWN, duration=0.07, wait=0.75)  # select fossil
-                self.press(Button.A, wait=0.75)  # determine fossil
-
-                if body == 1:
-                    self.press(Direction.DOWN, duration=0.07, wait=0.75)  # select fossil
-                self.press(Button.A, wait=0.75)  # determine fossil
-
-                self.press(Button.A, wait=0.75)  # select "それでよければ"
+                self.runSequence(revive)
                 while not self.isContainTemplate('Network_Offline.png', 0.8):
                     self.press(Button.B, wait=0.5)
                 self.wait(1.0)
 
-            # open up pokemon box
-            self.press(Button.X, wait=1)
-            self.press(Direction.RIGHT, duration=0.07, wait=1)
-            self.press(Button.A, wait=2)
-            self.press(Button.R, wait=2)
+            self.runSequence(open_box)
 
             is_contain_shiny = self.CheckBox()
             # tm = round(time.time() - start, 2)
@@ -67,11 +72,15 @@ class Fossil_shiny(ImageProcPythonCommand):
         col = 6
         for i in range(0, row):
             for j in range(0, col):
+                # 同じフレームで両方を判定する
+                # Maybe this threshold works for only Japanese version.
+                shiny, status = self.matchTemplates(
+                    [('shiny_mark.png', 0.9), ('status.png', 0.7)]
+                )
                 # if shiny, then stop
-                if self.isContainTemplate('shiny_mark.png', threshold=0.9):
+                if shiny.passed:
                     return True
-                # Maybe this threshold works for only Japanese version.
-                if self.isContainTemplate('status.png', threshold=0.7):
+                if status.passed:
                     pass
                 if not j == col - 1:
                     if i % 2 == 0:
@@ -1,10 +1,17 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import cv2
 import time
 
+import cv2
+
 from Commands.PythonCommandBase import ImageProcPythonCommand
+from TemplateMatcher import (
+    MATCH_POLICIES,
+    available_backends,
+    get_backend,
+    template_matcher,
+)
 
 
 # auto egg hatching using image recognition
@@ -17,32 +24,52 @@ class CalcTime(ImageProcPythonCommand):
         self.cam = cam
 
     def do(self):
-        print(cv2.cuda.getCudaEnabledDeviceCount())
-        if cv2.cuda.getCudaEnabledDeviceCount() != 0:
-            iter = 1000
-            # print(cv2.getBuildInformation())
-            print("Measure Calc.Speed btw. CPU, GPU for {0} iter".format(iter))
-            start = time.time()
-            for i in range(iter):
-                result = self.isContainTemplate("shiny_mark1.png", 0.7, True, False)
-            n = time.time() - start
-            print("CPU, Gray: Total: {0}, Ave: {1}".format(n, n / iter))
-            start = time.time()
-            for i in range(iter):
-                result = self.isContainTemplate("shiny_mark1.png", 0.7, False, False)
-            n = time.time() - start
-            print("CPU, Color: Total: {0}, Ave: {1}".format(n, n / iter))
-
-            start = time.time()
-            for i in range(iter):
-                result = self.isContainTemplateGPU("shiny_mark1.png", 0.7, True, False)
-            n = time.time() - start
-            print("GPU, Gray: Total: {0}, Ave: {1}".format(n, n / iter))
-            start = time.time()
-            for i in range(iter):
-                result = self.isContainTemplateGPU("shiny_mark1.png", 0.7, False, False)
-            n = time.time() - start
-            print("GPU, Color: Total: {0}, Ave: {1}".format(n, n / iter))
+        iter = 300
+        template = "shiny_mark.png"
+
+        # 探索方針ごとの速度を比較する(学習したROIは方針ごとにリセットする)
+        print("Measure Calc.Speed btw. match policies for {0} iter".format(iter))
+        base = {}  # exactの所要時間
+        for policy in MATCH_POLICIES:
+            self.match_policy = policy
+            for use_gray in (True, False):
+                template_matcher.clear()
+                start = time.perf_counter()
+                for i in range(iter):
+                    result = self.isContainTemplate(template, 0.7, use_gray, False)
+                n = time.perf_counter() - start
+                base.setdefault(use_gray, n)
+                print(
+                    "CPU, {0}, {1}: Total: {2}, Ave: {3}, Speedup: x{4:.2f}".format(
+                        policy,
+                        "Gray" if use_gray else "Color",
+                        n,
+                        n / iter,
+                        base[use_gray] / n,
+                    )
+                )
+
+        # バックエンドごとの速度を比較する(フレーム全体を原寸で探索する)
+        # 使えないバックエンド(CUDAのない環境のcudaなど)はopencvで代用される
+        # opencv-threadsはOpenCVのスレッド数(プロセス全体の設定)を変えるので、計測ごとに元に戻す
+        self.match_policy = "exact"
+        threads = cv2.getNumThreads()
+        for backend in available_backends():
+            self.match_backend = backend
+            start = time.perf_counter()
+            try:
+                for i in range(iter):
+                    result = self.isContainTemplate(template, 0.7, True, False)
+            finally:
+                cv2.setNumThreads(threads)
+            n = time.perf_counter() - start
+            print(
+                "{0} ({1}), Gray: Total: {2}, Ave: {3}".format(
+                    backend, type(get_backend(backend)).__name__, n, n / iter
+                )
+            )
+        self.match_policy = "balanced"
+        self.match_backend = None
 
 # print("テンプレートマッチング　グレースケール")
 # print("Total: {0}, Ave: {1}".format(n, n / 300))
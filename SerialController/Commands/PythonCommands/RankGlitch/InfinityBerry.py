@@ -66,12 +66,14 @@ class InfinityBerry(ImageProcPythonCommand):
         time = 0
         zero_cnt = 0
         height_half = int(self.camera.capture_size[1] / 2)
+        roi = [0, 0, self.camera.capture_size[0], height_half - 1]
 
-        frame1 = cv2.cvtColor(self.camera.readFrame()[0:height_half - 1, :], cv2.COLOR_BGR2GRAY)
+        # 同じフレーム同士で差分を取らないよう、毎回新しいフレームを待って取得する
+        frame1, seq = self.readNextFrame(roi=roi, gray=True)
         self.wait(check_interval / 3)
-        frame2 = cv2.cvtColor(self.camera.readFrame()[0:height_half - 1, :], cv2.COLOR_BGR2GRAY)
+        frame2, seq = self.readNextFrame(seq, roi=roi, gray=True)
         self.wait(check_interval / 3)
-        frame3 = cv2.cvtColor(self.camera.readFrame()[0:height_half - 1, :], cv2.COLOR_BGR2GRAY)
+        frame3, seq = self.readNextFrame(seq, roi=roi, gray=True)
 
         while time < check_duration:
             mask = self.getInterframeDiff(frame1, frame2, frame3, 15)
@@ -80,7 +82,7 @@ class InfinityBerry(ImageProcPythonCommand):
             frame1 = frame2
             frame2 = frame3
             self.wait(check_interval)
-            frame3 = cv2.cvtColor(self.camera.readFrame()[0:height_half - 1, :], cv2.COLOR_BGR2GRAY)
+            frame3, seq = self.readNextFrame(seq, roi=roi, gray=True)
 
             time += check_interval
 
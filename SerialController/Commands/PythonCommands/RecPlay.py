@@ -4,6 +4,7 @@
 from Commands.Keys import Direction, Stick
 from Commands.Keys import Button
 from Commands.PythonCommandBase import PythonCommand
+from Commands.Trajectory import Trajectory
 from tkinter import filedialog
 import time
 import numpy as np
@@ -13,6 +14,8 @@ import numpy as np
 # A連打
 class PlayRec(PythonCommand):
     NAME = '記録したログを再生'
+    # 1秒あたりの送信回数に揃えて再生する場合は指定する(Noneの場合は記録した間隔のまま)
+    RATE = None
 
     def __init__(self):
         super().__init__()
@@ -36,13 +39,12 @@ class PlayRec(PythonCommand):
 
     def do(self):
         file = filedialog.askopenfile(initialdir='~/')
+        if file is None:
+            return
         self.log = file.name
+        file.close()
         print(self.log)
-        with open(self.log) as f:
-            l_strip = [list(map(float, s.strip().split(","))) for s in f.readlines()]
-            # print(l_strip[:20])
-        for i in l_strip:
-            self.LStick(i[0], i[1], duration=i[2] * 1.0)
-            # self.wait(i[2]*0.90)
-
-        self.stickEnd(Direction(Stick.LEFT, 0, 0, showName=f'Angle={l_strip[0][0]},r={l_strip[0][1]}'))
+        # CSVでもバイナリでも、少しずつ読み込みながら記録した時刻どおりに送る
+        self.playTrajectory(Trajectory.chunks(self.log), rate=self.RATE)
+
+        self.stickEnd(Direction(Stick.LEFT, 0, 0, showName='Angle=0,r=0'))
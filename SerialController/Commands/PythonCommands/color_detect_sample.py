@@ -253,9 +253,7 @@ class ColorDetectSampleCommand(ImageProcPythonCommand):
         crop: list = [],
         mask_path: str | None = None,
     ) -> None:
-        src = self.camera.readFrame()
-        if len(crop) == 4:
-            src = src[crop[1] : crop[3], crop[0] : crop[2]]
+        src = self.camera.readFrame(copy=False, roi=crop if len(crop) == 4 else None)
 
         # ターゲット色と誤差からHSV範囲を計算
         lower_bound = np.array(
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from typing import NamedTuple
+
+# 締め切りの何秒前までOSのsleepに任せるか
+# OSのsleepの遅れ(Linuxで0.1ms程度、Windowsで1ms程度)より大きくしておく
+DEFAULT_SPIN_MARGIN = 0.002
+
+# 締め切りの何秒前からGILを手放さずに空回りするか
+# それより前はtime.sleep(0)で他のスレッドに譲りながら待つ
+DEFAULT_YIELD_MARGIN = 0.0005
+
+# 直前の締め切りからこの秒数以内に次の待機を始めた場合は、直前の締め切りを起点にする
+DEFAULT_CHAIN_TOLERANCE = 0.002
+
+# 遅れのヒストグラムの区切り[us]
+OVERSHOOT_BUCKETS_US = (10, 50, 100, 250, 500, 1000, 2000, 5000, 10000)
+
+
+class WaitSummary(NamedTuple):
+    count: int
+    mean_us: float
+    p50_us: float
+    p99_us: float
+    max_us: float
+    spin_ratio: float  # 待機時間のうち空回りしていた割合
+
+
+class OvershootHistogram:
+    """
+    締め切りからの遅れを区間ごとに数える
+
+    区間はOVERSHOOT_BUCKETS_USで区切り、最後の区間はそれ以上の遅れを数える。
+    """
+
+    def __init__(self, buckets_us: tuple[int, ...] = OVERSHOOT_BUCKETS_US):
+        self.buckets_us = buckets_us
+        self.counts = [0] * (len(buckets_us) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, overshoot: float) -> None:
+        us = overshoot * 1e6
+        index = 0
+        for edge in self.buckets_us:
+            if us < edge:
+                break
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += overshoot
+        if overshoot > self.max:
+            self.max = overshoot
+
+    def percentile(self, q: float) -> float:
+        """
+        遅れのq(0~1)分位点を返す[us]。区間の上端で近似する
+        """
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for edge, n in zip(self.buckets_us, self.counts):
+            seen += n
+            if seen >= target:
+                return float(edge)
+        return self.max * 1e6
+
+    def reset(self) -> None:
+        self.counts = [0] * (len(self.buckets_us) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def __str__(self) -> str:
+        labels = [f"<{edge}us" for edge in self.buckets_us]
+        labels.append(f">={self.buckets_us[-1]}us")
+        return " ".join(f"{label}:{n}" for label, n in zip(labels, self.counts) if n)
+
+
+class HybridScheduler:
+    """
+    OSのsleepと空回りを組み合わせた待機
+
+    締め切りのspin_margin秒前まではtime.sleepで待ち、残りだけperf_counterを見ながら
+    空回りする。yield_margin秒前まではtime.sleep(0)で他のスレッドに譲りながら空回りするので、
+    カメラのスレッドなどを止めない。
+    待機ごとの締め切りからの遅れはhistogramに記録する。
+    """
+
+    def __init__(
+        self,
+        spin_margin: float = DEFAULT_SPIN_MARGIN,
+        yield_margin: float = DEFAULT_YIELD_MARGIN,
+        chain_tolerance: float = DEFAULT_CHAIN_TOLERANCE,
+    ):
+        self.spin_margin = spin_margin
+        self.yield_margin = yield_margin
+        self.chain_tolerance = chain_tolerance
+        self.histogram = OvershootHistogram()
+        self.last_deadline: float | None = None
+        self._waited = 0.0
+        self._spun = 0.0
+        self._lock = threading.Lock()
+
+    def sleep_until(self, deadline: float) -> float:
+        """
+        perf_counterの値がdeadlineになるまで待つ。
+
+        Args:
+            deadline (float): 締め切り(time.perf_counter()の値)
+
+        Returns:
+            float: 締め切りからの遅れ[s]
+        """
+        start = time.perf_counter()
+        remaining = deadline - start - self.spin_margin
+        if remaining > 0:
+            time.sleep(remaining)
+        spin_start = time.perf_counter()
+        now = spin_start
+        yield_until = deadline - self.yield_margin
+        while now < yield_until:
+            time.sleep(0)
+            now = time.perf_counter()
+        while now < deadline:
+            now = time.perf_counter()
+
+        overshoot = now - deadline
+        with self._lock:
+            self.histogram.add(max(0.0, overshoot))
+            self._waited += now - start
+            self._spun += now - spin_start
+        self.last_deadline = deadline
+        return overshoot
+
+    def sleep(self, duration: float, chain: bool = False) -> float:
+        """
+        duration秒待つ。
+
+        Args:
+            duration (float): 待機時間[s]
+            chain (bool): 直前の締め切りからchain_tolerance秒以内であれば、
+                現在時刻ではなく直前の締め切りを起点にする。
+                ボタン入力の送信などにかかった時間が積み重なってずれていくのを防ぐ。
+
+        Returns:
+            float: 締め切りからの遅れ[s]
+        """
+        return self.sleep_until(self.deadline(duration, chain))
+
+    def deadline(self, duration: float, chain: bool = False) -> float:
+        # sleepの締め切りを求める
+        now = time.perf_counter()
+        base = now
+        last = self.last_deadline
+        if chain and last is not None and 0 <= now - last <= self.chain_tolerance:
+            base = last
+        return base + duration
+
+    def summary(self) -> WaitSummary:
+        with self._lock:
+            h = self.histogram
+            return WaitSummary(
+                h.count,
+                h.total / h.count * 1e6 if h.count else 0.0,
+                h.percentile(0.5),
+                h.percentile(0.99),
+                h.max * 1e6,
+                self._spun / self._waited if self._waited else 0.0,
+            )
+
+    def reset(self) -> None:
+        with self._lock:
+            self.histogram.reset()
+            self._waited = 0.0
+            self._spun = 0.0
+        self.last_deadline = None
@@ -1,25 +1,234 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import heapq
+import itertools
 import math
 import os
+import threading
 import time
 import platform
+from collections import deque
+from contextlib import contextmanager
+from typing import NamedTuple
 
 import serial
 from logging import getLogger, DEBUG, NullHandler
 
+from Commands.SerialProtocol import (HANDSHAKE, HANDSHAKE_REPLY, encode_row_frame,
+                                     frame_to_row)
+
+
+class WriterStats(NamedTuple):
+    queue_depth: int  # 送信待ちの数
+    max_queue_depth: int
+    sent: int
+    coalesced: int  # 新しい状態で置き換えて送らなかった数
+    jitter_mean_ms: float  # 指定した送信時刻からの遅れ(直近の送信)
+    jitter_p99_ms: float
+    jitter_max_ms: float
+    failed: int = 0  # 書き込みで例外が起きた数
+
+
+class _PortState:
+    # SerialWriterのポートごとの状態と統計
+    def __init__(self, history: int):
+        self.last = None  # 直前に送ったデータ
+        self.jitter = deque(maxlen=history)
+        self.pending = 0
+        self.max_depth = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.failed = 0
+
+
+class SerialWriter:
+    """
+    シリアルへの書き込みを1つのスレッドにまとめる
+
+    書き込みたい行を送信時刻つきでキューに積むと、専用のスレッドが時刻順に送る。
+    Tkのイベントやキーボードのリスナーがシリアルの書き込みを待たずに済み、
+    複数のスレッドから送っても行が混ざらない。
+    coalesce=Trueで積んだ行(マウスのスティックなど、最新の状態だけ送れば良いもの)は、
+    次の行も置き換え可能で送信時刻を過ぎていれば送らずに捨てる。直前に送った行と同じ場合も捨てる。
+
+    putにwriteを渡すと、1つのSerialWriter(スレッド)で複数のポートに書き込める
+    (Orchestratorで複数の機材を動かす場合)。置き換えの判定と統計はポート(write)ごとに行う。
+    """
+
+    def __init__(self, write=None, history: int = 1000):
+        self._write = write
+        self._history = history
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._running = True
+        self._ports: dict = {}
+        self._logger = getLogger(__name__)
+        self._logger.addHandler(NullHandler())
+        self._thread = threading.Thread(target=self._run, name="SerialWriter", daemon=True)
+        self._thread.start()
+
+    def _port(self, write) -> _PortState:
+        port = self._ports.get(write)
+        if port is None:
+            port = self._ports[write] = _PortState(self._history)
+        return port
+
+    def put(self, data: bytes, row, is_show: bool = False, send_at: float | None = None,
+            coalesce: bool = False, write=None) -> None:
+        """
+        送信する行をキューに積む。
+
+        Args:
+            data (bytes): 改行まで含めた送信データ
+            row: 送信した行としてSender.beforeに残す値
+            is_show (bool): 送信前に直前の入力を表示するかどうか
+            send_at (float | None): 送信時刻(time.perf_counter()の値)。Noneの場合はすぐに送る
+            coalesce (bool): 新しい状態で置き換えてよい行かどうか
+            write (Callable | None): 書き込む関数(write(data, row, is_show))。
+                Noneの場合はコンストラクタで渡した関数
+        """
+        if send_at is None:
+            send_at = time.perf_counter()
+        if write is None:
+            write = self._write
+        with self._cond:
+            heapq.heappush(
+                self._queue, (send_at, next(self._seq), data, row, is_show, coalesce, write)
+            )
+            self._pending += 1
+            port = self._port(write)
+            port.pending += 1
+            port.max_depth = max(port.max_depth, port.pending)
+            self._cond.notify_all()
+
+    def flush(self, timeout: float | None = None, write=None) -> bool:
+        # キューに積んだ行を全て送り終えるまで待つ(writeを渡した場合はそのポートの行だけ)
+        with self._cond:
+            if write is None:
+                return self._cond.wait_for(lambda: self._pending == 0, timeout)
+            port = self._port(write)
+            return self._cond.wait_for(lambda: port.pending == 0, timeout)
+
+    def stop(self, timeout: float | None = 1.0) -> None:
+        self.flush(timeout)
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def stats(self, write=None) -> WriterStats:
+        # writeを渡した場合はそのポートの統計、渡さない場合は全てのポートの合計
+        with self._cond:
+            ports = list(self._ports.values()) if write is None else [self._port(write)]
+            jitter = sorted(j for port in ports for j in port.jitter)
+            depth = sum(port.pending for port in ports)
+            max_depth = max((port.max_depth for port in ports), default=0)
+            sent = sum(port.sent for port in ports)
+            coalesced = sum(port.coalesced for port in ports)
+            failed = sum(port.failed for port in ports)
+        if not jitter:
+            return WriterStats(depth, max_depth, sent, coalesced, 0.0, 0.0, 0.0, failed)
+        return WriterStats(
+            depth,
+            max_depth,
+            sent,
+            coalesced,
+            sum(jitter) / len(jitter) * 1000,
+            jitter[min(len(jitter) - 1, int(len(jitter) * 0.99))] * 1000,
+            jitter[-1] * 1000,
+            failed,
+        )
+
+    def _following(self, write):
+        # 同じポートの次の行(キューの先頭でなければ探す)
+        if self._queue and self._queue[0][6] == write:
+            return self._queue[0]
+        return min((item for item in self._queue if item[6] == write), default=None)
+
+    def _next(self):
+        # 送信時刻になった行を取り出す。停止した場合はNone
+        with self._cond:
+            while True:
+                if not self._queue:
+                    if not self._running:
+                        return None
+                    self._cond.wait()
+                    continue
+                delay = self._queue[0][0] - time.perf_counter()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                item = heapq.heappop(self._queue)
+                coalesce, write = item[5], item[6]
+                if coalesce:
+                    following = self._following(write)
+                    if following is not None and following[5] and following[0] <= time.perf_counter():
+                        self._done(write, coalesced=True)
+                        continue
+                    if item[2] == self._port(write).last:
+                        self._done(write, coalesced=True)
+                        continue
+                return item
+
+    def _done(self, write, coalesced: bool = False, failed: bool = False) -> None:
+        port = self._port(write)
+        if coalesced:
+            port.coalesced += 1
+        elif failed:
+            port.failed += 1
+        else:
+            port.sent += 1
+        port.pending -= 1
+        self._pending -= 1
+        if self._pending == 0 or port.pending == 0:
+            self._cond.notify_all()
+
+    def _run(self) -> None:
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            send_at, _, data, row, is_show, _, write = item
+            try:
+                write(data, row, is_show)
+            except Exception as e:
+                # 1つのポートの失敗で他のポートへの書き込みを止めない
+                self._logger.error(f"Failed to write {data!r}: {e!r}")
+                with self._cond:
+                    self._done(write, failed=True)
+                continue
+            jitter = time.perf_counter() - send_at
+            with self._cond:
+                port = self._port(write)
+                port.last = data
+                port.jitter.append(jitter)
+                self._done(write)
+
 
 class Sender:
-    def __init__(self, is_show_serial, if_print=True):
+    def __init__(self, is_show_serial, if_print=True, async_write=False, writer=None):
         self.ser = None
         self.is_show_serial = is_show_serial
+        self._lock = threading.Lock()
+        # async_write=Trueの場合は専用のスレッドから書き込む
+        # writerを渡した場合は、そのSerialWriterを他のSenderと共有する
+        self.writer = writer
+        if writer is None and async_write:
+            self.writer = SerialWriter(self._write)
 
         self._logger = getLogger(__name__)
         self._logger.addHandler(NullHandler())
         self._logger.setLevel(DEBUG)
         self._logger.propagate = True
 
-        self.before = None
+        self._before = None
+        # incremented on every row written (or queued) and on (re)connection;
+        # KeyPress uses it to know whether someone else has written since its last report
+        self.write_count = 0
+        # True after negotiate() confirmed that the firmware accepts binary frames
+        self.binary = False
         self.L_holding = False
         self._L_holding = None
         self.R_holding = False
@@ -41,6 +250,9 @@ class Sender:
                     "CENTER"]
 
     def openSerial(self, portNum: int, portName: str = '', baudrate: int = 9600):
+        self.write_count += 1
+        self.binary = False
+        baudrate = int(baudrate)
         try:
             if portName is None or portName == '':
                 if os.name == 'nt':
@@ -64,9 +276,9 @@ class Sender:
                     self._logger.warning('Not supported OS')
                     return False
             else:
-                print('connecting to ' + portName)
-                self._logger.info('connecting to ' + portName)
-                self.ser = serial.Serial(portName, 9600)
+                print('connecting to ' + portName + "(" + str(baudrate) + ")")
+                self._logger.info('connecting to ' + portName + "(" + str(baudrate) + ")")
+                self.ser = serial.Serial(portName, baudrate)
                 return True
         except IOError as e:
             print('COM Port: can\'t be established')
@@ -76,46 +288,140 @@ class Sender:
 
     def closeSerial(self):
         self._logger.debug("Closing the serial communication")
-        self.ser.close()
+        if self.writer is not None:
+            self.writer.flush(timeout=1.0, write=self._write)
+            self._logger.debug(f"Serial writer: {self.writer.stats(self._write)}")
+        with self._lock:
+            self.ser.close()
+
+    @contextmanager
+    def exclusive(self):
+        # send everything queued, then hand over the port itself (e.g. for binary transfers)
+        if self.writer is not None:
+            self.writer.flush(timeout=1.0, write=self._write)
+        with self._lock:
+            yield self.ser
+
+    def negotiate(self, timeout: float = 0.3) -> bool:
+        """
+        マイコンがバイナリフレームに対応しているか確認する。
+
+        "proto bin1"を送り、timeout秒以内に"ok bin1"が返ってきた場合だけ以降の入力をフレームで送る。
+        返事がない(古いファームウェア)場合や別の返事の場合はテキストのまま。
+
+        Returns:
+            bool: バイナリフレームを使う場合はTrue
+        """
+        self.binary = False
+        try:
+            with self.exclusive() as port:
+                if hasattr(port, 'reset_input_buffer'):
+                    port.reset_input_buffer()
+                previous = port.timeout
+                port.timeout = timeout
+                try:
+                    port.write(HANDSHAKE)
+                    reply = port.read_until(b'\n')
+                finally:
+                    port.timeout = previous
+        except (serial.serialutil.SerialException, AttributeError) as e:
+            self._logger.error(f"Protocol negotiation failed: {e}")
+            return False
+        self.write_count += 1
+        self.binary = reply.strip() == HANDSHAKE_REPLY
+        self._logger.info(f"Serial protocol: {'binary' if self.binary else 'text'}")
+        return self.binary
+
+    def writerStats(self):
+        return self.writer.stats(self._write) if self.writer is not None else None
 
     def isOpened(self):
         self._logger.debug("Checking if serial communication is open")
         return True if self.ser is not None and self.ser.isOpen() else False
 
-    def writeRow(self, row, is_show=False):
-        try:
-            self.time_bef = time.perf_counter()
-            if self.before is not None and self.before != 'end' and is_show:
-                output = self.before.split(' ')
-                self.show_input(output)
-
-            self.ser.write((row + '\r\n').encode('utf-8'))
-            self.time_aft = time.perf_counter()
-            self.before = row
-        except serial.serialutil.SerialException as e:
-            # print(e)
-            self._logger.error(f"Error : {e}")
-        except AttributeError as e:
-            print('Using a port that is not open.')
-            self._logger.error('Maybe Using a port that is not open.')
-            self._logger.error(e)
-        # self._logger.debug(f"{row}")
+    @property
+    def before(self):
+        # the last row sent; rows from writeEncoded are kept as bytes and decoded here
+        before = self._before
+        if isinstance(before, bytes):
+            before = frame_to_row(before)
+            self._before = before
+        return before
+
+    @before.setter
+    def before(self, row):
+        self._before = row
+
+    def _encodeRow(self, row):
+        if self.binary:
+            return encode_row_frame(row)
+        return (row + '\r\n').encode('utf-8')
+
+    def writeRow(self, row, is_show=False, send_at=None, coalesce=False):
+        self._send(self._encodeRow(row), row, is_show, send_at, coalesce)
         # Show sending serial datas
         if self.is_show_serial.get():
             print(row)
-    
-    def writeRow_wo_perf_counter(self, row, is_show=False):
+
+    def writeEncoded(self, data, is_show=False, send_at=None, coalesce=False):
+        # data: a row already encoded with the line terminator (e.g. ReportEncoder.encode())
+        # or a binary frame (ReportEncoder.encode_frame()) after negotiate()
+        data = bytes(data)
+        self._send(data, data, is_show, send_at, coalesce)
+        # Show sending serial datas
+        if self.is_show_serial.get():
+            print(frame_to_row(data))
+
+    def _send(self, data, row, is_show, send_at, coalesce):
+        self.write_count += 1
+        if self.writer is not None:
+            self.writer.put(data, row, is_show, send_at, coalesce, self._write)
+        else:
+            self._write(data, row, is_show)
+
+    def _write(self, data, row, is_show):
         try:
-            self.ser.write((row + '\r\n').encode('utf-8'))
+            with self._lock:
+                if row is None:
+                    # writeRow_wo_perf_counter
+                    self.ser.write(data)
+                    return
+                self.time_bef = time.perf_counter()
+                if is_show:
+                    before = self.before
+                    if before is not None and before != 'end':
+                        self.show_input(before.split(' '))
+
+                self.ser.write(data)
+                self.time_aft = time.perf_counter()
+                self._before = row
         except serial.serialutil.SerialException as e:
-            # エラーはあえてprintでも出す。
-            print(e)
+            # print(e)
             self._logger.error(f"Error : {e}")
         except AttributeError as e:
             print('Using a port that is not open.')
             self._logger.error('Maybe Using a port that is not open.')
             self._logger.error(e)
         # self._logger.debug(f"{row}")
+
+    def writeRow_wo_perf_counter(self, row, is_show=False):
+        data = self._encodeRow(row)
+        self.write_count += 1
+        if self.writer is not None:
+            self.writer.put(data, None, write=self._write)
+        else:
+            try:
+                with self._lock:
+                    self.ser.write(data)
+            except serial.serialutil.SerialException as e:
+                # エラーはあえてprintでも出す。
+                print(e)
+                self._logger.error(f"Error : {e}")
+            except AttributeError as e:
+                print('Using a port that is not open.')
+                self._logger.error('Maybe Using a port that is not open.')
+                self._logger.error(e)
+        # self._logger.debug(f"{row}")
         # Show sending serial datas
         if self.is_show_serial.get():
             print(row)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+from typing import Any, Callable, NamedTuple
+
+from Commands.Scheduler import HybridScheduler
+
+
+class SequenceEvent(NamedTuple):
+    at: float  # シーケンスの開始からの時刻[s]
+    action: str  # "input", "inputEnd", "hold", "holdEnd"
+    buttons: Any
+    label: str
+
+
+class StepTiming(NamedTuple):
+    index: int
+    label: str
+    planned: float  # 予定した時刻(開始からの秒数)
+    actual: float  # 実際に送信を始めた時刻(開始からの秒数)
+    error: float  # actual - planned [s]
+    send: float  # 送信にかかった時間[s]
+
+
+class SequenceReport(NamedTuple):
+    steps: list[StepTiming]
+    planned_duration: float
+    actual_duration: float
+
+    @property
+    def max_error(self) -> float:
+        return max((step.error for step in self.steps), default=0.0)
+
+    @property
+    def mean_error(self) -> float:
+        if not self.steps:
+            return 0.0
+        return sum(step.error for step in self.steps) / len(self.steps)
+
+    @property
+    def drift(self) -> float:
+        # 終了時刻のずれ[s]
+        return self.actual_duration - self.planned_duration
+
+    def __str__(self) -> str:
+        return (
+            f"{len(self.steps)} steps in {self.actual_duration:.3f}s "
+            f"(planned {self.planned_duration:.3f}s): "
+            f"error mean {self.mean_error * 1000:.2f}ms max {self.max_error * 1000:.2f}ms, "
+            f"drift {self.drift * 1000:.2f}ms"
+        )
+
+
+def _label(action: str, buttons: Any) -> str:
+    if isinstance(buttons, list):
+        names = ", ".join(getattr(b, "name", None) or repr(b) for b in buttons)
+    else:
+        names = getattr(buttons, "name", None) or repr(buttons)
+    return f"{action}({names})"
+
+
+class Sequence:
+    """
+    ボタン入力の時刻表
+
+    PythonCommandのpress/pressRep/hold/holdEnd/waitと同じ引数で入力を積むと、
+    それぞれの入力を開始からの絶対時刻に並べる。Sequencerで実行すると、
+    送信にかかった時間や待機の遅れが後の入力に積み重ならない。
+
+    Example:
+        seq = Sequence().press(Button.A, wait=0.75).pressRep(Direction.DOWN, 3)
+        self.runSequence(seq)
+    """
+
+    def __init__(self):
+        self.events: list[SequenceEvent] = []
+        self.duration = 0.0
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def _add(self, action: str, buttons: Any) -> None:
+        self.events.append(
+            SequenceEvent(self.duration, action, buttons, _label(action, buttons))
+        )
+
+    def press(self, buttons, duration: float = 0.1, wait: float = 0.1) -> "Sequence":
+        # 押してから離すまでは同じオブジェクトを渡す(PythonCommand.pressと同じ)
+        self._add("input", buttons)
+        self.duration += duration
+        self._add("inputEnd", buttons)
+        self.duration += wait
+        return self
+
+    def pressRep(
+        self,
+        buttons,
+        repeat: int,
+        duration: float = 0.1,
+        interval: float = 0.1,
+        wait: float = 0.1,
+    ) -> "Sequence":
+        for i in range(0, repeat):
+            self.press(buttons, duration, 0 if i == repeat - 1 else interval)
+        self.duration += wait
+        return self
+
+    def hold(self, buttons, wait: float = 0.1) -> "Sequence":
+        self._add("hold", buttons)
+        self.duration += wait
+        return self
+
+    def holdEnd(self, buttons) -> "Sequence":
+        self._add("holdEnd", buttons)
+        return self
+
+    def wait(self, wait: float) -> "Sequence":
+        self.duration += wait
+        return self
+
+    def extend(self, other: "Sequence") -> "Sequence":
+        # otherをこのシーケンスの後ろにつなげる
+        offset = self.duration
+        for event in other.events:
+            self.events.append(event._replace(at=event.at + offset))
+        self.duration += other.duration
+        return self
+
+
+class Sequencer:
+    """
+    Sequenceを締め切り基準で実行する
+
+    各入力は「開始時刻 + 予定時刻」を締め切りとしてHybridSchedulerで待ってから送る。
+    ある入力が遅れても次の入力の締め切りは変わらないので、長いマクロでもずれが蓄積しない。
+    """
+
+    def __init__(
+        self,
+        keys,
+        scheduler: HybridScheduler | None = None,
+        check: Callable[[], Any] | None = None,
+    ):
+        """
+        Args:
+            keys (KeyPress): 入力を送るKeyPress
+            scheduler (HybridScheduler | None): 待機に使うスケジューラ
+            check (Callable | None): 入力を送るたびに呼ぶ関数(PythonCommand.checkIfAliveなど)
+        """
+        self.keys = keys
+        self.scheduler = scheduler or HybridScheduler()
+        self.check = check
+
+    def run(self, sequence: Sequence, start: float | None = None) -> SequenceReport:
+        """
+        シーケンスを実行する。
+
+        Args:
+            sequence (Sequence): 実行するシーケンス
+            start (float | None): 開始時刻(time.perf_counter()の値)。Noneの場合は現在時刻
+
+        Returns:
+            SequenceReport: 入力ごとの予定と実際の時刻
+        """
+        if start is None:
+            start = time.perf_counter()
+        keys = self.keys
+        steps = []
+        for index, event in enumerate(sequence.events):
+            self.scheduler.sleep_until(start + event.at)
+            sent = time.perf_counter()
+            getattr(keys, event.action)(event.buttons)
+            done = time.perf_counter()
+            steps.append(
+                StepTiming(
+                    index,
+                    event.label,
+                    event.at,
+                    sent - start,
+                    sent - start - event.at,
+                    done - sent,
+                )
+            )
+            if self.check is not None:
+                self.check()
+        self.scheduler.sleep_until(start + sequence.duration)
+        if self.check is not None:
+            self.check()
+        return SequenceReport(steps, sequence.duration, time.perf_counter() - start)
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Joystick.cに送る1行分の入力(レポート)の状態と、そのエンコーダ
+#
+# 送信形式(テキスト):
+#   "0x%04x <hat> [<lx> <ly>] [<rx> <ry>]\r\n"
+#   先頭の値はボタンのビット列を2ビット左にずらし、
+#   Lスティックが変化した場合は0x2、Rスティックが変化した場合は0x1を立てたもの。
+#   スティックの値は0埋めなしの16進数で、変化したスティックだけを送る。
+#
+# 送信形式(バイナリフレーム、ハンドシェイクで対応を確認した場合のみ):
+#   SYNC(0xa5) LEN TYPE PAYLOAD... CRC8
+#   LENはTYPEとPAYLOADのバイト数、CRC8(多項式0x07)はLENからPAYLOADの末尾まで。
+#   TYPE 0x01(入力): send_btn(u16, little endian) hat(u8) [lx ly] [rx ry]
+#                   スティックはテキスト形式と同じく変化したものだけを送る。
+#   TYPE 0x02(テキスト): 改行を除いた1行("end"など)
+#   SYNCはASCIIに含まれないので、マイコンはテキストの行とフレームを同じ回線で区別できる。
+#   ハンドシェイク: PCが"proto bin1"を送り、"ok bin1"が返ってきた場合だけフレームを使う。
+
+from typing import NamedTuple
+
+CENTER = 128
+HAT_CENTER = 8
+L_CHANGED = 0x2
+R_CHANGED = 0x1
+
+_HEX2 = [b"%02x" % i for i in range(256)]  # ボタンのビット列用(0埋めあり)
+_HEX = [b"%x" % i for i in range(256)]  # スティック用(0埋めなし)
+_SPACE = 0x20
+_DIGIT0 = 0x30
+_CRLF = b"\r\n"
+MAX_REPORT_LENGTH = 24  # "0xffff 8 ff ff ff ff\r\n"
+
+FRAME_SYNC = 0xA5
+FRAME_INVALID = 0x00  # FrameDecoderが壊れたデータを返すときの種類
+FRAME_REPORT = 0x01
+FRAME_TEXT = 0x02
+MAX_FRAME_LENGTH = 11  # SYNC LEN TYPE btn(2) hat lx ly rx ry CRC
+HANDSHAKE = b"proto bin1\r\n"
+HANDSHAKE_REPLY = b"ok bin1"
+
+
+def _crc8_table() -> list[int]:
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return table
+
+
+_CRC8 = _crc8_table()
+
+
+def crc8(data, crc: int = 0) -> int:
+    """CRC-8(多項式0x07、初期値0)"""
+    table = _CRC8
+    for b in data:
+        crc = table[crc ^ b]
+    return crc
+
+
+class ReportState:
+    """
+    送信するレポートの状態
+
+    ボタン・HAT・スティックの値と、前回の送信からスティックが変化したかどうかを保持する。
+    スティックのyは送信形式の値(下向きが正)で持つ。
+    """
+
+    __slots__ = ("btn", "hat", "lx", "ly", "rx", "ry", "l_changed", "r_changed")
+
+    def __init__(self):
+        self.btn = 0
+        self.hat = HAT_CENTER
+        self.lx = CENTER
+        self.ly = CENTER
+        self.rx = CENTER
+        self.ry = CENTER
+        self.l_changed = False
+        self.r_changed = False
+
+    def copy(self) -> "ReportState":
+        state = ReportState()
+        for name in self.__slots__:
+            setattr(state, name, getattr(self, name))
+        return state
+
+    def sticks(self) -> tuple[int, int, int, int]:
+        return self.lx, self.ly, self.rx, self.ry
+
+
+class ReportEncoder:
+    """
+    ReportStateを送信形式のバイト列に変換する
+
+    出力は使い回すバッファに書き込むので、1レポートごとに文字列やリストを作らない。
+    encodeが返すmemoryviewは次のencodeで上書きされるため、保持する場合はbytes()でコピーすること。
+    """
+
+    __slots__ = ("_buf", "_view", "_frame", "_frame_view")
+
+    def __init__(self):
+        self._buf = bytearray(MAX_REPORT_LENGTH)
+        self._buf[0:2] = b"0x"
+        self._view = memoryview(self._buf)
+        self._frame = bytearray(MAX_FRAME_LENGTH)
+        self._frame[0] = FRAME_SYNC
+        self._frame[2] = FRAME_REPORT
+        self._frame_view = memoryview(self._frame)
+
+    def encode(self, state: ReportState, clear_changed: bool = True) -> memoryview:
+        """
+        レポートを改行付きの送信形式に変換する。
+
+        Args:
+            state (ReportState): 送信する状態
+            clear_changed (bool): 変換後にスティックの変化フラグを下ろすかどうか
+
+        Returns:
+            memoryview: 送信するバイト列(次のencodeまで有効)
+        """
+        buf = self._buf
+        l_changed = state.l_changed
+        r_changed = state.r_changed
+
+        send_btn = int(state.btn) << 2
+        if l_changed:
+            send_btn |= L_CHANGED
+        if r_changed:
+            send_btn |= R_CHANGED
+        buf[2:4] = _HEX2[send_btn >> 8]
+        buf[4:6] = _HEX2[send_btn & 0xFF]
+        buf[6] = _SPACE
+        buf[7] = _DIGIT0 + int(state.hat)
+        pos = 8
+
+        if l_changed:
+            pos = self._put_pair(pos, state.lx, state.ly)
+        if r_changed:
+            pos = self._put_pair(pos, state.rx, state.ry)
+        buf[pos : pos + 2] = _CRLF
+
+        if clear_changed:
+            state.l_changed = False
+            state.r_changed = False
+        return self._view[: pos + 2]
+
+    def encode_frame(
+        self, state: ReportState, clear_changed: bool = True
+    ) -> memoryview:
+        """
+        レポートをバイナリフレームに変換する。
+
+        Args:
+            state (ReportState): 送信する状態
+            clear_changed (bool): 変換後にスティックの変化フラグを下ろすかどうか
+
+        Returns:
+            memoryview: 送信するフレーム(次のencode_frameまで有効)
+        """
+        buf = self._frame
+        l_changed = state.l_changed
+        r_changed = state.r_changed
+
+        send_btn = int(state.btn) << 2
+        if l_changed:
+            send_btn |= L_CHANGED
+        if r_changed:
+            send_btn |= R_CHANGED
+        buf[3] = send_btn & 0xFF
+        buf[4] = send_btn >> 8
+        buf[5] = int(state.hat)
+        pos = 6
+        if l_changed:
+            buf[pos] = state.lx
+            buf[pos + 1] = state.ly
+            pos += 2
+        if r_changed:
+            buf[pos] = state.rx
+            buf[pos + 1] = state.ry
+            pos += 2
+        buf[1] = pos - 2
+        crc = 0
+        table = _CRC8
+        for i in range(1, pos):
+            crc = table[crc ^ buf[i]]
+        buf[pos] = crc
+
+        if clear_changed:
+            state.l_changed = False
+            state.r_changed = False
+        return self._frame_view[: pos + 1]
+
+    def encode_str(self, state: ReportState, clear_changed: bool = True) -> str:
+        """改行を除いた送信形式の文字列を返す(表示やログ用)"""
+        return bytes(self.encode(state, clear_changed)[:-2]).decode("ascii")
+
+    def _put_pair(self, pos: int, x: int, y: int) -> int:
+        buf = self._buf
+        hx = _HEX[x]
+        hy = _HEX[y]
+        buf[pos] = _SPACE
+        pos += 1
+        end = pos + len(hx)
+        buf[pos:end] = hx
+        buf[end] = _SPACE
+        pos = end + 1
+        end = pos + len(hy)
+        buf[pos:end] = hy
+        return end
+
+
+def apply_report(state: ReportState, line: bytes | str) -> bool:
+    """
+    受け取った1行をJoystick.cと同じように解釈してstateに反映する。
+
+    変化フラグが立っていないスティックは前の値のままになる。
+
+    Args:
+        state (ReportState): 反映先の状態
+        line (bytes | str): 受け取った行(改行はあってもなくても良い)
+
+    Returns:
+        bool: 入力の行として解釈できた場合はTrue("end"などのコマンドはFalse)
+    """
+    if isinstance(line, (bytes, bytearray, memoryview)):
+        line = bytes(line).decode("ascii", "replace")
+    tokens = line.split()
+    if len(tokens) < 2:
+        return False
+    try:
+        values = [int(token, 16) for token in tokens]
+    except ValueError:
+        return False
+
+    send_btn = values[0]
+    state.btn = send_btn >> 2
+    state.hat = values[1]
+    rest = values[2:]
+    state.l_changed = bool(send_btn & L_CHANGED)
+    state.r_changed = bool(send_btn & R_CHANGED)
+    if state.l_changed and len(rest) >= 2:
+        state.lx, state.ly = rest[0], rest[1]
+        rest = rest[2:]
+    if state.r_changed and len(rest) >= 2:
+        state.rx, state.ry = rest[0], rest[1]
+    return True
+
+
+def encode_row_frame(row: str) -> bytes:
+    """
+    テキスト形式の1行をフレームにする。
+
+    入力の行(マウスのスティック操作の"3 8 ..."など)はTYPE 0x01、
+    それ以外("end"など)はTYPE 0x02のフレームになる。
+
+    Args:
+        row (str): 改行を除いた行
+
+    Returns:
+        bytes: 送信するフレーム
+    """
+    tokens = row.split()
+    if len(tokens) in (2, 4, 6):
+        try:
+            values = [int(token, 16) for token in tokens]
+        except ValueError:
+            values = None
+        if values is not None:
+            send_btn = values[0]
+            changed = bool(send_btn & L_CHANGED) + bool(send_btn & R_CHANGED)
+            if (
+                len(values) == 2 + 2 * changed
+                and 0 <= send_btn <= 0xFFFF
+                and all(0 <= v <= 0xFF for v in values[1:])
+            ):
+                body = bytes(
+                    (len(values) + 2, FRAME_REPORT, send_btn & 0xFF, send_btn >> 8)
+                ) + bytes(values[1:])
+                return bytes((FRAME_SYNC,)) + body + bytes((crc8(body),))
+    return encode_text_frame(row)
+
+
+def encode_text_frame(row: str) -> bytes:
+    """
+    テキストの1行("end"など)をTYPE 0x02のフレームにする。
+
+    Args:
+        row (str): 改行を除いた行
+
+    Returns:
+        bytes: 送信するフレーム
+    """
+    payload = row.encode("ascii")
+    if len(payload) > 254:
+        raise ValueError(f"row is too long for a frame: {len(payload)} bytes")
+    body = bytes((len(payload) + 1, FRAME_TEXT)) + payload
+    return bytes((FRAME_SYNC,)) + body + bytes((crc8(body),))
+
+
+def frame_to_row(data: bytes) -> str:
+    """
+    送信したデータ(テキストの行またはフレーム)を、テキスト形式の行(改行なし)に戻す。
+
+    Sender.beforeやシリアルの表示で、フレームを送った場合もテキストと同じ行を扱えるようにする。
+    """
+    if not data or data[0] != FRAME_SYNC:
+        return bytes(data).rstrip(b"\r\n").decode("ascii")
+    payload = bytes(data[3:-1])
+    if data[2] == FRAME_TEXT:
+        return payload.decode("ascii")
+    send_btn = payload[0] | payload[1] << 8
+    row = f"0x{send_btn:04x} {payload[2]}"
+    for i in range(3, len(payload) - 1, 2):
+        row += f" {payload[i]:x} {payload[i + 1]:x}"
+    return row
+
+
+def apply_frame(state: ReportState, frame_type: int, payload: bytes) -> bool:
+    """
+    受け取ったフレームをJoystick.cと同じようにstateに反映する(apply_reportのフレーム版)。
+
+    Returns:
+        bool: 入力のフレームとして解釈できた場合はTrue
+    """
+    if frame_type != FRAME_REPORT or len(payload) < 3:
+        return False
+    send_btn = payload[0] | payload[1] << 8
+    state.btn = send_btn >> 2
+    state.hat = payload[2]
+    rest = payload[3:]
+    state.l_changed = bool(send_btn & L_CHANGED)
+    state.r_changed = bool(send_btn & R_CHANGED)
+    if state.l_changed and len(rest) >= 2:
+        state.lx, state.ly = rest[0], rest[1]
+        rest = rest[2:]
+    if state.r_changed and len(rest) >= 2:
+        state.rx, state.ry = rest[0], rest[1]
+    return True
+
+
+class Frame(NamedTuple):
+    type: int  # FRAME_REPORT, FRAME_TEXT, FRAME_INVALID
+    payload: bytes  # テキストの行は改行を除いたもの
+    size: int  # 回線上のバイト数
+
+
+class FrameDecoder:
+    """
+    受け取ったバイト列から、テキストの行とバイナリフレームを取り出す(マイコン側の受信処理)
+
+    行の先頭がSYNCの場合はフレーム、それ以外は改行までをテキストの行として扱う。
+    CRCが合わないフレームはFRAME_INVALIDとして返し、次のバイトから同期を取り直す。
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self.errors = 0
+
+    def feed(self, data: bytes) -> list[Frame]:
+        buf = self._buf
+        buf += data
+        frames = []
+        pos = 0
+        while pos < len(buf):
+            if buf[pos] == FRAME_SYNC:
+                if pos + 2 > len(buf):
+                    break
+                end = pos + 2 + buf[pos + 1]
+                if end >= len(buf):
+                    break
+                body = buf[pos + 1 : end]
+                if buf[pos + 1] and crc8(body) == buf[end]:
+                    frames.append(Frame(body[1], bytes(body[2:]), end + 1 - pos))
+                    pos = end + 1
+                else:
+                    self.errors += 1
+                    frames.append(Frame(FRAME_INVALID, bytes(buf[pos : pos + 1]), 1))
+                    pos += 1
+                continue
+            end = buf.find(b"\n", pos)
+            if end < 0:
+                break
+            frames.append(
+                Frame(FRAME_TEXT, bytes(buf[pos:end]).strip(), end + 1 - pos)
+            )
+            pos = end + 1
+        del buf[:pos]
+        return frames
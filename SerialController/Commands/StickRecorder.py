@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+
+import numpy as np
+from loguru import logger
+
+from Commands.Trajectory import INDEX_DTYPE, SAMPLE_DTYPE, binary_header
+
+STICK_LEFT = 0
+STICK_RIGHT = 1
+STROKE_START = 0x1  # 1回の操作(クリックしてから離すまで)の最初のサンプル
+
+RECORD_DTYPE = np.dtype(
+    [
+        ("angle", "<f8"),
+        ("r", "<f8"),
+        ("duration", "<f8"),
+        ("stick", "u1"),
+        ("flags", "u1"),
+    ]
+)
+
+
+class StickRecorder:
+    """
+    マウスで操作したスティックの記録
+
+    サンプルはあらかじめ確保したリングバッファに書き込むだけで、リストや文字列を作らない。
+    バックグラウンドのスレッドがflush_interval秒ごと(またはバッファが半分埋まったとき)に
+    スティックごとのファイル("<base>_LStick.pctr"、"<base>_RStick.pctr")に追記する。
+    ファイルはTrajectoryのバイナリ形式なので、記録中でもPlayRecでそのまま再生できる。
+    操作ごとの最初のサンプル番号は索引("<ファイル>.idx")に書く(Trajectory.read_index)。
+
+    recordはTkのスレッドからだけ呼ぶ(書き込む側が1つであることを前提にしている)。
+    """
+
+    def __init__(
+        self, filename_base: str, capacity: int = 8192, flush_interval: float = 0.5
+    ):
+        """
+        Args:
+            filename_base (str): 保存するファイル名の先頭("log/20240101_000000"など)
+            capacity (int): リングバッファのサンプル数
+            flush_interval (float): ファイルに書き出す間隔[s]
+        """
+        self.paths = (
+            f"{filename_base}_LStick.pctr",
+            f"{filename_base}_RStick.pctr",
+        )
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.dropped = 0  # バッファがいっぱいで記録できなかったサンプル数
+        self._buf = np.zeros(capacity, dtype=RECORD_DTYPE)
+        # フィールドのビューを先に作っておく(record()でビューを作らない)
+        self._angle = self._buf["angle"]
+        self._r = self._buf["r"]
+        self._duration = self._buf["duration"]
+        self._stick = self._buf["stick"]
+        self._flags = self._buf["flags"]
+        self._head = 0  # 書き込んだサンプル数
+        self._tail = 0  # ファイルに書き出したサンプル数
+        self._high_water = capacity // 2
+        self._pending_start = [False, False]
+
+        directory = os.path.dirname(filename_base)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._files = []
+        self._indexes = []
+        self._written = []  # ファイルにあるサンプル数
+        self._elapsed = []  # ファイルにあるサンプルの合計時間
+        for path in self.paths:
+            self._open(path)
+
+        self._wake = threading.Event()
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._run, name="StickRecorder", daemon=True
+        )
+        self._thread.start()
+
+    def _open(self, path: str) -> None:
+        f = open(path, "ab")
+        if f.tell() == 0:
+            f.write(binary_header())
+            f.flush()
+            written, elapsed = 0, 0.0
+        else:
+            header = len(binary_header())
+            written = (f.tell() - header) // SAMPLE_DTYPE.itemsize
+            samples = np.memmap(
+                path, dtype=SAMPLE_DTYPE, mode="r", offset=header, shape=(written,)
+            )
+            elapsed = float(samples["duration"].sum()) if written else 0.0
+        self._files.append(f)
+        self._indexes.append(open(path + ".idx", "ab"))
+        self._written.append(written)
+        self._elapsed.append(elapsed)
+
+    def begin(self, stick: int) -> None:
+        """
+        新しい操作を始める。次にrecordしたサンプルを索引に載せる。
+        """
+        self._pending_start[stick] = True
+
+    def record(self, stick: int, angle: float, r: float, duration: float) -> bool:
+        """
+        サンプルを1つ記録する。
+
+        Args:
+            stick (int): STICK_LEFTまたはSTICK_RIGHT
+            angle (float): 角度[deg]
+            r (float): 倒す量(0〜1)
+            duration (float): 前のサンプルからの時間[s]
+
+        Returns:
+            bool: 記録できた場合はTrue(バッファがいっぱいの場合はFalse)
+        """
+        head = self._head
+        if head - self._tail >= self.capacity:
+            self.dropped += 1
+            return False
+        i = head % self.capacity
+        self._angle[i] = angle
+        self._r[i] = r
+        self._duration[i] = duration
+        self._stick[i] = stick
+        if self._pending_start[stick]:
+            self._flags[i] = STROKE_START
+            self._pending_start[stick] = False
+        else:
+            self._flags[i] = 0
+        self._head = head + 1
+        if head + 1 - self._tail >= self._high_water:
+            self._wake.set()
+        return True
+
+    def flush(self) -> None:
+        # 書き出しを急がせる(書き終わるのは待たない)
+        self._wake.set()
+
+    def close(self) -> None:
+        """
+        残っているサンプルを書き出してファイルを閉じる。
+        """
+        if not self._running:
+            return
+        self._running = False
+        self._wake.set()
+        self._thread.join(5.0)
+        for f in self._files + self._indexes:
+            f.close()
+        if self.dropped:
+            logger.warning(f"Stick recorder dropped {self.dropped} samples")
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self._write()
+            except (OSError, ValueError) as e:
+                logger.error(f"Failed to write the stick record: {e}")
+            if not self._running:
+                self._write()
+                return
+
+    def _write(self) -> None:
+        head = self._head
+        tail = self._tail
+        if head == tail:
+            return
+        records = self._buf[np.arange(tail, head) % self.capacity]
+        # コピーしたので、ここからrecordが上書きしてよい
+        self._tail = head
+        for stick, (f, index) in enumerate(zip(self._files, self._indexes)):
+            selected = records[records["stick"] == stick]
+            if not len(selected):
+                continue
+            samples = np.empty(len(selected), dtype=SAMPLE_DTYPE)
+            samples["angle"] = selected["angle"]
+            samples["r"] = selected["r"]
+            samples["duration"] = selected["duration"]
+            f.write(samples.tobytes())
+            f.flush()
+
+            starts = np.flatnonzero(selected["flags"] & STROKE_START)
+            if len(starts):
+                times = np.cumsum(selected["duration"]) - selected["duration"]
+                entries = np.empty(len(starts), dtype=INDEX_DTYPE)
+                entries["first"] = self._written[stick] + starts
+                entries["time"] = self._elapsed[stick] + times[starts]
+                index.write(entries.tobytes())
+                index.flush()
+            self._written[stick] += len(selected)
+            self._elapsed[stick] += float(selected["duration"].sum())
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 記録したスティックのログ(PlayRecで再生する「角度,倒す量,時間」の行)の読み込みと再生
+#
+# ログの形式:
+#   CSV     : 1行に"angle,r,duration"(GuiAssetsが記録する形式)
+#   バイナリ: ヘッダ"<4sBBH"(MAGIC, バージョン, 0, 0)のあとに
+#             float64(little endian)のangle, r, durationが1サンプル24バイトで並ぶ。
+#             np.memmapでそのまま読めるので、大きな記録も全体を読み込まずに再生できる。
+#             StickRecorderは記録しながら末尾に追記するので、サンプル数はファイルの大きさから求める。
+#   索引    : "<ログ>.idx"にINDEX_DTYPE(操作ごとの最初のサンプル番号とログ上の時刻)が並ぶ。
+
+import itertools
+import os
+import struct
+import time
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+import numpy as np
+
+from Commands.Scheduler import HybridScheduler
+from Commands.SerialProtocol import encode_row_frame
+
+MAGIC = b"PCTR"
+VERSION = 1
+_HEADER = struct.Struct("<4sBBH")
+SAMPLE_DTYPE = np.dtype([("angle", "<f8"), ("r", "<f8"), ("duration", "<f8")])
+INDEX_DTYPE = np.dtype([("first", "<i8"), ("time", "<f8")])
+DEFAULT_CHUNK = 4096
+END_ROW = "2 8 80 80"  # Lスティックを中央に戻す
+
+
+def binary_header() -> bytes:
+    return _HEADER.pack(MAGIC, VERSION, 0, 0)
+
+
+class PlaybackReport(NamedTuple):
+    samples: int
+    planned_duration: float
+    actual_duration: float
+    max_error: float  # 予定した送信時刻からの最大の遅れ[s]
+    mean_error: float
+
+    @property
+    def drift(self) -> float:
+        # 終了時刻のずれ[s]
+        return self.actual_duration - self.planned_duration
+
+    def __str__(self) -> str:
+        return (
+            f"{self.samples} samples in {self.actual_duration:.3f}s "
+            f"(planned {self.planned_duration:.3f}s): "
+            f"error mean {self.mean_error * 1000:.2f}ms "
+            f"max {self.max_error * 1000:.2f}ms, "
+            f"drift {self.drift * 1000:.2f}ms"
+        )
+
+
+class Trajectory:
+    """
+    スティックの軌跡(サンプルごとの角度・倒す量・時間)
+
+    サンプルはNumPyの配列で持ち、送信する値(stick_values)や行(encode)をまとめて計算する。
+    offsetはログの先頭からこの軌跡の最初のサンプルまでの時間で、
+    chunksで分割して読み込んだ場合も時刻が続くようにする。
+    """
+
+    def __init__(self, angle, r, duration, offset: float = 0.0):
+        self.angle = np.asarray(angle, dtype=np.float64)
+        self.r = np.asarray(r, dtype=np.float64)
+        self.duration = np.asarray(duration, dtype=np.float64)
+        self.offset = offset
+
+    def __len__(self) -> int:
+        return len(self.angle)
+
+    @property
+    def times(self) -> np.ndarray:
+        # 各サンプルを送る時刻(ログの先頭からの秒数)
+        return self.offset + np.cumsum(self.duration) - self.duration
+
+    @property
+    def end(self) -> float:
+        # 最後のサンプルの終わり(ログの先頭からの秒数)
+        return self.offset + float(self.duration.sum())
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[list[float]]) -> "Trajectory":
+        data = np.asarray(list(rows), dtype=np.float64).reshape(-1, 3)
+        return cls(data[:, 0], data[:, 1], data[:, 2])
+
+    @classmethod
+    def load(cls, path: str) -> "Trajectory":
+        """
+        ログ全体を読み込む(CSVとバイナリのどちらでも良い)。
+        """
+        chunks = list(cls.chunks(path))
+        if not chunks:
+            return cls([], [], [])
+        return cls(
+            np.concatenate([c.angle for c in chunks]),
+            np.concatenate([c.r for c in chunks]),
+            np.concatenate([c.duration for c in chunks]),
+        )
+
+    @classmethod
+    def chunks(
+        cls,
+        path: str,
+        size: int = DEFAULT_CHUNK,
+        start: int = 0,
+        stop: int | None = None,
+    ) -> Iterator["Trajectory"]:
+        """
+        ログをsizeサンプルずつ読み込む。
+
+        Args:
+            path (str): ログのファイル
+            size (int): 1回に読み込むサンプル数
+            start (int): 最初に読むサンプルの番号(read_indexのfirstなど)
+            stop (int | None): このサンプルの手前まで読む。Noneの場合は最後まで
+
+        Yields:
+            Trajectory: 読み込んだ部分(offsetはstartのサンプルからの時間)
+        """
+        with open(path, "rb") as f:
+            is_binary = f.read(len(MAGIC)) == MAGIC
+        read = _binary_chunks if is_binary else _csv_chunks
+        offset = 0.0
+        for data in read(path, size, start, stop):
+            chunk = cls(data[0], data[1], data[2], offset)
+            offset = chunk.end
+            yield chunk
+
+    def save(self, path: str) -> None:
+        """
+        バイナリ形式で保存する。
+        """
+        with open(path, "wb") as f:
+            f.write(binary_header())
+            f.write(self.to_samples().tobytes())
+
+    def to_samples(self) -> np.ndarray:
+        # バイナリ形式のサンプルの配列(SAMPLE_DTYPE)
+        samples = np.empty(len(self), dtype=SAMPLE_DTYPE)
+        samples["angle"] = self.angle
+        samples["r"] = self.r
+        samples["duration"] = self.duration
+        return samples
+
+    def resample(self, rate: float) -> "Trajectory":
+        """
+        一定の間隔(1/rate秒)で送る軌跡に変換する。
+
+        各時刻にはその時点で送られているサンプル(直前のサンプル)の値を使う。
+        時刻はログの先頭から数えるので、chunksで分割した軌跡を別々に変換しても間隔は揃う。
+
+        Args:
+            rate (float): 1秒あたりの送信回数
+
+        Returns:
+            Trajectory: 変換した軌跡
+        """
+        period = 1.0 / rate
+        first = int(np.ceil(self.offset * rate - 1e-9))
+        last = int(np.ceil(self.end * rate - 1e-9))
+        if last <= first or not len(self):
+            return Trajectory([], [], [], self.offset)
+        grid = np.arange(first, last) * period
+        index = np.searchsorted(self.times, grid, side="right") - 1
+        np.clip(index, 0, len(self) - 1, out=index)
+        return Trajectory(
+            self.angle[index],
+            self.r[index],
+            np.full(len(grid), period),
+            first * period,
+        )
+
+    def stick_values(self) -> np.ndarray:
+        """
+        送信するLスティックの値(PlayRec.LStickと同じ計算)をまとめて求める。
+
+        Returns:
+            np.ndarray: uint8の(x, y)の配列(yは下向きが正)
+        """
+        radians = np.deg2rad(self.angle)
+        values = np.empty((len(self), 2), dtype=np.uint8)
+        values[:, 0] = np.trunc(128 + self.r * 127.5 * np.cos(radians))
+        values[:, 1] = np.trunc(128 - self.r * 127.5 * np.sin(radians))
+        return values
+
+    def encode(self, binary: bool = False) -> list[bytes]:
+        """
+        サンプルごとに送るデータ("2 8 <x> <y>"の行またはフレーム)をまとめて作る。
+
+        同じ値の行は同じbytesを使い回す。
+
+        Args:
+            binary (bool): Sender.negotiateでバイナリフレームに切り替えた場合はTrue
+
+        Returns:
+            list[bytes]: Sender.writeEncodedに渡すデータ
+        """
+        values = self.stick_values()
+        keys = values[:, 0].astype(np.int32) << 8 | values[:, 1]
+        unique, inverse = np.unique(keys, return_inverse=True)
+        rows = []
+        for key in unique.tolist():
+            row = f"2 8 {key >> 8:x} {key & 0xFF:x}"
+            if binary:
+                rows.append(encode_row_frame(row))
+            else:
+                rows.append(row.encode("ascii") + b"\r\n")
+        return [rows[i] for i in inverse.tolist()]
+
+
+def read_index(path: str) -> np.ndarray:
+    """
+    StickRecorderが書いた索引(操作ごとの最初のサンプル番号と時刻)を読む。
+
+    Args:
+        path (str): ログのファイル(索引は"<path>.idx")
+
+    Returns:
+        np.ndarray: INDEX_DTYPEの配列(索引がない場合は空)
+    """
+    index_path = path + ".idx"
+    if not os.path.exists(index_path):
+        return np.empty(0, dtype=INDEX_DTYPE)
+    count = os.path.getsize(index_path) // INDEX_DTYPE.itemsize
+    if count == 0:
+        return np.empty(0, dtype=INDEX_DTYPE)
+    return np.memmap(index_path, dtype=INDEX_DTYPE, mode="r", shape=(count,))
+
+
+def _csv_chunks(
+    path: str, size: int, start: int, stop: int | None
+) -> Iterator[np.ndarray]:
+    with open(path) as f:
+        lines = itertools.islice((line for line in f if line.strip()), start, stop)
+        while True:
+            block = list(itertools.islice(lines, size))
+            if not block:
+                return
+            yield np.loadtxt(block, delimiter=",", ndmin=2, dtype=np.float64).T
+
+
+def _binary_chunks(
+    path: str, size: int, start: int, stop: int | None
+) -> Iterator[np.ndarray]:
+    with open(path, "rb") as f:
+        _, version, _, _ = _HEADER.unpack(f.read(_HEADER.size))
+    if version != VERSION:
+        raise ValueError(f"unsupported trajectory version: {version}")
+    # 追記中のファイルは最後のサンプルが書きかけの場合がある
+    count = (os.path.getsize(path) - _HEADER.size) // SAMPLE_DTYPE.itemsize
+    stop = count if stop is None else min(stop, count)
+    if stop <= start:
+        return
+    samples = np.memmap(
+        path, dtype=SAMPLE_DTYPE, mode="r", offset=_HEADER.size, shape=(count,)
+    )
+    for first in range(start, stop, size):
+        block = samples[first : min(first + size, stop)]
+        yield np.stack([block["angle"], block["r"], block["duration"]])
+
+
+class TrajectoryPlayer:
+    """
+    Trajectoryを締め切り基準で再生する
+
+    送るデータは再生前にまとめて作り、各サンプルは「開始時刻 + ログ上の時刻」を締め切りとして
+    HybridSchedulerで待ってから送る。送信や待機の遅れが後のサンプルに積み重ならない。
+    """
+
+    def __init__(
+        self,
+        ser,
+        scheduler: HybridScheduler | None = None,
+        check: Callable[[], object] | None = None,
+        rate: float | None = None,
+    ):
+        """
+        Args:
+            ser (Sender): 送信に使うSender
+            scheduler (HybridScheduler | None): 待機に使うスケジューラ
+            check (Callable | None): サンプルを送るたびに呼ぶ関数(PythonCommand.checkIfAliveなど)
+            rate (float | None): 指定した場合は1秒あたりrate回の送信に変換して再生する
+        """
+        self.ser = ser
+        self.scheduler = scheduler or HybridScheduler()
+        self.check = check
+        self.rate = rate
+
+    def play(
+        self, trajectory: Trajectory | Iterable[Trajectory], start: float | None = None
+    ) -> PlaybackReport:
+        """
+        軌跡を再生し、最後にLスティックを中央に戻す。
+
+        Args:
+            trajectory (Trajectory | Iterable[Trajectory]): 軌跡、
+                またはTrajectory.chunksのように順に読み込む軌跡
+            start (float | None): 開始時刻(time.perf_counter()の値)。Noneの場合は現在時刻
+
+        Returns:
+            PlaybackReport: 予定と実際の送信時刻のずれ
+        """
+        chunks = [trajectory] if isinstance(trajectory, Trajectory) else trajectory
+        if start is None:
+            start = time.perf_counter()
+        samples = 0
+        max_error = 0.0
+        total_error = 0.0
+        end = 0.0
+        binary = getattr(self.ser, "binary", False)
+        for chunk in chunks:
+            end = chunk.end
+            if self.rate:
+                chunk = chunk.resample(self.rate)
+            if not len(chunk):
+                continue
+            rows = chunk.encode(binary)
+            deadlines = (start + chunk.times).tolist()
+            errors = np.empty(len(rows))
+            for i, (deadline, row) in enumerate(zip(deadlines, rows)):
+                self.scheduler.sleep_until(deadline)
+                errors[i] = time.perf_counter() - deadline
+                self.ser.writeEncoded(row)
+                if self.check is not None:
+                    self.check()
+            samples += len(rows)
+            max_error = max(max_error, float(errors.max()))
+            total_error += float(errors.sum())
+        self.scheduler.sleep_until(start + end)
+        self.ser.writeRow(END_ROW)
+        return PlaybackReport(
+            samples,
+            end,
+            time.perf_counter() - start,
+            max_error,
+            total_error / samples if samples else 0.0,
+        )
@@ -1,16 +1,20 @@
 import os
-from tkinter import messagebox, simpledialog
 import cv2
 import io
 
 from deprecated import deprecated
-import requests
 from PIL import Image
 from loguru import logger
 import yaml
-import tkinter as tk
 from Camera import Camera
 
+try:
+    import tkinter as tk
+    from tkinter import messagebox, simpledialog
+except ImportError:
+    # WebhookGUIだけがtkinterを使う(headlessで通知を送る場合はなくてもよい)
+    tk = messagebox = simpledialog = None
+
 
 class Discord_Notify:
     """
@@ -51,7 +55,7 @@ class Discord_Notify:
         Returns:
             bytes: 画像データ（PNG形式）
         """
-        image_bgr = self.camera.readFrame()
+        image_bgr = self.camera.readFrame(copy=False)
         image_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
         image = Image.fromarray(image_rgb)
         png = io.BytesIO()
@@ -174,6 +178,9 @@ class Discord_Notify:
             else:
                 files = {}
             data = {"content": content}
+            # requestsは読み込みに時間がかかるので、送信する時にimportする
+            import requests
+
             response = requests.post(url, data=data, files=files)
             status_code = response.status_code
             if 200 <= status_code < 300:
@@ -226,7 +233,7 @@ class Discord_Notify:
 
 # GUIの設定と操作
 class WebhookGUI:
-    def __init__(self, parent: tk.Tk, webhook: Discord_Notify):
+    def __init__(self, parent: "tk.Tk", webhook: Discord_Notify):
         """
         GUIコンポーネントの初期化
 
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import glob
+import os
+from contextlib import contextmanager
+from time import perf_counter, sleep
+from typing import Iterator
+
+import cv2
+import numpy as np
+from loguru import logger
+
+from Camera import (
+    CaptureStats,
+    FrameInfo,
+    _extract_frame,
+    _get_save_filespec,
+    imwrite,
+)
+
+
+def synthetic_frames(
+    count: int = 8,
+    size: tuple[int, int] = (1280, 720),
+    templates: list[str] | None = None,
+    seed: int = 0,
+) -> list[np.ndarray]:
+    """
+    ノイズの背景にテンプレート画像を貼り付けたフレームを作る。
+
+    Args:
+        count (int): フレーム数
+        size (tuple[int, int]): フレームの(幅, 高さ)
+        templates (list[str] | None): 貼り付ける画像のパス。フレームごとに順番に1枚ずつ貼る
+        seed (int): 乱数のシード(同じ値なら同じフレームになる)
+
+    Returns:
+        list[np.ndarray]: BGRのフレーム
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    images = [cv2.imread(path) for path in templates or []]
+    images = [image for image in images if image is not None]
+    frames = []
+    for i in range(count):
+        frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        frame = cv2.GaussianBlur(frame, (7, 7), 0)
+        if images:
+            image = images[i % len(images)]
+            h, w = image.shape[:2]
+            if h < height and w < width:
+                x = int(rng.integers(0, width - w))
+                y = int(rng.integers(0, height - h))
+                frame[y : y + h, x : x + w] = image
+        frames.append(frame)
+    return frames
+
+
+def load_frames(
+    directory: str, size: tuple[int, int] = (1280, 720), limit: int = 32
+) -> list[np.ndarray]:
+    """保存済みのキャプチャ画像(Captures/など)を読み込む。大きさはsizeに揃える"""
+    frames = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.png")))[:limit]:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        if (image.shape[1], image.shape[0]) != size:
+            image = cv2.resize(image, size)
+        frames.append(image)
+    return frames
+
+
+class FakeCamera:
+    """
+    用意したフレームを順番に返すカメラ
+
+    Camera/CameraQueueと同じ読み出しAPIを持つので、実機をつながずに
+    コマンドや画像認識の処理を動かせる。
+    advance_on_read=Trueの場合は読み出しのたびに次のフレームへ進み、
+    Falseの場合はfpsの間隔で進む(waitNextFrameで次のフレームを待てる)。
+    """
+
+    def __init__(
+        self,
+        frames: list[np.ndarray],
+        fps: float = 60,
+        advance_on_read: bool = True,
+    ):
+        if not frames:
+            raise ValueError("FakeCamera needs at least one frame")
+        self.frames = []
+        for frame in frames:
+            frame = frame.copy()
+            frame.flags.writeable = False
+            self.frames.append(frame)
+        self.fps = fps
+        self.advance_on_read = advance_on_read
+        self.capture_size = (frames[0].shape[1], frames[0].shape[0])
+        self.capture_dir = "Captures"
+        self._seq = 0
+        self._start = perf_counter()
+
+    @classmethod
+    def fromDirectory(cls, directory: str, **kwargs) -> "FakeCamera":
+        frames = load_frames(directory)
+        logger.debug(f"Loaded {len(frames)} frames from {directory}")
+        return cls(frames, **kwargs)
+
+    def openCamera(self, cameraId: int) -> None:
+        pass
+
+    def isOpened(self) -> bool:
+        return True
+
+    def setFps(self, fps: float) -> None:
+        self.fps = fps
+
+    def _timed_seq(self) -> int:
+        # advance_on_read=Falseの場合の通し番号(1から始まり、1/fps秒ごとに増える)
+        return int((perf_counter() - self._start) * self.fps) + 1
+
+    def _current(self) -> tuple[np.ndarray, FrameInfo]:
+        if self.advance_on_read:
+            self._seq += 1
+            seq = self._seq
+        else:
+            seq = self._timed_seq()
+        frame = self.frames[(seq - 1) % len(self.frames)]
+        return frame, FrameInfo(seq, perf_counter())
+
+    def readFrame(
+        self,
+        copy: bool = True,
+        roi: list | tuple | None = None,
+        gray: bool = False,
+    ) -> cv2.Mat | None:
+        frame, _ = self.readFrameWithInfo(copy, roi, gray)
+        return frame
+
+    def readFrameWithInfo(
+        self,
+        copy: bool = True,
+        roi: list | tuple | None = None,
+        gray: bool = False,
+    ) -> tuple[cv2.Mat | None, FrameInfo]:
+        frame, info = self._current()
+        return _extract_frame(frame, copy, roi, gray), info
+
+    @contextmanager
+    def readFrameView(self) -> Iterator[cv2.Mat | None]:
+        frame, _ = self._current()
+        yield frame
+
+    def frameInfo(self) -> FrameInfo:
+        if self.advance_on_read:
+            return FrameInfo(self._seq, perf_counter())
+        return FrameInfo(self._timed_seq(), perf_counter())
+
+    def waitNextFrame(
+        self, after_seq: int | None = None, timeout: float | None = None
+    ) -> FrameInfo | None:
+        if self.advance_on_read:
+            return self.frameInfo()
+        if after_seq is None:
+            after_seq = self.frameInfo().seq
+        # 通し番号after_seq + 1のフレームはafter_seq / fps秒の時点で届く
+        due = self._start + after_seq / self.fps - perf_counter()
+        if timeout is not None and due > timeout:
+            sleep(timeout)
+            return None
+        sleep(max(0.0, due))
+        return self.frameInfo()
+
+    def saveCapture(
+        self,
+        filename: str | None = None,
+        crop: list | None = None,
+        crop_ax: list | None = None,
+        img: cv2.Mat | None = None,
+    ) -> None:
+        image = img if img is not None else self.readFrame(copy=False)
+        if filename is None or filename == "":
+            filename = "fake_camera"
+        save_path = _get_save_filespec(filename + ".png")
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+        imwrite(save_path, image)
+
+    def captureStats(self) -> CaptureStats:
+        return CaptureStats(float(self.fps), float(self.fps), 0.0, 0, 0, 0)
+
+    def destroy(self) -> None:
+        pass
@@ -9,13 +9,15 @@ import tkinter as tk
 from tkinter.scrolledtext import ScrolledText
 import numpy as np
 import datetime
-from collections import deque
 
 from PIL import Image, ImageTk
 
 from Commands import UnitCommand
 from Commands import StickCommand
 from Commands.Keys import Direction, Stick, Button, Direction, KeyPress
+from Commands.StickRecorder import STICK_LEFT, STICK_RIGHT, StickRecorder
+from PreviewRenderer import PreviewRenderer
+from StartupProfiler import FIRST_FRAME, startup
 
 import logging
 from logging import INFO, StreamHandler, getLogger, DEBUG, NullHandler
@@ -89,7 +91,7 @@ class CaptureArea(tk.Canvas):
         self.RStick = None
         self.calc_time = None
         self.ss = None
-        self.dq = None
+        self.recorder = None
         self._langle = None
         self._lmag = None
         self._rangle = None
@@ -102,22 +104,8 @@ class CaptureArea(tk.Canvas):
         # self._logger.addHandler(self.stick_handler)
         # self._logger.propagate = False
         if isTakeLog:
-            filename_base = os.path.join("log", f"{nowtime}")
-            self.LS = logging.FileHandler(
-                filename=f"{filename_base}_LStick.log", encoding="utf-8"
-            )
-            self.LS.setLevel(logging.DEBUG)
-            self.LSTICK_logger = logging.getLogger("L_STICK")
-            self.LSTICK_logger.setLevel(logging.DEBUG)
-            self.LSTICK_logger.addHandler(self.LS)
-
-            self.RS = logging.FileHandler(
-                filename=f"{filename_base}_RStick.log", encoding="utf-8"
-            )
-            self.RS.setLevel(logging.DEBUG)
-            self.RSTICK_logger = logging.getLogger("R_STICK")
-            self.RSTICK_logger.setLevel(logging.DEBUG)
-            self.RSTICK_logger.addHandler(self.RS)
+            # log/<日時>_LStick.pctr, log/<日時>_RStick.pctr (PlayRecで再生できる)
+            self.recorder = StickRecorder(os.path.join("log", f"{nowtime}"))
         # self.circle =
 
         self.setFps(fps)
@@ -136,6 +124,11 @@ class CaptureArea(tk.Canvas):
         # self.configure(image=self.disabled_tk)  # labelからキャンバスに変更したので微修正
         self.im_ = self.create_image(0, 0, image=self.disabled_tk, anchor=tk.NW)
 
+        # プレビューの縮小と色変換は別スレッドで行い、PhotoImageは使い回す
+        self.renderer = PreviewRenderer(camera, self.show_size, self.next_frames)
+        self.preview_tk = None
+        self._capture_due = None
+
     def ApplyLStickMouse(self):
         if self.master.is_use_left_stick_mouse.get():
             self.BindLeftClick()
@@ -265,7 +258,7 @@ class CaptureArea(tk.Canvas):
         )
 
     def mouseCtrlLeftPress(self, event):
-        _img = cv2.cvtColor(self.camera.readFrame(), cv2.COLOR_BGR2RGB)
+        _img = cv2.cvtColor(self.camera.readFrame(copy=False), cv2.COLOR_BGR2RGB)
         if self.master.is_use_left_stick_mouse.get():
             self.UnbindLeftClick()
         x, y = event.x, event.y
@@ -320,16 +313,13 @@ class CaptureArea(tk.Canvas):
         # self.LStick = StickCommand.StickLeft()
         # self.LStick.start(ser)
         if isTakeLog:
-            if self.dq is None:
-                self.dq = deque()
-            else:
-                self.dq.clear()
-
+            self.recorder.begin(STICK_LEFT)
             if self.calc_time is None:
                 self.calc_time = time.perf_counter()
             else:
-                # LSTICK_logger.debug(f"{0},{0},{time.perf_counter() - self.calc_time}")
-                self.dq.append([0, 0, time.perf_counter() - self.calc_time])
+                self.recorder.record(
+                    STICK_LEFT, 0, 0, time.perf_counter() - self.calc_time
+                )
             self._langle = None
             self._lmag = None
 
@@ -358,8 +348,9 @@ class CaptureArea(tk.Canvas):
                     f"{hex(int(128 - mag * 127.5 * np.sin(np.deg2rad(langle))))} "
                     f"80 80",
                     is_show=False,
+                    coalesce=True,
                 )
-                self.dq.append([langle, mag, _time - self.calc_time])
+                self.recorder.record(STICK_LEFT, langle, mag, _time - self.calc_time)
                 self.calc_time = _time
         elif not isTakeLog:
             self.ser.writeRow(
@@ -368,6 +359,7 @@ class CaptureArea(tk.Canvas):
                 f"{hex(int(128 - mag * 127.5 * np.sin(np.deg2rad(langle))))}"
                 f" 80 80",
                 is_show=False,
+                coalesce=True,
             )
 
         if mag >= 1:
@@ -402,11 +394,14 @@ class CaptureArea(tk.Canvas):
             self.BindRightClick()
         # self.event_generate('<Motion>', warp=True, x=self.lx_init, y=self.ly_init)
         if isTakeLog:
-            self.dq.append(
-                [self._langle, self._lmag, time.perf_counter() - self.calc_time]
+            # ファイルへの書き出しはStickRecorderのスレッドが行う
+            self.recorder.record(
+                STICK_LEFT,
+                self._langle or 0,
+                self._lmag or 0,
+                time.perf_counter() - self.calc_time,
             )
-            for _ in self.dq:
-                self.LSTICK_logger.debug(",".join(list(map(str, _))))
+            self.recorder.flush()
 
     def mouseRightPress(self, event, ser):
         if self.master.is_use_left_stick_mouse.get():
@@ -433,16 +428,13 @@ class CaptureArea(tk.Canvas):
         # self.RStick = StickCommand.StickRight()
         # self.RStick.start(ser)
         if isTakeLog:
-            if self.dq is None:
-                self.dq = deque()
-            else:
-                self.dq.clear()
-
+            self.recorder.begin(STICK_RIGHT)
             if self.calc_time is None:
                 self.calc_time = time.perf_counter()
             else:
-                # LSTICK_logger.debug(f"{0},{0},{time.perf_counter() - self.calc_time}")
-                self.dq.append([0, 0, time.perf_counter() - self.calc_time])
+                self.recorder.record(
+                    STICK_RIGHT, 0, 0, time.perf_counter() - self.calc_time
+                )
         self._rangle = None
         self._rmag = None
 
@@ -456,7 +448,7 @@ class CaptureArea(tk.Canvas):
             mag = 0
         elif mag >= 1:
             mag = 1
-        if (self._langle and self._lmag) is not None and isTakeLog:
+        if (self._rangle and self._rmag) is not None and isTakeLog:
             _time = time.perf_counter()
             if _time - self.calc_time > 0.05:
                 # thread_1 = threading.Thread(target=self.RStick.RStick,
@@ -469,8 +461,9 @@ class CaptureArea(tk.Canvas):
                     f"{hex(int(128 + mag * 127.5 * np.cos(np.deg2rad(rangle))))} "
                     f"{hex(int(128 - mag * 127.5 * np.sin(np.deg2rad(rangle))))}",
                     is_show=False,
+                    coalesce=True,
                 )
-                self.dq.append([rangle, mag, _time - self.calc_time])
+                self.recorder.record(STICK_RIGHT, rangle, mag, _time - self.calc_time)
                 self.calc_time = _time
         elif not isTakeLog:
             self.ser.writeRow(
@@ -478,6 +471,7 @@ class CaptureArea(tk.Canvas):
                 f"{hex(int(128 + mag * 127.5 * np.cos(np.deg2rad(rangle))))} "
                 f"{hex(int(128 - mag * 127.5 * np.sin(np.deg2rad(rangle))))}",
                 is_show=False,
+                coalesce=True,
             )
         if mag >= 1:
             center_x = (self.radius + self.radius // 11) * np.cos(np.deg2rad(rangle))
@@ -512,36 +506,59 @@ class CaptureArea(tk.Canvas):
 
         # self.event_generate('<Motion>', warp=True, x=self.rx_init, y=self.ry_init)
         if isTakeLog:
-            self.dq.append(
-                [self._rangle, self._rmag, time.perf_counter() - self.calc_time]
+            self.recorder.record(
+                STICK_RIGHT,
+                self._rangle or 0,
+                self._rmag or 0,
+                time.perf_counter() - self.calc_time,
             )
-            for _ in self.dq:
-                self.RSTICK_logger.debug(",".join(list(map(str, _))))
+            self.recorder.flush()
 
     def startCapture(self):
+        self.renderer.start()
         self.capture()
 
     def capture(self):
-        if self.is_show_var.get():
-            image_bgr = self.camera.readFrame()
-        else:
-            self.after(self.next_frames, self.capture)
-            return
+        start = time.perf_counter()
+        lateness = 0.0 if self._capture_due is None else start - self._capture_due
+        renderer = self.renderer
+        renderer.enabled = self.is_show_var.get()
+        renderer.size = self.show_size
+        renderer.interval_ms = self.next_frames
+
+        # 前回から新しいフレームが届いていなければ何もしない
+        ready = renderer.take() if renderer.enabled else None
+        if ready is not None:
+            _, image_rgb = ready
+            if image_rgb is not None:
+                height, width = image_rgb.shape[:2]
+                if (
+                    self.preview_tk is None
+                    or self.preview_tk.width() != width
+                    or self.preview_tk.height() != height
+                ):
+                    self.preview_tk = ImageTk.PhotoImage("RGB", (width, height))
+                self.preview_tk.paste(Image.fromarray(image_rgb))
+                if self.im is not self.preview_tk:
+                    self.im = self.preview_tk
+                    # self.configure( image=image_tk)
+                    self.itemconfig(self.im_, image=self.preview_tk)
+                startup.mark(FIRST_FRAME)
+            elif self.im is not self.disabled_tk:
+                self.im = self.disabled_tk
+                # self.configure(image=self.disabled_tk)
+                self.itemconfig(self.im_, image=self.disabled_tk)
+
+        # Tkの処理が追いつかない場合は表示の間隔を伸ばす
+        interval = renderer.next_interval(time.perf_counter() - start, lateness)
+        self._capture_due = time.perf_counter() + interval / 1000
+        self.after(interval, self.capture)
 
-        if image_bgr is not None:
-            image_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
-            image_pil = Image.fromarray(image_rgb).resize(self.show_size)
-            image_tk = ImageTk.PhotoImage(image_pil)
-
-            self.im = image_tk
-            # self.configure( image=image_tk)
-            self.itemconfig(self.im_, image=image_tk)
-        else:
-            self.im = self.disabled_tk
-            # self.configure(image=self.disabled_tk)
-            self.itemconfig(self.im_, image=self.disabled_tk)
-
-        self.after(self.next_frames, self.capture)
+    def destroy(self):
+        self.renderer.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+        super().destroy()
 
     def saveCapture(self):
         self.camera.saveCapture()
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+GUIを使わずにPythonコマンドを実行する
+
+Tkのウィンドウを作らないので、X serverのないサーバーでも動く。設定はsettings.iniから読み込み、
+コマンドラインの引数で上書きする。プレビューは表示しない。
+コマンドのダイアログ(dialogue/dialogue6widget)には、--answersのJSONファイルか
+--answerで指定した値を答える。指定がない項目は初期値のまま。
+
+    cd SerialController
+    python -m Headless list
+    python -m Headless run <コマンド名> --camera 0 --port /dev/ttyUSB0
+    python -m Headless run <コマンド名> --frames Captures --port /dev/pts/3 \\
+        --answer "設定:回数=10" --answers answers.json
+
+answers.jsonの形式(ダイアログのタイトルごとに、項目名と値の辞書・値のリスト・キャンセルならfalse):
+
+    {"設定": {"回数": "10", "色違いのみ": true}, "確認": false}
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+from typing import Any
+
+from loguru import logger
+
+import Settings
+import Utility as util
+from CommandLoader import CommandEntry, CommandLoader
+from Commands import PythonCommandBase, Sender
+
+
+def _to_bool(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.strip().casefold() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def _to_str(value: Any) -> str:
+    # tk.StringVarと同じく文字列で返す(JSONのtrue/falseもtkの表記にそろえる)
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return str(value)
+
+
+class DialogueAnswers:
+    """
+    PokeConDialogueの代わりに、あらかじめ用意した答えを返す
+
+    PythonCommand.dialogue_answersに設定すると、dialogue/dialogue6widgetは
+    ウィンドウを開かずにanswerの戻り値を返す。戻り値の形はPokeConDialogue.ret_valueと同じ。
+    """
+
+    def __init__(self, answers: dict | None = None):
+        """
+        Args:
+            answers (dict | None): ダイアログのタイトルをキーにした答え。
+                値は{項目名: 値}、[値, ...](項目の順)、またはFalse(キャンセル)
+        """
+        self.answers = dict(answers or {})
+
+    @classmethod
+    def load(cls, path: str | None = None, pairs: list[str] | None = None):
+        """
+        JSONファイルと"タイトル:項目名=値"の形の指定から作る。
+
+        Args:
+            path (str | None): 答えを書いたJSONファイル
+            pairs (list[str] | None): "タイトル:項目名=値"のリスト。値がJSONとして読めればその値、
+                読めなければ文字列として扱う。JSONファイルの同じ項目より優先する
+
+        Returns:
+            DialogueAnswers: 答え
+        """
+        answers = {}
+        if path is not None:
+            with open(path, encoding="utf-8") as f:
+                answers = json.load(f)
+        for pair in pairs or []:
+            key, sep, text = pair.partition("=")
+            title, sep2, label = key.partition(":")
+            if not sep or not sep2:
+                raise ValueError(f"expected TITLE:LABEL=VALUE, got {pair!r}")
+            try:
+                value = json.loads(text)
+            except ValueError:
+                value = text
+            entry = answers.get(title)
+            if not isinstance(entry, dict):
+                entry = answers[title] = {}
+            entry[label] = value
+        return cls(answers)
+
+    def answer(
+        self, title: str, message: int | str | list, need: type = list, mode: int = 0
+    ) -> list | dict | bool:
+        """
+        ダイアログの答えを返す。
+
+        Args:
+            title (str): ダイアログのタイトル
+            message (int | str | list): PokeConDialogueのmessage(modeによって形が異なる)
+            need (type): listまたはdict
+            mode (int): 0の場合はEntryだけ、1の場合は6種類のwidget
+
+        Returns:
+            list | dict | bool: 答え。キャンセルした場合はFalse
+        """
+        fields = self._fields(message, mode)
+        answer = self.answers.get(title)
+        if answer is False:
+            logger.info(f"Dialogue '{title}': cancelled")
+            return False
+        values = {label: default for label, default, _ in fields}
+        if answer is None:
+            logger.warning(f"Dialogue '{title}': no answer given, using the defaults")
+        elif isinstance(answer, list):
+            for (label, _, _), value in zip(fields, answer):
+                values[label] = value
+        elif isinstance(answer, dict):
+            for label, value in answer.items():
+                if label not in values:
+                    logger.warning(f"Dialogue '{title}': no item named '{label}'")
+                    continue
+                values[label] = value
+        else:
+            raise ValueError(f"Dialogue '{title}': invalid answer {answer!r}")
+
+        result = {label: convert(values[label]) for label, _, convert in fields}
+        logger.info(f"Dialogue '{title}': {result}")
+        if need == dict:
+            return result
+        return list(result.values())
+
+    @staticmethod
+    def _fields(message: int | str | list, mode: int) -> list[tuple]:
+        # (項目名, 初期値, 値の変換)のリスト
+        if mode == 0:
+            if type(message) is not list:
+                message = [message]
+            return [(label, "", _to_str) for label in message]
+        fields = []
+        for widget in message:
+            kind = widget[0].casefold()
+            if kind == "check":
+                fields.append((widget[1], widget[2], _to_bool))
+            elif kind == "entry":
+                fields.append((widget[1], widget[2], _to_str))
+            elif kind in ("combo", "radio", "spin"):
+                fields.append((widget[1], widget[3], _to_str))
+            elif kind == "scale":
+                digit = widget[5]
+                if digit != 0:
+                    fields.append(
+                        (widget[1], widget[4], lambda v, d=digit: round(float(v), d))
+                    )
+                else:
+                    fields.append((widget[1], widget[4], lambda v: int(float(v))))
+        return fields
+
+
+def parse_port(port: str | None, settings: Settings.GuiSettings) -> tuple[int, str]:
+    """
+    --portの値をSender.openSerialの(portNum, portName)にする。
+
+    数字だけの場合はポート番号(COM3なら3)、それ以外はポート名("/dev/ttyUSB0"など)。
+    指定がない場合はsettings.iniの値を使う。
+    """
+    if port is None:
+        return settings.com_port.get(), settings.com_port_name.get()
+    if port.isdigit():
+        return int(port), ""
+    return 0, port
+
+
+def open_camera(
+    camera_id: int | None = None,
+    frames: str | None = None,
+    fps: int = 45,
+    backend: str = "thread",
+):
+    """
+    カメラを開く。
+
+    Args:
+        camera_id (int | None): カメラのID
+        frames (str | None): 指定した場合はカメラの代わりにこのディレクトリの画像を返すFakeCameraを使う
+        fps (int): キャプチャのFPS
+        backend (str): "thread"(Camera)または"process"(CameraQueue)
+
+    Returns:
+        Camera | CameraQueue | FakeCamera: カメラ
+    """
+    if frames is not None:
+        from FakeCamera import FakeCamera
+
+        return FakeCamera.fromDirectory(frames, fps=fps, advance_on_read=False)
+
+    from Camera import Camera, CameraQueue
+
+    camera = CameraQueue(int(fps)) if backend == "process" else Camera(fps)
+    camera.openCamera(camera_id)
+    return camera
+
+
+def open_serial(
+    port_num: int,
+    port_name: str = "",
+    baudrate: int = 9600,
+    protocol: str = "text",
+    async_write: bool = False,
+    show_serial: bool = False,
+    writer: Sender.SerialWriter | None = None,
+) -> Sender.Sender | None:
+    """
+    シリアルポートを開く。開けなかった場合はNone。
+
+    protocolが"auto"の場合はSender.negotiateでバイナリフレームに対応しているか確認する。
+    writerを渡した場合は、そのSerialWriterのスレッドから書き込む(他のポートと共有できる)。
+    """
+    ser = Sender.Sender(
+        Settings.Variable(value=show_serial),
+        if_print=False,
+        async_write=async_write,
+        writer=writer,
+    )
+    if not ser.openSerial(port_num, port_name, baudrate):
+        return None
+    if protocol == "auto":
+        ser.negotiate()
+    return ser
+
+
+def load_command_classes(path: str = "Commands/PythonCommands") -> list[CommandEntry]:
+    # モジュールはimportせずに一覧だけを作る(find_commandで見つけたものだけimportする)
+    return CommandLoader(util.ospath(path), PythonCommandBase.PythonCommand).load()
+
+
+def find_command(name: str, classes: list) -> type:
+    """
+    NAMEまたはクラス名が一致するコマンドを探す。
+
+    Args:
+        name (str): コマンドのNAMEまたはクラス名
+        classes (list): CommandLoader.loadの結果(CommandEntry)またはコマンドのクラス
+
+    Returns:
+        type: コマンドのクラス(CommandEntryの場合はここでモジュールをimportする)
+
+    Raises:
+        KeyError: 見つからない場合
+        ImportError: コマンドのモジュールを読み込めない場合
+    """
+
+    def class_name(command) -> str:
+        if isinstance(command, CommandEntry):
+            return command.class_name
+        return command.__name__
+
+    for matches in (lambda c: c.NAME == name, lambda c: class_name(c) == name):
+        for command in classes:
+            if matches(command):
+                if isinstance(command, CommandEntry):
+                    return command.load()
+                return command
+    raise KeyError(name)
+
+
+def create_command(cls: type, camera, answers: DialogueAnswers | None = None):
+    """
+    コマンドを作る(プレビューがないので、画像認識のコマンドにはguiを渡さない)。
+    """
+    if issubclass(cls, PythonCommandBase.ImageProcPythonCommand):
+        command = cls(camera)
+    else:
+        command = cls()
+    command.dialogue_answers = answers or DialogueAnswers()
+    return command
+
+
+def run_command(command, ser: Sender.Sender, timeout: float | None = None) -> bool:
+    """
+    コマンドを実行して終わるまで待つ。Ctrl+Cまたはtimeout秒で停止を要求する。
+
+    Returns:
+        bool: コマンドが終わった場合はTrue(停止を要求してもtimeout秒以内に終わらなければFalse)
+    """
+    finished = threading.Event()
+    command.start(ser, finished.set)
+    try:
+        if finished.wait(timeout):
+            return True
+        logger.info(f"{command.NAME}: timed out after {timeout} s, stopping")
+    except KeyboardInterrupt:
+        logger.info(f"{command.NAME}: interrupted, stopping")
+    try:
+        command.end(ser)
+    except PythonCommandBase.StopThread:
+        # 停止を要求する前に終わっていた
+        return True
+    # 停止はwait/pressなどの呼び出しで反映されるので、少し待つ
+    return finished.wait(10.0)
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m Headless", description=__doc__.split("\n\n")[1]
+    )
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    subparsers.add_parser("list", help="実行できるコマンドの一覧を表示する")
+    run = subparsers.add_parser("run", help="コマンドを実行する")
+    run.add_argument("command", help="コマンドのNAMEまたはクラス名")
+    run.add_argument("--camera", type=int, help="カメラのID(省略時はsettings.iniの値)")
+    run.add_argument("--frames", help="カメラの代わりに使う画像のディレクトリ")
+    run.add_argument("--port", help="ポート番号またはポート名(/dev/ttyUSB0, COM3など)")
+    run.add_argument("--baud", type=int, help="ボーレート")
+    run.add_argument("--fps", type=int, help="キャプチャのFPS")
+    run.add_argument("--protocol", choices=["text", "auto"], help="シリアルの送り方")
+    run.add_argument("--capture-backend", choices=["thread", "process"])
+    run.add_argument("--async-serial", action="store_true", default=None)
+    run.add_argument("--show-serial", action="store_true", help="送った入力を表示する")
+    run.add_argument("--answers", help="ダイアログの答えを書いたJSONファイル")
+    run.add_argument(
+        "--answer",
+        action="append",
+        default=[],
+        metavar="TITLE:LABEL=VALUE",
+        help="ダイアログの答え(複数指定できる)",
+    )
+    run.add_argument("--timeout", type=float, help="この秒数が過ぎたら停止する")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    # Window.pyと同じく、SerialControllerの中で実行する
+    if "SerialController" in os.listdir():
+        os.chdir("SerialController")
+    args = _build_parser().parse_args(argv)
+
+    Settings.GuiSettings.headless = True
+    settings = Settings.GuiSettings()
+    classes = load_command_classes()
+    if args.action == "list":
+        for cls in classes:
+            print(cls.NAME)
+        return 0
+
+    try:
+        cls = find_command(args.command, classes)
+        answers = DialogueAnswers.load(args.answers, args.answer)
+    except KeyError:
+        logger.error(f"No command named '{args.command}'")
+        return 2
+    except ImportError as e:
+        logger.error(f"Cannot load '{args.command}': {e}")
+        return 2
+    except (OSError, ValueError) as e:
+        logger.error(f"Cannot read the dialogue answers: {e}")
+        return 2
+
+    fps = args.fps if args.fps is not None else int(settings.fps.get())
+    try:
+        camera = open_camera(
+            args.camera if args.camera is not None else settings.camera_id.get(),
+            args.frames,
+            fps,
+            args.capture_backend or settings.capture_backend.get(),
+        )
+    except (OSError, ValueError) as e:
+        # --framesのディレクトリがない、または画像が1枚もない場合など
+        logger.error(f"Cannot open the camera: {e}")
+        return 2
+    port_num, port_name = parse_port(args.port, settings)
+    ser = open_serial(
+        port_num,
+        port_name,
+        args.baud or settings.baud_rate.get(),
+        args.protocol or settings.serial_protocol.get(),
+        (
+            args.async_serial
+            if args.async_serial is not None
+            else settings.is_async_serial.get()
+        ),
+        args.show_serial,
+    )
+    if ser is None:
+        camera.destroy()
+        return 1
+
+    try:
+        command = create_command(cls, camera, answers)
+        logger.info(f"Start {command.NAME}")
+        finished = run_command(command, ser, args.timeout)
+        logger.info(f"{command.NAME}: {'finished' if finished else 'did not stop'}")
+    finally:
+        ser.closeSerial()
+        camera.destroy()
+    return 0 if finished else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,22 @@
 import configparser
-from typing import Any, Optional
+from typing import TYPE_CHECKING, Any, Optional
 import cv2
 import io
 import os
 
-import requests
 from PIL import Image
 from loguru import logger
 
+if TYPE_CHECKING:
+    import requests
+
 
 class Line_Notify:
     def __init__(self, camera: Optional[Any] = None, token_name: str = "token"):
         try:
+            # 起動時間を短くするため、requestsは使う時にimportする
+            import requests
+
             self.res: list[requests.Response] | requests.Response | None = None
             self.token_file = configparser.ConfigParser(
                 comment_prefixes="#", allow_no_value=True
@@ -73,6 +78,8 @@ class Line_Notify:
         """
         LINEにテキストを通知する
         """
+        import requests
+
         line_notify_api = "https://notify-api.line.me/api/notify"
         try:
             headers = {"Authorization": f"Bearer {self.token_list[token]}"}
@@ -101,7 +108,7 @@ class Line_Notify:
                 self.send_text(notification_message)
                 return
 
-            image_bgr = self.camera.readFrame()
+            image_bgr = self.camera.readFrame(copy=False)
             image_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
             image = Image.fromarray(image_rgb)
             png = io.BytesIO()  # 空のio.BytesIOオブジェクトを用意
@@ -110,6 +117,8 @@ class Line_Notify:
             )  # 空のio.BytesIOオブジェクトにpngファイルとして書き込み
             b_frame = png.getvalue()  # io.BytesIOオブジェクトをbytes形式で読みとり
 
+            import requests
+
             line_notify_api = "https://notify-api.line.me/api/notify"
             headers = {"Authorization": f"Bearer {self.token_list[token]}"}
             data = {"Message": f"{notification_message}"}
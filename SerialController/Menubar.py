@@ -3,12 +3,11 @@ from typing import Any
 import cv2
 import tkinter as tk
 
-from KeyConfig import PokeKeycon
-from LineNotify import Line_Notify
-from get_pokestatistics import GetFromHomeGUI
-import DiscordNotify
 from loguru import logger
 
+# メニューから開く機能(KeyConfig, LineNotify, get_pokestatistics, DiscordNotify)は
+# pandasやrequestsを使うので、起動時間を短くするため最初に開く時にimportする
+
 
 class PokeController_Menubar(tk.Menu):
     def __init__(self, master, **kw):  # type: ignore
@@ -69,6 +68,8 @@ class PokeController_Menubar(tk.Menu):
             self.poke_treeview.focus_force()
             return
 
+        from get_pokestatistics import GetFromHomeGUI
+
         window2 = GetFromHomeGUI(
             self.root, self.settings.season, self.settings.is_SingleBattle
         )
@@ -84,6 +85,8 @@ class PokeController_Menubar(tk.Menu):
         try:
             logger.debug("Show line API")
             if self.line is None:
+                from LineNotify import Line_Notify
+
                 self.line = Line_Notify(self.camera)
             print(self.line)
             self.line.getRateLimit()
@@ -98,6 +101,8 @@ class PokeController_Menubar(tk.Menu):
             self.key_config.focus_force()
             return
 
+        from KeyConfig import PokeKeycon
+
         kc_window = PokeKeycon(self.root)
         kc_window.protocol("WM_DELETE_WINDOW", self.closingKeyConfig)
         self.key_config = kc_window
@@ -113,6 +118,8 @@ class PokeController_Menubar(tk.Menu):
         self.show_size_cb.current(0)
 
     def open_discord_notify_setting(self) -> None:
+        import DiscordNotify
+
         webhook = DiscordNotify.Discord_Notify()
         DiscordNotify.WebhookGUI(self.root, webhook=webhook)
 
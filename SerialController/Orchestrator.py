@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+複数の機材(カメラとシリアルポートの組)のコマンドを1つのプロセスで動かす
+
+機材ごとにGUIのプロセスを起動する代わりに、Python・OpenCV・読み込んだコマンドを共有する。
+テンプレート画像のキャッシュ(template_cache)とマッチング(template_matcher)はもともと
+プロセス全体で共有しているので、同じテンプレートを使う機材が増えても読み込みは1回で済む。
+シリアルへの書き込みは1つのSerialWriterのスレッドが全てのポートに送る。
+機材ごとに残るのは、カメラの読み込みスレッド(grabがデバイスを待つため)とコマンドのスレッドだけ。
+
+    cd SerialController
+    python -m Orchestrator fleet.json
+
+fleet.jsonの形式(defaultsは全ての機材に共通の値。各項目はHeadless runの引数と同じ意味):
+
+    {
+        "defaults": {"baudrate": 115200, "protocol": "auto", "fps": 30},
+        "rigs": [
+            {"name": "rig1", "command": "A連打", "camera": 0, "port": "/dev/ttyUSB0"},
+            {"name": "rig2", "command": "A連打", "camera": 1, "port": "/dev/ttyUSB1",
+             "answers": {"設定": {"回数": "10"}}}
+        ]
+    }
+
+実行中は標準入力から操作できる: status / start [名前] / stop [名前] / quit
+"""
+
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from typing import NamedTuple
+
+from loguru import logger
+
+import Headless
+import Settings
+from Commands.PythonCommandBase import StopThread
+from Commands.Sender import SerialWriter
+
+# Rig.state
+IDLE = "idle"
+RUNNING = "running"
+STOPPING = "stopping"
+FINISHED = "finished"
+ERROR = "error"
+
+
+class RigConfig(NamedTuple):
+    name: str
+    command: str  # コマンドのNAMEまたはクラス名
+    camera: int = 0  # カメラのID
+    frames: str | None = None  # カメラの代わりに使う画像のディレクトリ(FakeCamera)
+    port: str | None = None  # ポート番号またはポート名
+    baudrate: int = 9600
+    protocol: str = "text"  # "text"または"auto"
+    fps: int = 30  # キャプチャのFPS。低くすると読み捨てるフレームが増え、デコードが減る
+    capture_backend: str = "thread"
+    answers: dict | None = None  # ダイアログの答え(Headless.DialogueAnswers)
+
+    @classmethod
+    def from_dict(cls, data: dict, defaults: dict | None = None) -> "RigConfig":
+        values = {**(defaults or {}), **data}
+        unknown = set(values) - set(cls._fields)
+        if unknown:
+            raise ValueError(f"unknown rig settings: {', '.join(sorted(unknown))}")
+        return cls(**values)
+
+
+class RigStatus(NamedTuple):
+    name: str
+    state: str
+    health: str  # "ok", "no camera", "no serial", "slow capture"
+    command: str
+    runs: int  # コマンドを開始した回数
+    fps: float  # キャプチャの実測FPS
+    target_fps: float
+    capture_latency_ms: float  # フレームの撮影から配信までの時間
+    serial_sent: int  # 送った行の数
+    serial_p99_ms: float  # 指定した送信時刻からの遅れ(99パーセンタイル)
+    message: str  # エラーの内容など
+
+
+class Rig:
+    """
+    1組のカメラとシリアルポートと、そこで動かすコマンド
+    """
+
+    SLOW_CAPTURE_RATIO = 0.5  # 実測FPSが設定値のこの割合を下回ったらslow capture
+
+    def __init__(
+        self, config: RigConfig, command_class: type, writer: SerialWriter | None
+    ):
+        self.config = config
+        self.command_class = command_class
+        self.writer = writer
+        self.camera = None
+        self.ser = None
+        self.command = None
+        self.state = IDLE
+        self.runs = 0
+        self.message = ""
+        self._answers = Headless.DialogueAnswers(config.answers)
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        self._finished.set()
+
+    @property
+    def name(self) -> str:
+        return self.config.name
+
+    def open(self) -> bool:
+        """
+        カメラとシリアルポートを開く。
+
+        Returns:
+            bool: どちらも開けた場合はTrue
+        """
+        config = self.config
+        try:
+            self.camera = Headless.open_camera(
+                config.camera, config.frames, config.fps, config.capture_backend
+            )
+            settings = Settings.GuiSettings() if config.port is None else None
+            port_num, port_name = Headless.parse_port(config.port, settings)
+            self.ser = Headless.open_serial(
+                port_num,
+                port_name,
+                config.baudrate,
+                config.protocol,
+                writer=self.writer,
+            )
+        except Exception as e:
+            self._fail(f"cannot open: {e}")
+            return False
+        if self.ser is None:
+            self._fail(f"cannot open the serial port {config.port}")
+            return False
+        return True
+
+    def start(self) -> bool:
+        """
+        コマンドを開始する。すでに実行中の場合や開けていない場合はFalse。
+        """
+        with self._lock:
+            if self.state in (RUNNING, STOPPING) or self.ser is None:
+                return False
+            self.command = Headless.create_command(
+                self.command_class, self.camera, self._answers
+            )
+            self._finished.clear()
+            self.state = RUNNING
+            self.runs += 1
+            self.message = ""
+        logger.info(f"[{self.name}] start {self.command.NAME}")
+        self.command.start(self.ser, self._on_finished)
+        return True
+
+    def stop(self) -> None:
+        # 停止を要求する(コマンドはwait/pressなどの呼び出しで止まる)
+        with self._lock:
+            if self.state != RUNNING:
+                return
+            self.state = STOPPING
+        logger.info(f"[{self.name}] stop {self.command.NAME}")
+        try:
+            self.command.end(self.ser)
+        except StopThread:
+            # 停止を要求する前に終わっていた
+            pass
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._finished.wait(timeout)
+
+    def close(self, timeout: float = 10.0) -> None:
+        self.stop()
+        if not self.wait(timeout):
+            logger.warning(f"[{self.name}] the command did not stop")
+        if self.ser is not None:
+            self.ser.closeSerial()
+            self.ser = None
+        if self.camera is not None:
+            self.camera.destroy()
+            self.camera = None
+
+    def status(self) -> RigStatus:
+        if self.camera is not None:
+            capture = self.camera.captureStats()
+            fps, target, latency = (
+                capture.fps,
+                capture.target_fps,
+                capture.latency_ms,
+            )
+        else:
+            fps, target, latency = 0.0, float(self.config.fps), 0.0
+        serial = self.ser.writerStats() if self.ser is not None else None
+
+        if self.camera is None or not self.camera.isOpened():
+            health = "no camera"
+        elif self.ser is None or not self.ser.isOpened():
+            health = "no serial"
+        elif self.state == RUNNING and fps < target * self.SLOW_CAPTURE_RATIO:
+            health = "slow capture"
+        else:
+            health = "ok"
+        return RigStatus(
+            self.name,
+            self.state,
+            health,
+            self.command_class.NAME,
+            self.runs,
+            fps,
+            target,
+            latency,
+            serial.sent if serial is not None else 0,
+            serial.jitter_p99_ms if serial is not None else 0.0,
+            self.message,
+        )
+
+    def _on_finished(self) -> None:
+        with self._lock:
+            if self.state in (RUNNING, STOPPING):
+                self.state = FINISHED
+        logger.info(f"[{self.name}] {self.command_class.NAME} finished")
+        self._finished.set()
+
+    def _fail(self, message: str) -> None:
+        logger.error(f"[{self.name}] {message}")
+        self.state = ERROR
+        self.message = message
+
+
+class Orchestrator:
+    """
+    複数のRigをまとめて管理する
+
+    シリアルへの書き込みは全てのRigで1つのSerialWriterを共有する(async_serial=Falseの場合は
+    コマンドのスレッドから直接書き込む)。
+    """
+
+    def __init__(
+        self,
+        configs: list[RigConfig],
+        command_classes: list[type] | None = None,
+        async_serial: bool = True,
+    ):
+        """
+        Args:
+            configs (list[RigConfig]): 機材ごとの設定
+            command_classes (list[type] | None): 使えるコマンド。Noneの場合は
+                Commands/PythonCommandsから読み込む
+            async_serial (bool): 共有のSerialWriterから書き込むかどうか
+
+        Raises:
+            KeyError: configsのコマンドが見つからない場合
+            ValueError: 機材の名前が重複している場合
+        """
+        names = [config.name for config in configs]
+        if len(set(names)) != len(names):
+            raise ValueError("rig names must be unique")
+        if command_classes is None:
+            command_classes = Headless.load_command_classes()
+        self.writer = SerialWriter() if async_serial else None
+        self.rigs: dict[str, Rig] = {
+            config.name: Rig(
+                config,
+                Headless.find_command(config.command, command_classes),
+                self.writer,
+            )
+            for config in configs
+        }
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "Orchestrator":
+        """fleet.jsonから作る"""
+        with open(path, encoding="utf-8") as f:
+            fleet = json.load(f)
+        defaults = fleet.get("defaults", {})
+        configs = [RigConfig.from_dict(rig, defaults) for rig in fleet["rigs"]]
+        return cls(configs, **kwargs)
+
+    def __enter__(self) -> "Orchestrator":
+        self.open()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def open(self) -> None:
+        for rig in self.rigs.values():
+            rig.open()
+
+    def start(self, names: list[str] | None = None) -> None:
+        for rig in self._select(names):
+            rig.start()
+
+    def stop(self, names: list[str] | None = None) -> None:
+        for rig in self._select(names):
+            rig.stop()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """全てのコマンドが終わるまで待つ。timeout秒以内に終わった場合はTrue"""
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        for rig in self.rigs.values():
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - time.perf_counter(), 0.0)
+            if not rig.wait(remaining):
+                return False
+        return True
+
+    def running(self) -> bool:
+        return any(rig.state in (RUNNING, STOPPING) for rig in self.rigs.values())
+
+    def status(self) -> list[RigStatus]:
+        return [rig.status() for rig in self.rigs.values()]
+
+    def close(self) -> None:
+        self.stop()
+        for rig in self.rigs.values():
+            rig.close()
+        if self.writer is not None:
+            self.writer.stop()
+
+    def _select(self, names: list[str] | None) -> list[Rig]:
+        if not names:
+            return list(self.rigs.values())
+        missing = [name for name in names if name not in self.rigs]
+        if missing:
+            logger.warning(f"No rig named {', '.join(missing)}")
+        return [self.rigs[name] for name in names if name in self.rigs]
+
+
+def format_status(statuses: list[RigStatus]) -> str:
+    lines = [
+        f"{'rig':<12} {'state':<9} {'health':<12} {'fps':>11} {'latency':>9} "
+        f"{'sent':>7} {'p99':>8}  command"
+    ]
+    for s in statuses:
+        lines.append(
+            f"{s.name:<12} {s.state:<9} {s.health:<12} "
+            f"{s.fps:5.1f}/{s.target_fps:<5.0f} {s.capture_latency_ms:7.1f}ms "
+            f"{s.serial_sent:7d} {s.serial_p99_ms:6.2f}ms  {s.command}"
+            + (f" ({s.message})" if s.message else "")
+        )
+    return "\n".join(lines)
+
+
+def _read_stdin(lines: queue.Queue) -> None:
+    for line in sys.stdin:
+        lines.put(line.strip())
+    lines.put(None)
+
+
+def main(argv: list[str] | None = None) -> int:
+    # Window.pyと同じく、SerialControllerの中で実行する
+    if "SerialController" in os.listdir():
+        os.chdir("SerialController")
+    parser = argparse.ArgumentParser(
+        prog="python -m Orchestrator", description=__doc__.split("\n\n")[1]
+    )
+    parser.add_argument("fleet", help="機材の設定を書いたJSONファイル")
+    parser.add_argument(
+        "--status-interval", type=float, default=10.0, help="状態を表示する間隔[s]"
+    )
+    parser.add_argument("--no-start", action="store_true", help="開くだけで開始しない")
+    args = parser.parse_args(argv)
+
+    Settings.GuiSettings.headless = True
+    try:
+        orchestrator = Orchestrator.load(args.fleet)
+    except KeyError as e:
+        logger.error(f"No command named {e}")
+        return 2
+    except ImportError as e:
+        logger.error(f"Cannot load a command: {e}")
+        return 2
+    except (OSError, ValueError) as e:
+        logger.error(f"Cannot read {args.fleet}: {e}")
+        return 2
+
+    lines: queue.Queue = queue.Queue()
+    threading.Thread(target=_read_stdin, args=(lines,), daemon=True).start()
+    stdin_open = True
+    with orchestrator:
+        if not args.no_start:
+            orchestrator.start()
+        try:
+            while stdin_open or orchestrator.running():
+                try:
+                    line = lines.get(timeout=args.status_interval)
+                except queue.Empty:
+                    print(format_status(orchestrator.status()))
+                    continue
+                if line is None:
+                    stdin_open = False
+                    continue
+                action, *names = line.split() or [""]
+                if action == "status":
+                    print(format_status(orchestrator.status()))
+                elif action == "start":
+                    orchestrator.start(names)
+                elif action == "stop":
+                    orchestrator.stop(names)
+                elif action == "quit":
+                    break
+                elif action:
+                    print("status / start [name ...] / stop [name ...] / quit")
+        except KeyboardInterrupt:
+            logger.info("Interrupted, stopping all rigs")
+        print(format_status(orchestrator.status()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
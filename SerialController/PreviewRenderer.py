@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+from loguru import logger
+
+
+class PreviewStats(NamedTuple):
+    rendered: int  # 縮小・変換したフレーム数
+    shown: int  # Tkが受け取ったフレーム数
+    skipped: int  # 表示が追いつかず、縮小せずに読み飛ばしたカメラのフレーム数
+    interval_ms: int  # 現在の表示間隔
+
+
+class PreviewRenderer:
+    """
+    プレビューに表示するフレームを別スレッドで作る
+
+    ワーカースレッドは新しいフレーム(通し番号が進んだもの)が届くと、cv2.resize(INTER_AREA)で
+    表示サイズに縮小してからRGBに変換し、あらかじめ確保した2枚のバッファの片方に書き込む。
+    Tkのスレッドはtakeで出来上がった画像を受け取り、PhotoImageに貼り付けるだけにする。
+    Tkが前の画像を受け取るまで次の画像は作らないので、表示が遅れている間に届いたフレームは
+    縮小せずに読み飛ばす。表示の間隔はnext_intervalでTk側の遅れに合わせて伸び縮みさせる。
+    """
+
+    MAX_INTERVAL_RATIO = 4  # 表示間隔は設定値のこの倍まで伸ばす
+
+    def __init__(self, camera, size: tuple[int, int], interval_ms: int = 22):
+        """
+        Args:
+            camera (Camera | CameraQueue): waitNextFrame/readFrameWithInfoを持つカメラ
+            size (tuple[int, int]): 表示サイズ(幅, 高さ)
+            interval_ms (int): 表示間隔の設定値[ms]
+        """
+        self.camera = camera
+        self.size = size
+        self.enabled = True
+        self.interval_ms = interval_ms
+        self._interval = float(interval_ms)
+        self._lock = threading.Lock()
+        self._ready = None
+        self._taken = threading.Event()
+        self._taken.set()
+        self._buffers: list[np.ndarray] = []
+        self._resized = None
+        self._back = 0
+        self._showing = False  # 最後に渡したのがカメラの画像かどうか
+        self._rendered = 0
+        self._shown = 0
+        self._skipped = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="PreviewRenderer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._taken.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
+            self._thread = None
+
+    def take(self) -> tuple[int, np.ndarray | None] | None:
+        """
+        新しく出来上がった画像を受け取る(Tkのスレッドから呼ぶ)。
+
+        Returns:
+            tuple | None: (通し番号, RGBの画像)。カメラのフレームがなくなった場合は画像がNone。
+                新しい画像がなければNone。画像は次のtakeまで書き換えられない
+        """
+        with self._lock:
+            ready = self._ready
+            self._ready = None
+            if ready is not None:
+                self._taken.set()
+        if ready is not None:
+            self._shown += 1
+        return ready
+
+    def next_interval(self, cost: float, lateness: float) -> int:
+        """
+        次の表示までの間隔を決める(Tkのスレッドから呼ぶ)。
+
+        Tkの処理(cost)やafterの遅れ(lateness)が設定間隔の半分を超える場合は間隔を伸ばし、
+        追いついたら設定値まで少しずつ戻す。
+
+        Args:
+            cost (float): 今回の表示にかかった時間[s]
+            lateness (float): 予定した時刻からの遅れ[s]
+
+        Returns:
+            int: 次の表示までの間隔[ms]
+        """
+        base = self.interval_ms
+        behind = (cost + max(lateness, 0.0)) * 1000
+        if behind > base / 2:
+            self._interval = min(
+                max(self._interval * 1.5, behind * 2), base * self.MAX_INTERVAL_RATIO
+            )
+        else:
+            self._interval = max(float(base), self._interval * 0.9)
+        return int(self._interval)
+
+    def stats(self) -> PreviewStats:
+        return PreviewStats(
+            self._rendered, self._shown, self._skipped, int(self._interval)
+        )
+
+    def _run(self) -> None:
+        seq = 0
+        while not self._stop.is_set():
+            # Tkが前の画像を受け取るまで次を作らない
+            if not self._taken.wait(0.1) or self._stop.is_set():
+                continue
+            if not self.enabled:
+                self._stop.wait(0.05)
+                continue
+            try:
+                info = self.camera.waitNextFrame(seq, timeout=0.1)
+                if info is None and self._showing:
+                    frame, _ = self.camera.readFrameWithInfo(copy=False)
+                    if frame is None:
+                        # カメラが閉じられた
+                        self._publish(0, None)
+                if info is None:
+                    if not self.camera.isOpened():
+                        self._stop.wait(0.1)
+                    continue
+                frame, info = self.camera.readFrameWithInfo(copy=False)
+                if frame is None:
+                    continue
+                if seq and info.seq > seq + 1:
+                    self._skipped += info.seq - seq - 1
+                seq = info.seq
+                self._publish(seq, self._render(frame))
+            except Exception as e:
+                logger.error(f"Preview renderer: {e}")
+                self._stop.wait(0.1)
+
+    def _render(self, frame: np.ndarray) -> np.ndarray:
+        width, height = self.size
+        if not self._buffers or self._buffers[0].shape[:2] != (height, width):
+            self._buffers = [
+                np.empty((height, width, 3), dtype=np.uint8) for _ in range(2)
+            ]
+        out = self._buffers[self._back]
+        if frame.shape[:2] == (height, width):
+            resized = frame
+        else:
+            shape = (height, width) + frame.shape[2:]
+            if self._resized is None or self._resized.shape != shape:
+                self._resized = np.empty(shape, dtype=frame.dtype)
+            resized = cv2.resize(
+                frame, (width, height), dst=self._resized, interpolation=cv2.INTER_AREA
+            )
+        code = cv2.COLOR_GRAY2RGB if resized.ndim == 2 else cv2.COLOR_BGR2RGB
+        cv2.cvtColor(resized, code, dst=out)
+        self._rendered += 1
+        return out
+
+    def _publish(self, seq: int, image: np.ndarray | None) -> None:
+        with self._lock:
+            self._ready = (seq, image)
+            self._taken.clear()
+        self._showing = image is not None
+        if image is not None:
+            self._back ^= 1
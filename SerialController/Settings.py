@@ -3,12 +3,34 @@
 
 import configparser
 import os
-import tkinter as tk
 from logging import getLogger, DEBUG, NullHandler
 
+try:
+    import tkinter as tk
+except ImportError:
+    # tkinterがない環境でもheadlessの実行はできる
+    tk = None
+
+
+class Variable:
+    """
+    tk.IntVarなどの代わりに値を持つだけの変数(Tkを使わないheadlessの実行で使う)
+    """
+
+    def __init__(self, master=None, value=None):
+        self._value = value
+
+    def get(self):
+        return self._value
+
+    def set(self, value) -> None:
+        self._value = value
+
 
 class GuiSettings:
     SETTING_PATH = os.path.join(os.path.dirname(__file__), "settings.ini")
+    # Trueの場合はtkの変数の代わりにVariableを使う(Tkのルートウィンドウがなくてもよい)
+    headless = False
 
     def __init__(self):
 
@@ -27,19 +49,31 @@ class GuiSettings:
             self.load()
             self._logger.debug('Settings file has been loaded.')
 
+        if self.headless or tk is None:
+            IntVar = StringVar = BooleanVar = Variable
+        else:
+            IntVar, StringVar, BooleanVar = tk.IntVar, tk.StringVar, tk.BooleanVar
+
         # default
-        self.camera_id = tk.IntVar(value=self.setting['General Setting'].getint('camera_id'))
-        self.com_port = tk.IntVar(value=self.setting['General Setting'].getint('com_port'))
-        self.com_port_name = tk.StringVar(value=self.setting['General Setting'].get('com_port_name'))
-        self.baud_rate = tk.IntVar(value=self.setting['General Setting'].getint('baud_rate'))
-        self.fps = tk.StringVar(value=self.setting['General Setting']['fps'])
-        self.show_size = tk.StringVar(value=self.setting['General Setting'].get('show_size'))
-        self.is_show_realtime = tk.BooleanVar(value=self.setting['General Setting'].getboolean('is_show_realtime'))
-        self.is_show_serial = tk.BooleanVar(value=self.setting['General Setting'].getboolean('is_show_serial'))
-        self.is_use_keyboard = tk.BooleanVar(value=self.setting['General Setting'].getboolean('is_use_keyboard'))
+        self.camera_id = IntVar(value=self.setting['General Setting'].getint('camera_id'))
+        self.com_port = IntVar(value=self.setting['General Setting'].getint('com_port'))
+        self.com_port_name = StringVar(value=self.setting['General Setting'].get('com_port_name'))
+        self.baud_rate = IntVar(value=self.setting['General Setting'].getint('baud_rate'))
+        self.fps = StringVar(value=self.setting['General Setting']['fps'])
+        self.show_size = StringVar(value=self.setting['General Setting'].get('show_size'))
+        self.is_show_realtime = BooleanVar(value=self.setting['General Setting'].getboolean('is_show_realtime'))
+        self.is_show_serial = BooleanVar(value=self.setting['General Setting'].getboolean('is_show_serial'))
+        self.is_use_keyboard = BooleanVar(value=self.setting['General Setting'].getboolean('is_use_keyboard'))
+        # 'thread' or 'process' (キャプチャを別プロセスで行う)
+        self.capture_backend = StringVar(value=self.setting['General Setting'].get('capture_backend', 'thread'))
+        self.is_async_serial = BooleanVar(
+            value=self.setting['General Setting'].getboolean('is_async_serial', False))
+        # 'text' or 'auto' (接続時にハンドシェイクし、対応していればバイナリフレームで送る)
+        self.serial_protocol = StringVar(
+            value=self.setting['General Setting'].get('serial_protocol', 'text'))
         # Pokemon Home用の設定
-        self.season = tk.StringVar(value=self.setting['Pokemon Home'].get('Season'))
-        self.is_SingleBattle = tk.StringVar(value=self.setting['Pokemon Home'].get('Single or Double'))
+        self.season = StringVar(value=self.setting['Pokemon Home'].get('Season'))
+        self.is_SingleBattle = StringVar(value=self.setting['Pokemon Home'].get('Single or Double'))
 
     def load(self):
         if os.path.isfile(self.SETTING_PATH):
@@ -58,6 +92,9 @@ class GuiSettings:
             'is_show_realtime': True,
             'is_show_serial': False,
             'is_use_keyboard': True,
+            'capture_backend': 'thread',
+            'is_async_serial': False,
+            'serial_protocol': 'text',
         }
         # pokemon home用の設定
         self.setting['Pokemon Home'] = {
@@ -118,6 +155,9 @@ class GuiSettings:
             'is_show_realtime': self.is_show_realtime.get(),
             'is_show_serial': self.is_show_serial.get(),
             'is_use_keyboard': self.is_use_keyboard.get(),
+            'capture_backend': self.capture_backend.get(),
+            'is_async_serial': self.is_async_serial.get(),
+            'serial_protocol': self.serial_protocol.get(),
         }
         # pokemon home用の設定
         self.setting['Pokemon Home'] = {
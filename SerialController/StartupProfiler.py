@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Poke-Controllerの起動時間を計測する
+
+Window.pyは起動の各段階(設定の読み込み・カメラを開く・コマンドの読み込みなど)の時間と、
+最初のフレームを表示した時刻をstartupに記録する。このモジュールを実行すると、
+-X importtimeを付けてWindow.pyを起動し、各段階の時間とモジュールごとのimportの時間を
+JSONに書き出す。--exitを付けると最初のフレームを表示した後に終了する。
+
+    cd SerialController
+    python -m StartupProfiler
+    python -m StartupProfiler --output startup.json --exit
+    python -m StartupProfiler --show startup.json
+"""
+
+import atexit
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, NamedTuple
+
+# 子プロセス(Window.py)に渡す環境変数
+ENV_REPORT = "POKECON_STARTUP_REPORT"
+ENV_EXIT = "POKECON_STARTUP_EXIT"
+ENV_LAUNCHED = "POKECON_STARTUP_LAUNCHED"
+
+FIRST_FRAME = "first_frame"
+
+
+class Phase(NamedTuple):
+    name: str
+    start_ms: float  # 計測を始めた時刻(このモジュールをimportした時刻から)
+    elapsed_ms: float
+
+
+class StartupProfiler:
+    """
+    起動の段階ごとの時間と、ある時点(最初のフレームの表示など)の時刻を記録する
+
+    時刻はこのモジュールをimportした時点から数える。Window.pyは最初にimportするので、
+    それより前はインタプリタの起動の時間になる。環境変数ENV_REPORTがあれば、
+    最初のフレームを表示した時(表示しなければ終了する時)にそのファイルへ結果を書き出す。
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.origin_epoch = time.time()
+        self.phases: list[Phase] = []
+        self.marks: dict[str, float] = {}
+        self.report_path = os.environ.get(ENV_REPORT)
+        self.exit_after_first_frame = bool(os.environ.get(ENV_EXIT))
+        launched = os.environ.get(ENV_LAUNCHED)
+        self.launched_epoch = float(launched) if launched else None
+        self._callbacks: dict[str, list[Callable[[], None]]] = {}
+        self._written = False
+        if self.report_path:
+            atexit.register(self._write_at_exit)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.origin) * 1000
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        withの中の時間を段階nameとして記録する
+
+        Args:
+            name (str): 段階の名前
+        """
+        start = self.elapsed_ms()
+        try:
+            yield
+        finally:
+            self.phases.append(Phase(name, start, self.elapsed_ms() - start))
+
+    def mark(self, name: str) -> None:
+        """
+        今の時刻をnameとして記録する。2回目以降は何もしない
+
+        Args:
+            name (str): 時点の名前
+        """
+        if name in self.marks:
+            return
+        self.marks[name] = self.elapsed_ms()
+        if name == FIRST_FRAME and self.report_path:
+            self.write(self.report_path)
+        for callback in self._callbacks.pop(name, []):
+            callback()
+
+    def on_mark(self, name: str, callback: Callable[[], None]) -> None:
+        """
+        nameが記録された時にcallbackを呼ぶ(記録済みならすぐに呼ぶ)
+
+        Args:
+            name (str): 時点の名前
+            callback (Callable[[], None]): markを呼んだスレッドで呼ばれる
+        """
+        if name in self.marks:
+            callback()
+        else:
+            self._callbacks.setdefault(name, []).append(callback)
+
+    def report(self) -> dict:
+        """
+        Returns:
+            dict: 段階の時間(phases)、時点の時刻(marks)、インタプリタの起動の時間
+                (interpreter_ms、起動した時刻がわかる場合だけ)
+        """
+        interpreter_ms = None
+        if self.launched_epoch is not None:
+            interpreter_ms = (self.origin_epoch - self.launched_epoch) * 1000
+        return {
+            "interpreter_ms": interpreter_ms,
+            "phases": [phase._asdict() for phase in self.phases],
+            "marks": dict(self.marks),
+        }
+
+    def write(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+        self._written = True
+
+    def _write_at_exit(self) -> None:
+        if not self._written:
+            self.write(self.report_path)
+
+
+startup = StartupProfiler()
+
+
+def parse_importtime(line: str) -> dict | None:
+    """
+    -X importtimeの1行を読む
+
+    Args:
+        line (str): "import time:   self |   cumulative | (字下げ)モジュール名"
+
+    Returns:
+        dict | None: module, self_us, cumulative_us, depth(字下げの深さ)。
+            importtimeの行でなければNone
+    """
+    if not line.startswith("import time:"):
+        return None
+    fields = line[len("import time:") :].rstrip("\n").split("|")
+    if len(fields) != 3 or not fields[0].strip().isdigit():
+        return None  # 見出しの行
+    name = fields[2]
+    return {
+        "module": name.strip(),
+        "self_us": int(fields[0]),
+        "cumulative_us": int(fields[1]),
+        "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+    }
+
+
+def profile(script: str = "Window.py", exit_after_first_frame: bool = False) -> dict:
+    """
+    -X importtimeを付けてscriptを起動し、終了するまで待つ
+
+    Args:
+        script (str): 起動するファイル
+        exit_after_first_frame (bool): 最初のフレームを表示したら終了させる
+
+    Returns:
+        dict: StartupProfiler.reportの内容に、import(imports)と終了コード(returncode)を加えたもの
+    """
+    # Window.pyが最初にimportするモジュールなので、計測にだけ使うものはここでimportする
+    import subprocess
+    import tempfile
+
+    fd, report_path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    env = dict(os.environ)
+    env[ENV_REPORT] = report_path
+    env[ENV_LAUNCHED] = repr(time.time())
+    if exit_after_first_frame:
+        env[ENV_EXIT] = "1"
+    imports = []
+    try:
+        proc = subprocess.Popen(
+            [sys.executable, "-X", "importtime", script],
+            stderr=subprocess.PIPE,
+            text=True,
+            env=env,
+        )
+        # Windowsではカメラのプロセス(spawn)のimportも混ざる
+        for line in proc.stderr:
+            parsed = parse_importtime(line)
+            if parsed is not None:
+                imports.append(parsed)
+            elif not line.startswith("import time:"):
+                sys.stderr.write(line)  # ログなどはそのまま表示する
+        returncode = proc.wait()
+        try:
+            with open(report_path, encoding="utf-8") as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            report = {"interpreter_ms": None, "phases": [], "marks": {}}
+    finally:
+        os.remove(report_path)
+    report["imports"] = imports
+    report["returncode"] = returncode
+    return report
+
+
+def format_report(report: dict, top: int = 15) -> str:
+    """
+    Args:
+        report (dict): profileの結果
+        top (int): 表示するimportの数(トップレベルのimportを累計時間の長い順に)
+
+    Returns:
+        str: 表示用の文字列
+    """
+    lines = []
+    if report.get("interpreter_ms") is not None:
+        lines.append(f"{'interpreter':<20} {report['interpreter_ms']:9.1f} ms")
+    for phase in report["phases"]:
+        lines.append(
+            f"{phase['name']:<20} {phase['elapsed_ms']:9.1f} ms"
+            f"  (at {phase['start_ms']:.1f} ms)"
+        )
+    for name, at in report["marks"].items():
+        lines.append(f"{name:<20} at {at:6.1f} ms")
+    if FIRST_FRAME in report["marks"]:
+        total = report["marks"][FIRST_FRAME] + (report.get("interpreter_ms") or 0.0)
+        lines.append(f"time to first frame: {total:.1f} ms")
+    else:
+        lines.append("time to first frame: no frame was shown")
+
+    imports = sorted(
+        (i for i in report.get("imports", []) if i["depth"] == 0),
+        key=lambda i: i["cumulative_us"],
+        reverse=True,
+    )
+    if imports:
+        lines.append(f"slowest imports (of {len(report['imports'])} modules):")
+        for i in imports[:top]:
+            lines.append(f"  {i['cumulative_us'] / 1000:8.1f} ms  {i['module']}")
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--output", default="startup_profile.json")
+    parser.add_argument(
+        "--exit", action="store_true", help="最初のフレームを表示したら終了する"
+    )
+    parser.add_argument("--show", metavar="REPORT", help="書き出した結果を表示する")
+    parser.add_argument("--top", type=int, default=15, help="表示するimportの数")
+    args = parser.parse_args(argv)
+
+    if args.show:
+        with open(args.show, encoding="utf-8") as f:
+            print(format_report(json.load(f), args.top))
+        return 0
+
+    # Window.pyと同じく、SerialControllerの中で実行する
+    if "SerialController" in os.listdir():
+        os.chdir("SerialController")
+    report = profile(exit_after_first_frame=args.exit)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(format_report(report, args.top))
+    print(f"Report written to {args.output}")
+    return report["returncode"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+from loguru import logger
+
+
+class _Entry(NamedTuple):
+    template: np.ndarray
+    mask: np.ndarray | None
+    stamp: tuple
+
+
+def _stat_stamp(path: str) -> tuple[int, int]:
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def _imread(path: str, flags: int) -> np.ndarray | None:
+    image = cv2.imread(path, flags)
+    if image is not None:
+        # キャッシュを共有するので呼び出し側で書き換えられないようにする
+        image.flags.writeable = False
+    return image
+
+
+class TemplateCache:
+    """
+    テンプレート画像(とマスク画像)のデコード結果を保持するプロセス共通のキャッシュ
+
+    キーは(解決済みパス, グレースケールかどうか, マスクのパス)。
+    取得のたびにファイルのmtimeとサイズを確認し、変更されていれば読み直すので
+    Template/フォルダ内の画像を編集してもそのまま反映される。
+    上限件数を超えた場合は最も使われていないものから破棄する(LRU)。
+    """
+
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[tuple, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def load(
+        self, path: str, use_gray: bool = True, mask_path: str | None = None
+    ) -> tuple[np.ndarray | None, np.ndarray | None]:
+        """
+        テンプレート画像とマスク画像を取得する。
+
+        Args:
+            path (str): テンプレート画像のパス
+            use_gray (bool): グレースケールで読み込むかどうか
+            mask_path (str | None): マスク画像のパス。不要ならNone
+
+        Returns:
+            tuple: (テンプレート画像, マスク画像)。読み込めない場合はNoneが入る
+        """
+        path = os.path.abspath(path)
+        mask_path = os.path.abspath(mask_path) if mask_path is not None else None
+        key = (path, use_gray, mask_path)
+
+        try:
+            stamp = (
+                _stat_stamp(path),
+                _stat_stamp(mask_path) if mask_path is not None else None,
+            )
+        except OSError as e:
+            logger.error(f"Template file cannot be read: {e}")
+            with self._lock:
+                self._entries.pop(key, None)
+                self.misses += 1
+            return None, None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.stamp == stamp:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.template, entry.mask
+            self.misses += 1
+
+        # デコードはロックの外で行う(OpenCVはGILを解放する)
+        template = _imread(path, cv2.IMREAD_GRAYSCALE if use_gray else cv2.IMREAD_COLOR)
+        mask = (
+            _imread(mask_path, cv2.IMREAD_GRAYSCALE) if mask_path is not None else None
+        )
+        if template is None or (mask_path is not None and mask is None):
+            return template, mask
+
+        with self._lock:
+            self._entries[key] = _Entry(template, mask, stamp)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return template, mask
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# プロセス全体で共有するキャッシュ
+template_cache = TemplateCache()
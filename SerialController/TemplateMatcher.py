@@ -0,0 +1,562 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, NamedTuple
+
+import cv2
+import numpy as np
+from loguru import logger
+
+
+class MatchPolicy(NamedTuple):
+    pyramid_levels: int  # 粗探索で縮小する段数(0なら縮小しない)
+    candidates: int  # 粗探索から原寸で詰める候補の数
+    learn_roi: bool  # 一致した位置を覚えて、次回はその周辺から探すかどうか
+    # 縮小画像での相関値が(閾値 - verify_margin)以上の候補だけを原寸で詰める。
+    # 詰めても閾値に届かなかった場合は、フレーム全体を原寸で探索し直す
+    verify_margin: float
+
+
+# exact: 従来どおり原寸で全体を探索する
+# balanced: 学習したROIと縮小画像で候補を絞る。閾値に近い候補が見つかったのに
+#           一致しなかった場合は全体を探索し直すので、一致判定は従来とほぼ変わらない。
+#           縮小画像の時点で閾値から遠い場合は原寸で探索せず、相関値は-1.0(見つからない)になる
+#           (exact_scoreを指定すると原寸で全体を探索して、exactと同じ相関値を返す)
+# fast: 縮小を2段にし、閾値以上の候補だけを詰める。小さいテンプレートでは見落とすことがある
+MATCH_POLICIES: dict[str, MatchPolicy] = {
+    "exact": MatchPolicy(0, 0, False, 0.0),
+    "balanced": MatchPolicy(1, 3, True, 0.15),
+    "fast": MatchPolicy(2, 1, True, 0.0),
+}
+
+
+class MatchResult(NamedTuple):
+    max_val: float
+    max_loc: tuple[int, int]  # 探索した画像上でのテンプレート左上の座標
+    size: tuple[int, int]  # テンプレートの(幅, 高さ)
+
+
+class TemplateSpec(NamedTuple):
+    template_path: str
+    threshold: float = 0.7
+    mask_path: str | None = None
+
+
+class TemplateMatch(NamedTuple):
+    template_path: str
+    max_val: float  # 相関値
+    max_loc: tuple[int, int]  # テンプレート左上の座標(cropを指定した場合はcrop内の座標)
+    size: tuple[int, int]  # テンプレートの(幅, 高さ)
+    passed: bool  # 閾値以上かどうか
+
+
+class MatchJob(NamedTuple):
+    template: np.ndarray
+    threshold: float
+    method: int
+    mask: np.ndarray | None
+    key: tuple | None
+
+
+def _roi_slice(
+    shape: tuple, roi: tuple[int, int, int, int]
+) -> tuple[int, int, int, int]:
+    height, width = shape[:2]
+    x1, y1, x2, y2 = roi
+    return max(0, x1), max(0, y1), min(width, x2), min(height, y2)
+
+
+class MatcherBackend(ABC):
+    """
+    matchTemplateを実行するバックエンドの基底クラス
+
+    register_backendで登録しておくと、get_backendで初めて使うときに生成され、
+    以降は同じインスタンスが使い回される。
+    """
+
+    name = ""
+
+    @abstractmethod
+    def match(
+        self,
+        image: np.ndarray,
+        template: np.ndarray,
+        method: int,
+        mask: np.ndarray | None = None,
+    ) -> np.ndarray:
+        """cv2.matchTemplateと同じ形の相関値マップを返す"""
+
+
+_BACKENDS: dict[str, type[MatcherBackend]] = {}
+_backend_instances: dict[str, MatcherBackend] = {}
+_backend_lock = threading.Lock()
+
+
+def register_backend(cls: type[MatcherBackend]) -> type[MatcherBackend]:
+    _BACKENDS[cls.name] = cls
+    return cls
+
+
+def available_backends() -> list[str]:
+    return list(_BACKENDS)
+
+
+def get_backend(name: str) -> MatcherBackend:
+    """
+    登録されたバックエンドを取得する。使えない場合はopencvで代用する。
+
+    Args:
+        name (str): バックエンド名
+
+    Returns:
+        MatcherBackend: バックエンドのインスタンス
+    """
+    with _backend_lock:
+        backend = _backend_instances.get(name)
+        if backend is not None:
+            return backend
+        try:
+            backend = _BACKENDS[name]()
+        except KeyError:
+            logger.error(f"Unknown matcher backend: {name}")
+            backend = _BACKENDS["opencv"]()
+        except RuntimeError as e:
+            logger.warning(f"Matcher backend {name} is not available: {e}")
+            backend = _backend_instances.get("opencv") or _BACKENDS["opencv"]()
+        _backend_instances[name] = backend
+        return backend
+
+
+@register_backend
+class OpenCVBackend(MatcherBackend):
+    """OpenCVの設定のままcv2.matchTemplateを呼ぶ"""
+
+    name = "opencv"
+
+    def match(
+        self,
+        image: np.ndarray,
+        template: np.ndarray,
+        method: int,
+        mask: np.ndarray | None = None,
+    ) -> np.ndarray:
+        return cv2.matchTemplate(image, template, method, mask=mask)
+
+
+@register_backend
+class OpenCVThreadsBackend(OpenCVBackend):
+    """
+    OpenCV内部のスレッド数をCPUのコア数に合わせてからcv2.matchTemplateを呼ぶ
+
+    cv2.setNumThreadsはプロセス全体の設定なので、他の画像処理にも影響する。
+    他の処理がスレッド数を戻した場合は、次の探索の前に設定し直す。
+    """
+
+    name = "opencv-threads"
+
+    def __init__(self, threads: int | None = None):
+        self.threads = threads or os.cpu_count() or 1
+        cv2.setNumThreads(self.threads)
+        logger.debug(f"OpenCV threads: {cv2.getNumThreads()}")
+
+    def match(
+        self,
+        image: np.ndarray,
+        template: np.ndarray,
+        method: int,
+        mask: np.ndarray | None = None,
+    ) -> np.ndarray:
+        if cv2.getNumThreads() != self.threads:
+            cv2.setNumThreads(self.threads)
+        return super().match(image, template, method, mask)
+
+
+@register_backend
+class TiledBackend(MatcherBackend):
+    """
+    探索範囲を横長の帯に分け、帯ごとにスレッドで並列にcv2.matchTemplateを呼ぶ
+
+    帯はテンプレートの高さ-1だけ重ねて切り出すので、つなげた結果は
+    フレーム全体を一度に探索した結果と同じになる。
+    探索範囲が小さい場合は分割せずにそのまま呼ぶ。
+    """
+
+    name = "tiled"
+    MIN_TILE_ROWS = 64  # 1つの帯が受け持つ結果の最小行数
+
+    def __init__(self, workers: int | None = None):
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="TiledMatcher"
+        )
+
+    def match(
+        self,
+        image: np.ndarray,
+        template: np.ndarray,
+        method: int,
+        mask: np.ndarray | None = None,
+    ) -> np.ndarray:
+        rows = image.shape[0] - template.shape[0] + 1
+        tiles = min(self.workers, rows // self.MIN_TILE_ROWS)
+        if tiles < 2:
+            return cv2.matchTemplate(image, template, method, mask=mask)
+
+        bounds = np.linspace(0, rows, tiles + 1, dtype=int)
+        h = template.shape[0]
+
+        def run(i: int) -> np.ndarray:
+            top, bottom = bounds[i], bounds[i + 1]
+            return cv2.matchTemplate(
+                image[top : bottom + h - 1], template, method, mask=mask
+            )
+
+        return np.vstack(list(self._pool.map(run, range(tiles))))
+
+
+@register_backend
+class CudaBackend(MatcherBackend):
+    """
+    CUDA版のTemplateMatchingで探索する(OpenCVがCUDA付きでビルドされている場合のみ)
+
+    GPU上のバッファとマッチャーは生成後に使い回す。マスク付きの探索はCPUで行う。
+    """
+
+    name = "cuda"
+
+    def __init__(self):
+        try:
+            count = cv2.cuda.getCudaEnabledDeviceCount()
+        except (AttributeError, cv2.error):
+            count = 0
+        if count == 0:
+            raise RuntimeError("no CUDA device")
+        self._src = cv2.cuda_GpuMat()
+        self._template = cv2.cuda_GpuMat()
+        self._matchers: dict[tuple[int, int], Any] = {}
+        self._lock = threading.Lock()
+
+    def match(
+        self,
+        image: np.ndarray,
+        template: np.ndarray,
+        method: int,
+        mask: np.ndarray | None = None,
+    ) -> np.ndarray:
+        if mask is not None:
+            return cv2.matchTemplate(image, template, method, mask=mask)
+        mat_type = cv2.CV_8UC1 if image.ndim == 2 else cv2.CV_8UC3
+        # GPU上のバッファを共有しているので、同時に呼ばれた場合は順番に処理する
+        with self._lock:
+            matcher = self._matchers.get((mat_type, method))
+            if matcher is None:
+                matcher = cv2.cuda.createTemplateMatching(mat_type, method)
+                self._matchers[(mat_type, method)] = matcher
+            self._src.upload(image)
+            self._template.upload(template)
+            return matcher.match(self._src, self._template).download()
+
+
+class TemplateMatcher:
+    """
+    ROIと画像ピラミッドで探索範囲を絞るテンプレートマッチング
+
+    テンプレートごとに探索ROIを指定するか、一致した位置から学習させておくと、
+    まずその範囲だけを原寸で探索する。見つからなければ縮小画像で候補を探し、
+    候補の周辺だけを原寸で詰める。返す相関値は原寸のmatchTemplateの値か、
+    原寸で全体を探索せずに見つからないと判断した場合の-1.0のどちらかで、
+    縮小画像での相関値は返さない。相関値を表示する場合などはexact_scoreを指定すると、
+    見つからない場合も原寸の相関値を返す。
+    """
+
+    MIN_COARSE_SIZE = 8  # 縮小後のテンプレートがこれより小さくなる段数は使わない
+    ROI_MARGIN = 16  # 学習したROIの周囲に足す余白[px]
+    MAX_PYRAMIDS = 256
+
+    def __init__(self, backend: str = "opencv"):
+        self.backend = backend
+        self._rois: dict[tuple, tuple[int, int, int, int]] = {}
+        self._pyramids: dict[tuple, tuple[np.ndarray, np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    def setSearchRoi(self, key: tuple, roi: list | tuple | None) -> None:
+        """
+        テンプレートの探索ROIを指定する。Noneで解除する。
+
+        Args:
+            key (tuple): テンプレートを表すキー
+            roi (list | tuple | None): [x1, y1, x2, y2]
+        """
+        with self._lock:
+            if roi is None:
+                self._rois.pop(key, None)
+            else:
+                self._rois[key] = tuple(int(v) for v in roi)  # type: ignore[assignment]
+
+    def searchRoi(self, key: tuple) -> tuple[int, int, int, int] | None:
+        with self._lock:
+            return self._rois.get(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rois.clear()
+            self._pyramids.clear()
+
+    def match(
+        self,
+        src: np.ndarray,
+        template: np.ndarray,
+        threshold: float,
+        method: int = cv2.TM_CCOEFF_NORMED,
+        mask: np.ndarray | None = None,
+        policy: str | MatchPolicy = "balanced",
+        key: tuple | None = None,
+        backend: str | None = None,
+        exact_score: bool = False,
+    ) -> MatchResult:
+        """
+        srcの中からtemplateを探す。
+
+        Args:
+            src (np.ndarray): 探索対象の画像
+            template (np.ndarray): テンプレート画像
+            threshold (float): 一致とみなす相関値
+            method (int): cv2.matchTemplateの手法
+            mask (np.ndarray | None): マスク画像
+            policy (str | MatchPolicy): 精度と速度の方針。MATCH_POLICIESのキーか、MatchPolicy
+            key (tuple | None): ROIの学習に使うテンプレートのキー。Noneなら学習しない
+            backend (str | None): 使うバックエンド名。Noneならself.backend
+            exact_score (bool): 見つからない場合も原寸で全体を探索して相関値を求める
+
+        Returns:
+            MatchResult: 最大の相関値とその位置。exact以外の方針で、縮小画像の時点で
+                見つからないと判断した場合の相関値は-1.0(exact_scoreを指定しない場合)
+        """
+        if isinstance(policy, str):
+            policy = MATCH_POLICIES[policy]
+        engine = get_backend(backend or self.backend)
+        size = (template.shape[1], template.shape[0])
+
+        if policy == MATCH_POLICIES["exact"]:
+            return self._match_region(engine, src, template, method, mask, None, size)
+
+        best: MatchResult | None = None
+        roi = self.searchRoi(key) if key is not None else None
+        if roi is not None:
+            best = self._match_region(engine, src, template, method, mask, roi, size)
+            if best.max_val >= threshold:
+                self._learn(key, policy, best, src.shape)
+                return best
+
+        levels = self._usable_levels(template, policy.pyramid_levels)
+        if levels > 0 and mask is None:
+            result, refined = self._match_pyramid(
+                engine,
+                src,
+                template,
+                method,
+                levels,
+                threshold - policy.verify_margin,
+                policy.candidates,
+            )
+            if best is None or result.max_val > best.max_val:
+                best = result
+            if best.max_val >= threshold:
+                self._learn(key, policy, best, src.shape)
+                return best
+            if not refined and not exact_score:
+                # 縮小画像の時点で閾値から遠い場合は、原寸でも一致しないとみなす。
+                # 縮小画像での相関値(やROI内だけの相関値)は原寸の全体探索の値と違うので返さない
+                return MatchResult(-1.0, best.max_loc, size)
+
+        result = self._match_region(engine, src, template, method, mask, None, size)
+        self._learn(key, policy, result, src.shape, threshold)
+        return result
+
+    def match_many(
+        self,
+        src: np.ndarray,
+        jobs: list[MatchJob],
+        policy: str | MatchPolicy = "balanced",
+        parallel: bool = False,
+        backend: str | None = None,
+        exact_score: bool = False,
+    ) -> list[MatchResult]:
+        """
+        1枚の画像に対して複数のテンプレートを探す。
+
+        OpenCVはmatchTemplateの間GILを解放するので、parallel=Trueの場合は
+        スレッドプールでテンプレートごとに並列に探索する。
+
+        Args:
+            src (np.ndarray): 探索対象の画像
+            jobs (list[MatchJob]): テンプレートごとの探索条件
+            policy (str | MatchPolicy): 精度と速度の方針
+            parallel (bool): 並列に探索するかどうか
+            backend (str | None): 使うバックエンド名。Noneならself.backend
+            exact_score (bool): 見つからない場合も原寸の相関値を求める
+
+        Returns:
+            list[MatchResult]: jobsと同じ順序の結果
+        """
+
+        def run(job: MatchJob) -> MatchResult:
+            return self.match(
+                src,
+                job.template,
+                job.threshold,
+                job.method,
+                job.mask,
+                policy,
+                job.key,
+                backend,
+                exact_score,
+            )
+
+        if parallel and len(jobs) > 1:
+            return list(_executor().map(run, jobs))
+        return [run(job) for job in jobs]
+
+    def _learn(
+        self,
+        key: tuple | None,
+        policy: MatchPolicy,
+        result: MatchResult,
+        shape: tuple,
+        threshold: float | None = None,
+    ) -> None:
+        if key is None or not policy.learn_roi:
+            return
+        if threshold is not None and result.max_val < threshold:
+            return
+        (x, y), (w, h) = result.max_loc, result.size
+        margin = self.ROI_MARGIN
+        found = _roi_slice(
+            shape, (x - margin, y - margin, x + w + margin, y + h + margin)
+        )
+        with self._lock:
+            current = self._rois.get(key)
+            if current is not None:
+                # 表示位置が揺れるテンプレートにも対応できるよう、これまでのROIと合わせる
+                found = (
+                    min(current[0], found[0]),
+                    min(current[1], found[1]),
+                    max(current[2], found[2]),
+                    max(current[3], found[3]),
+                )
+            self._rois[key] = found
+
+    def _usable_levels(self, template: np.ndarray, levels: int) -> int:
+        short_side = min(template.shape[:2])
+        while levels > 0 and (short_side >> levels) < self.MIN_COARSE_SIZE:
+            levels -= 1
+        return levels
+
+    def _coarse_template(self, template: np.ndarray, levels: int) -> np.ndarray:
+        # 縮小したテンプレートは元の配列ごとに使い回す(テンプレートはキャッシュ上で不変)
+        cache_key = (id(template), levels)
+        with self._lock:
+            cached = self._pyramids.get(cache_key)
+        if cached is not None and cached[0] is template:
+            return cached[1]
+        coarse = template
+        for _ in range(levels):
+            coarse = cv2.pyrDown(coarse)
+        with self._lock:
+            if len(self._pyramids) >= self.MAX_PYRAMIDS:
+                self._pyramids.clear()
+            self._pyramids[cache_key] = (template, coarse)
+        return coarse
+
+    def _match_pyramid(
+        self,
+        backend: MatcherBackend,
+        src: np.ndarray,
+        template: np.ndarray,
+        method: int,
+        levels: int,
+        min_coarse_val: float,
+        candidates: int = 3,
+    ) -> tuple[MatchResult, bool]:
+        """
+        縮小画像で候補を探し、min_coarse_val以上の候補を原寸で詰める。
+
+        Returns:
+            tuple: (結果, 原寸で詰めた候補があったかどうか)。
+                詰めていない場合の結果は縮小画像での相関値と位置
+        """
+        size = (template.shape[1], template.shape[0])
+        coarse_src = src
+        for _ in range(levels):
+            coarse_src = cv2.pyrDown(coarse_src)
+        coarse_template = self._coarse_template(template, levels)
+        res = backend.match(coarse_src, coarse_template, method)
+
+        scale = 1 << levels
+        pad = 2 * scale
+        cw, ch = coarse_template.shape[1], coarse_template.shape[0]
+        _, coarse_max, _, (cx, cy) = cv2.minMaxLoc(res)
+        best = MatchResult(float(coarse_max), (cx * scale, cy * scale), size)
+        refined = False
+        for _ in range(max(1, candidates)):
+            _, coarse_val, _, (cx, cy) = cv2.minMaxLoc(res)
+            if coarse_val < min_coarse_val or coarse_val < coarse_max - 0.1:
+                break
+            x, y = cx * scale, cy * scale
+            roi = (x - pad, y - pad, x + size[0] + pad, y + size[1] + pad)
+            result = self._match_region(
+                backend, src, template, method, None, roi, size
+            )
+            if not refined or result.max_val > best.max_val:
+                best = result
+            refined = True
+            # 同じ山を何度も詰めないように周辺を潰す
+            res[
+                max(0, cy - ch // 2) : cy + ch // 2 + 1,
+                max(0, cx - cw // 2) : cx + cw // 2 + 1,
+            ] = -1.0
+        return best, refined
+
+    def _match_region(
+        self,
+        backend: MatcherBackend,
+        src: np.ndarray,
+        template: np.ndarray,
+        method: int,
+        mask: np.ndarray | None,
+        roi: tuple[int, int, int, int] | None,
+        size: tuple[int, int],
+    ) -> MatchResult:
+        x1, y1 = 0, 0
+        region = src
+        if roi is not None:
+            x1, y1, x2, y2 = _roi_slice(src.shape, roi)
+            if x2 - x1 < size[0] or y2 - y1 < size[1]:
+                return MatchResult(-1.0, (x1, y1), size)
+            region = src[y1:y2, x1:x2]
+        res = backend.match(region, template, method, mask)
+        _, max_val, _, (x, y) = cv2.minMaxLoc(res)
+        return MatchResult(float(max_val), (x + x1, y + y1), size)
+
+
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=min(4, os.cpu_count() or 1),
+                thread_name_prefix="TemplateMatcher",
+            )
+        return _pool
+
+
+# プロセス全体で共有するマッチャー(学習したROIを保持する)
+template_matcher = TemplateMatcher()
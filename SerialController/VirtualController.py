@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import select
+import threading
+import time
+from typing import NamedTuple
+
+from loguru import logger
+
+from Commands.SerialProtocol import (
+    FRAME_INVALID,
+    FRAME_REPORT,
+    HANDSHAKE,
+    HANDSHAKE_REPLY,
+    FrameDecoder,
+    ReportState,
+    apply_frame,
+    apply_report,
+)
+
+# UARTの1バイトのビット数(スタートビット + 8ビット + ストップビット)
+BITS_PER_BYTE = 10
+
+
+class ReceivedReport(NamedTuple):
+    seq: int
+    arrived: float  # 行を読み取った時刻(perf_counter)
+    completed: float  # ボーレートから求めた、マイコンが行を受け取り終える時刻
+    values: tuple[int, int, int, int, int, int]  # 反映後の(btn, hat, lx, ly, rx, ry)
+    raw: bytes  # テキストの行またはフレームのペイロード
+
+
+class LoopbackStats(NamedTuple):
+    received: int
+    commands: int  # 入力以外の行("end"など)
+    dropped: int  # 解釈できなかった行
+    merged: int  # 同じUSBの送信周期の間に次の入力で上書きされた数
+    reports_per_sec: float
+    bytes_per_sec: float
+    wire_busy: float  # 送信時間のうち回線が使われていた割合
+
+
+class VirtualController:
+    """
+    擬似端末(pty)でマイコンの代わりをする
+
+    port_nameをSender.openSerialに渡すと、送られた行をJoystick.cと同じように解釈して
+    コントローラの状態(state)を再現し、受け取った時刻とともにreportsに残す。
+    ptyは実際には遅延しないので、ボーレートから1行を受け取り終えるまでの時間を計算してcompletedにする。
+    Switchへの送信(USB)はpoll_interval秒ごとに行われるものとして、その間に上書きされた入力を数える。
+    supports_binary=Trueの場合はSender.negotiateのハンドシェイクに応答し、バイナリフレームも受け取る。
+    """
+
+    def __init__(
+        self,
+        baudrate: int = 9600,
+        poll_interval: float = 0.008,
+        supports_binary: bool = True,
+    ):
+        if os.name != "posix":
+            raise RuntimeError("VirtualController needs a POSIX pty")
+        self.baudrate = baudrate
+        self.poll_interval = poll_interval
+        self.supports_binary = supports_binary
+        self.state = ReportState()
+        self.reports: list[ReceivedReport] = []
+        self.commands: list[bytes] = []
+        self.dropped: list[bytes] = []
+        self.received_bytes = 0
+        self._master, self._slave = os.openpty()
+        self.port_name = os.ttyname(self._slave)
+        self._decoder = FrameDecoder()
+        self._wire_free = 0.0
+        self._wire_busy = 0.0
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def __enter__(self) -> "VirtualController":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._run, name="VirtualController", daemon=True
+        )
+        self._thread.start()
+        logger.debug(f"Virtual controller listening on {self.port_name}")
+
+    def stop(self) -> None:
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(1.0)
+            self._thread = None
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def reset(
+        self, baudrate: int | None = None, supports_binary: bool | None = None
+    ) -> None:
+        # 受け取った記録を消す(状態はそのまま)
+        with self._cond:
+            if baudrate is not None:
+                self.baudrate = baudrate
+            if supports_binary is not None:
+                self.supports_binary = supports_binary
+            self.reports = []
+            self.commands = []
+            self.dropped = []
+            self.received_bytes = 0
+            self._wire_free = 0.0
+            self._wire_busy = 0.0
+
+    def wait_for(self, count: int, timeout: float = 5.0) -> bool:
+        """
+        入力とコマンドの行をあわせてcount行受け取るまで待つ。
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: len(self.reports) + len(self.commands) + len(self.dropped)
+                >= count,
+                timeout,
+            )
+
+    def _run(self) -> None:
+        while self._running:
+            try:
+                ready, _, _ = select.select([self._master], [], [], 0.05)
+                if not ready:
+                    continue
+                data = os.read(self._master, 4096)
+            except OSError:
+                return
+            arrived = time.perf_counter()
+            with self._cond:
+                self._receive(data, arrived)
+                self._cond.notify_all()
+
+    def _receive(self, data: bytes, arrived: float) -> None:
+        byte_time = BITS_PER_BYTE / self.baudrate
+        self.received_bytes += len(data)
+        for frame in self._decoder.feed(data):
+            # 回線が空いてから1行(1フレーム)分のバイトを送り終えるまで
+            wire_time = frame.size * byte_time
+            start = max(arrived, self._wire_free)
+            self._wire_free = start + wire_time
+            self._wire_busy += wire_time
+
+            line = frame.payload
+            if frame.type == FRAME_INVALID:
+                self.dropped.append(line)
+                continue
+            if frame.type == FRAME_REPORT:
+                is_report = apply_frame(self.state, frame.type, line)
+            elif not line:
+                continue
+            elif line + b"\r\n" == HANDSHAKE:
+                self.commands.append(line)
+                if self.supports_binary:
+                    os.write(self._master, HANDSHAKE_REPLY + b"\r\n")
+                continue
+            else:
+                is_report = apply_report(self.state, line)
+            if is_report:
+                s = self.state
+                values = (int(s.btn), int(s.hat), s.lx, s.ly, s.rx, s.ry)
+                report = ReceivedReport(
+                    len(self.reports), arrived, self._wire_free, values, line
+                )
+                self.reports.append(report)
+            elif line.isascii() and line.replace(b"_", b"").isalnum():
+                self.commands.append(line)
+            else:
+                self.dropped.append(line)
+
+    def merged(self) -> int:
+        """
+        USBの送信周期ごとに、Switchに届かずに次の入力で上書きされた入力の数を返す。
+        """
+        with self._cond:
+            reports = list(self.reports)
+        merged = 0
+        previous_window = None
+        for report in reports:
+            window = int(report.completed / self.poll_interval)
+            if window == previous_window:
+                merged += 1
+            previous_window = window
+        return merged
+
+    def stats(self) -> LoopbackStats:
+        with self._cond:
+            reports = list(self.reports)
+            commands = len(self.commands)
+            dropped = len(self.dropped)
+            received_bytes = self.received_bytes
+            busy = self._wire_busy
+        if len(reports) > 1:
+            span = reports[-1].completed - reports[0].arrived
+        else:
+            span = 0.0
+        return LoopbackStats(
+            len(reports),
+            commands,
+            dropped,
+            self.merged(),
+            len(reports) / span if span else 0.0,
+            received_bytes / span if span else 0.0,
+            busy / span if span else 0.0,
+        )
@@ -1,5 +1,6 @@
 # import argparse
 # import time
+from StartupProfiler import FIRST_FRAME, startup  # 起動時間の計測のため、最初にimportする
 from typing import Any  # noqa: F401
 import cv2
 import os
@@ -18,7 +19,7 @@ from pygubu.widgets.scrollbarhelper import ScrollbarHelper
 
 import Settings
 import Utility as util
-from Camera import Camera  # , CameraQueue
+from Camera import Camera, CameraQueue
 from CommandLoader import CommandLoader
 from Commands import McuCommandBase, PythonCommandBase, Sender
 import PokeConLogger
@@ -134,6 +135,13 @@ class PokeControllerApp:
         )
         self.show_size_cb.grid(column="4", padx="10", row="0", sticky="ew")
         self.show_size_cb.bind("<<ComboboxSelected>>", self.applyWindowSize, add="")
+        self.separator_stats = ttk.Separator(self.camera_f2)
+        self.separator_stats.config(orient="vertical")
+        self.separator_stats.grid(column="5", row="0", sticky="ns")
+        self.capture_stats = tk.StringVar()
+        self.capture_stats_label = ttk.Label(self.camera_f2)
+        self.capture_stats_label.config(textvariable=self.capture_stats)
+        self.capture_stats_label.grid(column="6", padx="5", row="0", sticky="ew")
         self.camera_f2.grid(column="0", columnspan="7", row="3", sticky="nsew")
         self.camera_name_l = ttk.Label(self.camera_lf)
         self.camera_name_l.config(anchor="center", text="Camera Name: ")
@@ -172,7 +180,7 @@ class PokeControllerApp:
             justify="right",
             state=self.baud_rate_state,
             textvariable=self.baud_rate,
-            values=[9600, 4800],
+            values=[9600, 4800, 38400, 115200, 1000000],
         )
         self.baud_rate_cb.config(width="6")
         self.baud_rate_cb.grid(column="3", padx="5", row="0", sticky="ew")
@@ -329,7 +337,8 @@ class PokeControllerApp:
         # th_text.start()
 
         # load settings file
-        self.loadSettings()
+        with startup.phase("settings"):
+            self.loadSettings()
         # 各tk変数に設定値をセット(コピペ簡単のため)
         self.is_show_realtime.set(self.settings.is_show_realtime.get())
         self.is_show_serial.set(self.settings.is_show_serial.get())
@@ -374,12 +383,18 @@ class PokeControllerApp:
             )
             self.Camera_Name.config(state="disable")
         # open up a camera
-        self.camera = Camera(self.fps.get())
-        # self.camera = CameraQueue(self.fps.get(), self.camera_id.get())
-        self.openCamera()
+        with startup.phase("camera_open"):
+            if self.settings.capture_backend.get() == "process":
+                self.camera = CameraQueue(int(self.fps.get()))
+            else:
+                self.camera = Camera(self.fps.get())
+            self.openCamera()
         # activate serial communication
-        self.ser = Sender.Sender(self.is_show_serial)
-        self.activateSerial()
+        with startup.phase("serial"):
+            self.ser = Sender.Sender(
+                self.is_show_serial, async_write=self.settings.is_async_serial.get()
+            )
+            self.activateSerial()
         self.activateKeyboard()
         self.preview = CaptureArea(
             self.camera,
@@ -393,7 +408,8 @@ class PokeControllerApp:
         self.preview.grid(
             column="0", columnspan="7", row="2", padx="5", pady="5", sticky=tk.NSEW
         )
-        self.loadCommands()
+        with startup.phase("command_load"):
+            self.loadCommands()
 
         self.show_size_tmp = self.show_size_cb["values"].index(self.show_size_cb.get())
         self.root.bind("<Key-F5>", self.ReloadCommandWithF5)
@@ -408,9 +424,11 @@ class PokeControllerApp:
 
         self.root.protocol("WM_DELETE_WINDOW", self.exit)
         self.preview.startCapture()
+        self.updateCaptureStats()
 
-        self.menu = PokeController_Menubar(self)
-        self.root.config(menu=self.menu)
+        with startup.phase("menu"):
+            self.menu = PokeController_Menubar(self)
+            self.root.config(menu=self.menu)
 
         # logging.debug(f'python version: {sys.version}')
 
@@ -502,8 +520,14 @@ class PokeControllerApp:
 
     def applyFps(self, event: Any = None) -> None:
         print("changed FPS to: " + self.fps.get() + " [fps]")
+        self.camera.setFps(int(self.fps.get()))
         self.preview.setFps(self.fps.get())
 
+    def updateCaptureStats(self) -> None:
+        stats = self.camera.captureStats()
+        self.capture_stats.set(f"{stats.fps:4.1f} fps / {stats.latency_ms:4.1f} ms")
+        self.capture_stats_label.after(500, self.updateCaptureStats)
+
     def applyBaudRate(self, event: Any = None) -> None:
         # 未実装
         pass
@@ -552,6 +576,9 @@ class PokeControllerApp:
                 logger.debug(
                     "COM Port " + str(self.com_port.get()) + " connected successfully"
                 )
+                if self.settings.serial_protocol.get() == "auto":
+                    # ファームウェアが対応していればバイナリフレームで送る
+                    self.ser.negotiate()
                 self.keyPress = KeyPress(self.ser)
                 self.settings.com_port.set(self.com_port.get())
                 self.settings.baud_rate.set(self.baud_rate.get())
@@ -644,13 +671,18 @@ class PokeControllerApp:
         self.mcu_cb.current(0)
 
     def assignCommand(self) -> None:
-        # 選択されているコマンドを取得する
-        self.mcu_cur_command = self.mcu_classes[
-            self.mcu_cb.current()
-        ]()  # MCUコマンドについて
+        # 選択されているコマンドを取得する(モジュールはここで初めてimportされる)
+        try:
+            mcu_class = self.mcu_classes[self.mcu_cb.current()].load()
+            cmd_class = self.py_classes[self.py_cb.current()].load()
+        except Exception as e:
+            print(f"Cannot load the command: {e}")
+            logger.error(f"Cannot load the command: {e}")
+            self.cur_command = None
+            return
+        self.mcu_cur_command = mcu_class()  # MCUコマンドについて
 
         # pythonコマンドは画像認識を使うかどうかで分岐している
-        cmd_class = self.py_classes[self.py_cb.current()]
         if issubclass(cmd_class, PythonCommandBase.ImageProcPythonCommand):
             try:  # 画像認識の際に認識位置を表示する引数追加。互換性のため従来のはexceptに。
                 self.py_cur_command = cmd_class(self.camera, self.preview)
@@ -683,8 +715,14 @@ class PokeControllerApp:
         if oldval_py in self.py_cb["values"]:
             self.py_cb.set(oldval_py)
         self.assignCommand()
+        for loader in (self.py_loader, self.mcu_loader):
+            for mod_name, elapsed in loader.last_report.reloaded:
+                print(f"Reloaded {mod_name} ({elapsed:.1f} ms)")
         print("Finished reloading command modules.")
-        logger.info("Reloaded commands.")
+        logger.info(
+            f"Reloaded commands. Python: {self.py_loader.last_report}, "
+            f"MCU: {self.mcu_loader.last_report}"
+        )
 
     def startPlay(self, *event: Any) -> None:
         if self.cur_command is None:
@@ -693,10 +731,13 @@ class PokeControllerApp:
 
         # set and init selected command
         self.assignCommand()
+        if self.cur_command is None:
+            return
 
         print(self.startButton["text"] + " " + self.cur_command.NAME)
         logger.info(self.startButton["text"] + " " + self.cur_command.NAME)
-        self.cur_command.start(self.ser, self.stopPlayPost)
+        if self.cur_command.start(self.ser, self.stopPlayPost) is False:
+            return  # 始められなかった(McuSequenceCommandの転送の失敗など)
 
         self.startButton["text"] = "Stop"
         self.startButton["command"] = self.stopPlay
@@ -716,37 +757,42 @@ class PokeControllerApp:
 
     def run(self) -> None:
         logger.debug("Start Poke-Controller")
+        startup.mark("mainloop")
         self.mainwindow.mainloop()
 
     def exit(self) -> None:
         ret = tkmsg.askyesno("確認", "Poke Controllerを終了しますか？")
         if ret:
-            if self.ser.isOpened():
-                self.ser.closeSerial()
-                print("Serial disconnected")
-                # logger.info("Serial disconnected")
+            self.close()
 
-            # stop listening to keyboard events
-            if self.keyboard is not None:
-                self.keyboard.stop()
-                self.keyboard = None
+    def close(self) -> None:
+        # 確認せずに終了する
+        if self.ser.isOpened():
+            self.ser.closeSerial()
+            print("Serial disconnected")
+            # logger.info("Serial disconnected")
+
+        # stop listening to keyboard events
+        if self.keyboard is not None:
+            self.keyboard.stop()
+            self.keyboard = None
 
-            # save settings
-            self.settings.is_show_realtime.set(self.is_show_realtime.get())
-            self.settings.is_show_serial.set(self.is_show_serial.get())
-            self.settings.is_use_keyboard.set(self.is_use_keyboard.get())
-            self.settings.fps.set(self.fps.get())
-            self.settings.show_size.set(self.show_size.get())
-            self.settings.com_port.set(self.com_port.get())
-            self.settings.baud_rate.set(self.baud_rate.get())
-            self.settings.camera_id.set(self.camera_id.get())
+        # save settings
+        self.settings.is_show_realtime.set(self.is_show_realtime.get())
+        self.settings.is_show_serial.set(self.is_show_serial.get())
+        self.settings.is_use_keyboard.set(self.is_use_keyboard.get())
+        self.settings.fps.set(self.fps.get())
+        self.settings.show_size.set(self.show_size.get())
+        self.settings.com_port.set(self.com_port.get())
+        self.settings.baud_rate.set(self.baud_rate.get())
+        self.settings.camera_id.set(self.camera_id.get())
 
-            self.settings.save()
+        self.settings.save()
 
-            self.camera.destroy()
-            cv2.destroyAllWindows()
-            logger.debug("Stop Poke Controller")
-            self.root.destroy()
+        self.camera.destroy()
+        cv2.destroyAllWindows()
+        logger.debug("Stop Poke Controller")
+        self.root.destroy()
 
     def closingController(self) -> None:
         if self.controller is not None:
@@ -831,6 +877,7 @@ class StdoutRedirector(object):
 
 
 if __name__ == "__main__":
+    startup.mark("imports")
     # もし実行階層でlsした結果にSerialControllerフォルダがある場合はそこに移動する
     if "SerialController" in os.listdir():
         os.chdir("SerialController")
@@ -844,4 +891,11 @@ if __name__ == "__main__":
 
     root = tk.Tk()
     app = PokeControllerApp(root)
+    startup.on_mark(
+        FIRST_FRAME,
+        lambda: logger.info(f"Time to first frame: {startup.elapsed_ms():.1f} ms"),
+    )
+    if startup.exit_after_first_frame:
+        # python -m StartupProfiler --exit
+        startup.on_mark(FIRST_FRAME, lambda: root.after(0, app.close))
     app.run()
@@ -0,0 +1,5 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Switchやカメラをつながずに実行できるベンチマーク
+# SerialControllerディレクトリで python -m benchmarks.<モジュール名> として実行する
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+コマンドの一覧を作る時間とメモリのベンチマーク
+
+以前のCommandLoader(Commands/PythonCommandsとCommands/McuCommandsの全てのモジュールをimportする)と、
+ソースを解析して一覧だけを作るCommandLoaderについて、子プロセスで一覧を作るまでの時間と
+常駐メモリ(RSS)の増加を計測する。解析の結果のキャッシュ(__pycache__/commands.json)が
+ない場合(cold)とある場合(warm)を分ける。importできないモジュールは以前の方法では読み飛ばす。
+RSSはLinuxの/proc/self/statusから読む。
+また、importできるコマンドを全て読み込んだ後のリロードについて、以前のreload(読み込んだ
+モジュールを全てリロードする)と、1つのモジュールだけが編集された場合のreloadの時間を比べる。
+
+    cd SerialController
+    python -m benchmarks.command_loader
+    python -m benchmarks.command_loader --repeat 10 --output loader.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.common import write_results
+
+PATHS = ["Commands/PythonCommands", "Commands/McuCommands"]
+MODES = ["eager", "lazy_cold", "lazy_warm", "reload_all", "reload_one"]
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def _eager(path: str, base: type) -> list:
+    # 以前のCommandLoader.load(importに失敗したモジュールは読み飛ばす)
+    import importlib
+
+    import Utility as util
+
+    classes = []
+    for name in util.getModuleNames(path):
+        try:
+            module = importlib.import_module(name)
+        except Exception:
+            continue
+        classes.extend(
+            c
+            for c in util.getClassesInModule(module)
+            if issubclass(c, base) and hasattr(c, "NAME") and c.NAME
+        )
+    return classes
+
+
+def _reload(mode: str, loaders: list) -> dict:
+    import importlib
+
+    for loader in loaders:
+        for entry in loader.load():
+            try:
+                entry.load()
+            except Exception:
+                continue
+    start = time.perf_counter()
+    if mode == "reload_all":
+        # 以前のCommandLoader.reload
+        for loader in loaders:
+            for module in loader.modules:
+                importlib.reload(module)
+    else:
+        # 最初に読み込んだモジュールが編集されたことにする
+        loader = loaders[0]
+        loader._imported[loader.modules[0].__name__] = None
+        for loader in loaders:
+            loader.reload()
+    return {
+        "elapsed_ms": (time.perf_counter() - start) * 1000,
+        "rss_mb": 0.0,
+        "modules": sum(len(loader.modules) for loader in loaders),
+        "commands": sum(len(loader.entries) for loader in loaders),
+    }
+
+
+def child(mode: str) -> dict:
+    from Commands import McuCommandBase, PythonCommandBase
+
+    import Utility as util
+    from CommandLoader import CommandLoader
+
+    bases = [PythonCommandBase.PythonCommand, McuCommandBase.McuCommand]
+    if mode.startswith("reload"):
+        loaders = [
+            CommandLoader(util.ospath(path), base) for path, base in zip(PATHS, bases)
+        ]
+        return _reload(mode, loaders)
+    modules = len(sys.modules)
+    rss = _rss_mb()
+    start = time.perf_counter()
+    commands = []
+    for path, base in zip(PATHS, bases):
+        if mode == "eager":
+            commands += _eager(util.ospath(path), base)
+        else:
+            loader = CommandLoader(util.ospath(path), base)
+            if mode == "lazy_cold" and os.path.exists(loader.index_path):
+                os.remove(loader.index_path)
+            commands += loader.load()
+    return {
+        "elapsed_ms": (time.perf_counter() - start) * 1000,
+        "rss_mb": _rss_mb() - rss,
+        "modules": len(sys.modules) - modules,
+        "commands": len(commands),
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child is not None:
+        print(json.dumps(child(args.child)))
+        return 0
+
+    cases = []
+    for mode in MODES:
+        results = []
+        for _ in range(args.repeat):
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.command_loader", "--child", mode],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            results.append(json.loads(out.strip().splitlines()[-1]))
+        elapsed = sorted(r["elapsed_ms"] for r in results)
+        case = {
+            "name": "list_commands",
+            "params": {"mode": mode},
+            "repeat": args.repeat,
+            "median_ms": statistics.median(elapsed),
+            "min_ms": elapsed[0],
+            "rss_mb": statistics.median(r["rss_mb"] for r in results),
+            "modules": results[-1]["modules"],
+            "commands": results[-1]["commands"],
+        }
+        print(
+            f"{mode:<10} {case['median_ms']:9.1f} ms  +{case['rss_mb']:6.1f} MB RSS  "
+            f"{case['modules']:4d} modules imported  {case['commands']} commands"
+        )
+        cases.append(case)
+
+    if args.output:
+        write_results(args.output, "command_loader", cases, {"repeat": args.repeat})
+        print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
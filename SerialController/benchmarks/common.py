@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import datetime
+import json
+import os
+import platform
+import statistics
+from time import perf_counter
+from typing import Any, Callable
+
+import cv2
+import numpy as np
+
+
+def measure(func: Callable[[], Any], repeat: int = 50, warmup: int = 3) -> dict:
+    """
+    funcを繰り返し呼び出して1回あたりの所要時間を計測する。
+
+    Args:
+        func (Callable): 計測する処理
+        repeat (int): 計測する回数
+        warmup (int): 計測前に空回しする回数(キャッシュの読み込みなどを除くため)
+
+    Returns:
+        dict: 所要時間の統計[ms]
+    """
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        samples.append((perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "repeat": repeat,
+        "median_ms": statistics.median(samples),
+        "mean_ms": statistics.fmean(samples),
+        "min_ms": samples[0],
+        "p90_ms": samples[min(len(samples) - 1, int(len(samples) * 0.9))],
+    }
+
+
+def environment() -> dict:
+    """結果を比較するときに確認する実行環境の情報"""
+    return {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+    }
+
+
+def case_key(case: dict) -> str:
+    return case["name"] + json.dumps(case.get("params", {}), sort_keys=True)
+
+
+def write_results(path: str, suite: str, cases: list[dict], meta: dict) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"suite": suite, "environment": environment(), "meta": meta, "cases": cases},
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+
+
+def compare(cases: list[dict], baseline_path: str, tolerance: float = 0.1) -> int:
+    """
+    以前の結果と中央値を比較して表示する。
+
+    Args:
+        cases (list[dict]): 今回の結果
+        baseline_path (str): 以前の結果のJSONファイル
+        tolerance (float): この割合を超えて遅くなったものを劣化とみなす
+
+    Returns:
+        int: 劣化とみなした件数
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {case_key(case): case for case in json.load(f)["cases"]}
+
+    regressions = 0
+    for case in cases:
+        before = baseline.get(case_key(case))
+        if before is None:
+            continue
+        ratio = case["median_ms"] / before["median_ms"] if before["median_ms"] else 1.0
+        mark = ""
+        if ratio > 1 + tolerance:
+            mark = "  <-- slower"
+            regressions += 1
+        elif ratio < 1 - tolerance:
+            mark = "  faster"
+        print(
+            f"{case['name']:<32} {json.dumps(case.get('params', {}), sort_keys=True):<60}"
+            f" {before['median_ms']:9.3f} -> {case['median_ms']:9.3f} ms (x{ratio:.2f}){mark}"
+        )
+    return regressions
+
+
+def print_case(case: dict) -> None:
+    print(
+        f"{case['name']:<32} {json.dumps(case.get('params', {}), sort_keys=True):<60}"
+        f" median {case['median_ms']:9.3f} ms  p90 {case['p90_ms']:9.3f} ms"
+    )
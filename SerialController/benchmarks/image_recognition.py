@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+画像認識まわりのベンチマーク
+
+保存済みのキャプチャ画像(--frames)か、テンプレート画像を貼り付けた合成フレームを
+FakeCameraから流し、isContainTemplate・isContainTemplate_max・getInterframeDiff・
+色検出の処理時間を、OpenCVのスレッド数と探索範囲(ROI)の大きさごとに計測する。
+
+    cd SerialController
+    python -m benchmarks.image_recognition --output bench.json
+    python -m benchmarks.image_recognition --compare bench.json
+"""
+
+import argparse
+import os
+import sys
+
+import cv2
+
+from benchmarks.common import compare, measure, print_case, write_results
+from Commands.PythonCommandBase import TEMPLATE_PATH, ImageProcPythonCommand
+from Commands.PythonCommands.color_detect_sample import ColorDetectSampleCommand
+from FakeCamera import FakeCamera, load_frames, synthetic_frames
+from TemplateMatcher import template_matcher
+
+TEMPLATES = ["shiny_mark.png", "status.png", "Network_Offline.png", "OP.png"]
+
+# 探索範囲: フレームの中央から指定した割合を切り出す
+ROI_FRACTIONS = [1.0, 0.5, 0.25]
+
+
+class _NullGui:
+    # 認識位置の矩形表示を無視する
+    def ImgRect(self, *args, **kwargs) -> None:
+        pass
+
+
+class _BenchCommand(ImageProcPythonCommand):
+    NAME = "benchmark"
+
+    def do(self) -> None:
+        pass
+
+
+def _centered_roi(size: tuple[int, int], fraction: float) -> list:
+    width, height = size
+    if fraction >= 1.0:
+        return []
+    w, h = int(width * fraction), int(height * fraction)
+    x, y = (width - w) // 2, (height - h) // 2
+    return [x, y, x + w, y + h]
+
+
+def _templates_in(templates: list[str], roi: list) -> list[str]:
+    # 切り出した範囲より大きいテンプレートは探索できないので除く
+    usable = []
+    for name in templates:
+        image = cv2.imread(os.path.join(TEMPLATE_PATH, name))
+        if image is None:
+            continue
+        h, w = image.shape[:2]
+        if roi and (w > roi[2] - roi[0] or h > roi[3] - roi[1]):
+            continue
+        usable.append(name)
+    return usable
+
+
+def run(
+    camera: FakeCamera,
+    thread_counts: list[int],
+    policies: list[str],
+    repeat: int,
+) -> list[dict]:
+    command = _BenchCommand(camera, _NullGui())
+    color = ColorDetectSampleCommand(camera, _NullGui())
+    cases = []
+
+    def record(name: str, params: dict, func) -> None:
+        case = {"name": name, "params": params, **measure(func, repeat)}
+        print_case(case)
+        cases.append(case)
+
+    for threads in thread_counts:
+        cv2.setNumThreads(threads)
+        for fraction in ROI_FRACTIONS:
+            crop = _centered_roi(camera.capture_size, fraction)
+            templates = _templates_in(TEMPLATES, crop)
+            for policy in policies:
+                command.match_policy = policy
+                for name in templates:
+                    for use_gray in (True, False):
+                        template_matcher.clear()
+                        record(
+                            "isContainTemplate",
+                            {
+                                "template": name,
+                                "gray": use_gray,
+                                "threads": threads,
+                                "roi": fraction,
+                                "policy": policy,
+                            },
+                            lambda: command.isContainTemplate(
+                                name, 0.7, use_gray, show_position=False, crop=crop
+                            ),
+                        )
+                template_matcher.clear()
+                record(
+                    "isContainTemplate_max",
+                    {
+                        "templates": len(templates),
+                        "threads": threads,
+                        "roi": fraction,
+                        "policy": policy,
+                    },
+                    lambda: command.isContainTemplate_max(
+                        templates, 0.7, show_position=False, crop=crop
+                    ),
+                )
+
+            record(
+                "detect_color_in_frame",
+                {"threads": threads, "roi": fraction},
+                lambda: color.detect_color_in_frame(crop=crop),
+            )
+
+        gray = [camera.readFrame(gray=True) for _ in range(3)]
+        record(
+            "getInterframeDiff",
+            {"threads": threads},
+            lambda: command.getInterframeDiff(*gray, 15),
+        )
+        record(
+            "readFrame",
+            {"threads": threads, "copy": True, "gray": True},
+            lambda: camera.readFrame(gray=True),
+        )
+    return cases
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--frames", help="キャプチャ画像のフォルダ(省略時は合成フレームを使う)"
+    )
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument(
+        "--threads",
+        default=f"1,{os.cpu_count() or 1}",
+        help="OpenCVのスレッド数(カンマ区切り)",
+    )
+    parser.add_argument("--policies", default="exact,balanced")
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    parser.add_argument("--compare", help="比較する以前の結果のJSONファイル")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    if args.frames:
+        frames = load_frames(args.frames)
+        source = os.path.abspath(args.frames)
+    else:
+        frames = synthetic_frames(
+            templates=[os.path.join(TEMPLATE_PATH, name) for name in TEMPLATES]
+        )
+        source = "synthetic"
+    if not frames:
+        print(f"No frames found in {args.frames}")
+        return 1
+    camera = FakeCamera(frames)
+
+    thread_counts = sorted({int(v) for v in args.threads.split(",")})
+    policies = args.policies.split(",")
+    default_threads = cv2.getNumThreads()
+    try:
+        cases = run(camera, thread_counts, policies, args.repeat)
+    finally:
+        cv2.setNumThreads(default_threads)
+
+    if args.output:
+        write_results(
+            args.output,
+            "image_recognition",
+            cases,
+            {"frames": source, "frame_count": len(frames), "repeat": args.repeat},
+        )
+        print(f"Results written to {args.output}")
+    if args.compare:
+        regressions = compare(cases, args.compare, args.tolerance)
+        print(f"{regressions} regression(s)")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+MCUシーケンスの確認とベンチマーク
+
+timeLeapや記録したスティックのログを時刻表に変換し、McuEmulatorに転送して再生する。
+再生した入力がPC側から1つずつ送った場合と同じであることを確認し、
+PC側から送った場合のタイミングのずれと、時刻表の大きさを表示する。
+
+    cd SerialController
+    python -m benchmarks.mcu_sequence
+    python -m benchmarks.mcu_sequence --playrec Logs/stick.csv
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.common import measure, print_case, write_results
+from Commands.Keys import Button, Direction, KeyPress
+from Commands.McuSequence import (
+    McuEmulator,
+    McuUploader,
+    compile_playrec,
+    compile_sequence,
+)
+from Commands.PythonCommandBase import PythonCommand
+from Commands.Sequencer import Sequence, Sequencer
+from Commands.SerialProtocol import ReportState, apply_report
+
+
+class _Command(PythonCommand):
+    NAME = "benchmark"
+
+    def do(self) -> None:
+        pass
+
+
+class _TimedPort:
+    # 送られた行を、送られた時刻とマイコン側の状態として記録する
+    def __init__(self):
+        self.state = ReportState()
+        self.received: list[tuple[float, tuple]] = []
+
+    def writeEncoded(self, data, is_show=False, send_at=None, coalesce=False) -> None:
+        self.writeRow(bytes(data).decode("ascii"))
+
+    def writeRow(self, row, is_show=False, send_at=None, coalesce=False) -> None:
+        now = time.perf_counter()
+        if apply_report(self.state, row):
+            s = self.state
+            values = (int(s.btn), int(s.hat), s.lx, s.ly, s.rx, s.ry)
+            self.received.append((now, values))
+
+
+def _upload_and_play(program) -> tuple[int, list]:
+    emulator = McuEmulator()
+    size = McuUploader(emulator).upload(program)
+    emulator.write(b"seq_play\r\n")
+    return size, emulator.playback
+
+
+def _check(name: str, program, expected: list[tuple]) -> bool:
+    size, playback = _upload_and_play(program)
+    played = [values for _, values in playback]
+    same = played == expected
+    print(
+        f"{name:<24} {len(program):5d} reports  {size:6d} bytes  "
+        f"{program.duration:8.3f} s  {'identical' if same else 'MISMATCH'}"
+    )
+    return same
+
+
+def _random_playrec(rows: int, seed: int = 0) -> list[list[float]]:
+    rng = random.Random(seed)
+    return [[rng.uniform(-180, 180), rng.random(), 0.015] for _ in range(rows)]
+
+
+def _load_playrec(path: str) -> list[list[float]]:
+    with open(path) as f:
+        return [list(map(float, s.strip().split(","))) for s in f if s.strip()]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--playrec", help="PlayRecで再生するスティックのログ")
+    parser.add_argument("--presses", type=int, default=100, help="PC側で送る入力の回数")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    args = parser.parse_args(argv)
+
+    ok = True
+    command = _Command()
+    cases = []
+
+    # 変換した時刻表が、PC側から送った場合と同じ入力になるか
+    for is_go_back in (True, False):
+        sequence = command.timeLeapSequence(is_go_back)
+        port = _TimedPort()
+        keys = KeyPress(port)
+        for event in sequence.events:
+            getattr(keys, event.action)(event.buttons)
+        expected = [values for _, values in port.received]
+        program = compile_sequence(sequence)
+        ok &= _check(f"timeLeap({is_go_back})", program, expected)
+        case = {
+            "name": "compile_sequence",
+            "params": {"sequence": f"timeLeap({is_go_back})"},
+            **measure(lambda: compile_sequence(sequence), args.repeat),
+        }
+        print_case(case)
+        cases.append(case)
+
+    rows = _load_playrec(args.playrec) if args.playrec else _random_playrec(500)
+    port = _TimedPort()
+    for angle, r, _ in rows:
+        # PlayRec.LStickと同じ行
+        port.writeRow(
+            f"2 8 {hex(int(128 + r * 127.5 * np.cos(np.deg2rad(angle))))} "
+            f"{hex(int(128 - r * 127.5 * np.sin(np.deg2rad(angle))))}"
+        )
+    port.writeRow("2 8 80 80")
+    expected = [values for _, values in port.received]
+    ok &= _check("playrec", compile_playrec(rows), expected)
+
+    # PC側から送った場合のタイミングのずれ
+    sequence = Sequence().pressRep(Button.A, args.presses, 0.017, 0.017)
+    sequence.pressRep(Direction.RIGHT, args.presses // 4, 0.05, 0.05)
+    port = _TimedPort()
+    report = Sequencer(KeyPress(port)).run(sequence)
+    errors = sorted(abs(step.error) * 1000 for step in report.steps)
+    program = compile_sequence(sequence)
+    mcu_errors = sorted(
+        abs(frame.tick * program.tick_us / 1e6 - event.at) * 1000
+        for frame, event in zip(program.frames, sequence.events)
+    )
+    print(
+        f"host streaming: error median {statistics.median(errors):.3f} ms "
+        f"p99 {errors[int(len(errors) * 0.99)]:.3f} ms max {errors[-1]:.3f} ms"
+    )
+    print(
+        f"mcu playback  : error max {mcu_errors[-1]:.3f} ms "
+        f"(tick {program.tick_us} us, no host involvement)"
+    )
+    cases.append(
+        {
+            "name": "host_streaming_error",
+            "params": {"presses": args.presses},
+            "repeat": len(errors),
+            "median_ms": statistics.median(errors),
+            "max_ms": errors[-1],
+        }
+    )
+
+    if args.output:
+        write_results(args.output, "mcu_sequence", cases, {"repeat": args.repeat})
+        print(f"Results written to {args.output}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+複数の機材を1つのプロセスで動かした場合のメモリとCPUのベンチマーク
+
+機材の数ごとに子プロセスを起動し、Orchestratorで機材(FakeCameraとpty)を動かして、
+常駐メモリ(RSS)・CPU時間・スレッド数・コマンドが行ったテンプレートマッチングの回数を計測する。
+機材ごとに別のプロセスを起動した場合の値は、機材1台の子プロセスの値を台数倍して比べる。
+Linuxで実行する(RSSは/proc/self/statusから読む)。
+
+    cd SerialController
+    python -m benchmarks.orchestrator
+    python -m benchmarks.orchestrator --rigs 1,4,8 --duration 10 --output fleet.json
+"""
+
+import argparse
+import json
+import os
+import select
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+
+from benchmarks.common import write_results
+
+WORKLOAD = "benchmark workload"
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _drain(masters: list[int], stop: threading.Event) -> None:
+    # ptyに書かれた行を読み捨てる(読まないとバッファが埋まって書き込みが止まる)
+    while not stop.is_set():
+        readable, _, _ = select.select(masters, [], [], 0.1)
+        for fd in readable:
+            os.read(fd, 4096)
+
+
+def _workload_class():
+    from Commands.Keys import Button
+    from Commands.PythonCommandBase import ImageProcPythonCommand
+
+    class Workload(ImageProcPythonCommand):
+        # 新しいフレームごとにテンプレートを探し、Aボタンを押す
+        NAME = WORKLOAD
+        template = None
+        matches = 0
+
+        def do(self):
+            seq = 0
+            while True:
+                _, seq = self.readNextFrame(after_seq=seq)
+                self.isContainTemplate(self.template, 0.8, show_position=False)
+                type(self).matches += 1
+                self.press(Button.A, 0.03, 0.03)
+
+    return Workload
+
+
+def child(rigs: int, duration: float, fps: int) -> dict:
+    import Settings
+    from FakeCamera import synthetic_frames
+    from Orchestrator import Orchestrator, RigConfig
+
+    Settings.GuiSettings.headless = True
+    workload = _workload_class()
+    with tempfile.TemporaryDirectory() as tmp:
+        frames = synthetic_frames(4, (1280, 720))
+        for i, frame in enumerate(frames):
+            cv2.imwrite(os.path.join(tmp, f"{i}.png"), frame)
+        workload.template = os.path.join(tmp, "template.png")
+        cv2.imwrite(workload.template, frames[0][300:380, 500:620])
+
+        masters, configs = [], []
+        for i in range(rigs):
+            master, slave = os.openpty()
+            masters.append(master)
+            configs.append(
+                RigConfig(
+                    f"rig{i}",
+                    WORKLOAD,
+                    frames=tmp,
+                    port=os.ttyname(slave),
+                    baudrate=115200,
+                    fps=fps,
+                )
+            )
+        stop = threading.Event()
+        drainer = threading.Thread(target=_drain, args=(masters, stop), daemon=True)
+        drainer.start()
+
+        start_cpu = sum(os.times()[:2])
+        start = time.perf_counter()
+        with Orchestrator(configs, [workload]) as orchestrator:
+            orchestrator.start()
+            time.sleep(duration)
+            statuses = orchestrator.status()
+            rss = _rss_mb()
+            threads = threading.active_count()
+            elapsed = time.perf_counter() - start
+            cpu = sum(os.times()[:2]) - start_cpu
+        stop.set()
+    return {
+        "rigs": rigs,
+        "rss_mb": rss,
+        "cpu_percent": cpu / elapsed * 100,
+        "threads": threads,
+        "matches_per_sec": workload.matches / elapsed,
+        "serial_sent": sum(s.serial_sent for s in statuses),
+        "unhealthy": sum(s.health != "ok" for s in statuses),
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--rigs", default="1,2,4,8", help="機材の数(カンマ区切り)")
+    parser.add_argument("--duration", type=float, default=5.0, help="計測する時間[s]")
+    parser.add_argument("--fps", type=int, default=30, help="機材ごとのキャプチャのFPS")
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child is not None:
+        print(json.dumps(child(args.child, args.duration, args.fps)))
+        return 0
+
+    cases = []
+    single = None
+    for rigs in (int(v) for v in args.rigs.split(",")):
+        out = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.orchestrator",
+                "--child",
+                str(rigs),
+                "--duration",
+                str(args.duration),
+                "--fps",
+                str(args.fps),
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        if rigs == 1:
+            single = result
+        separate = f"{single['rss_mb'] * rigs:7.1f} MB" if single else "      -"
+        print(
+            f"{rigs:3d} rigs  RSS {result['rss_mb']:7.1f} MB "
+            f"(separate processes {separate})  CPU {result['cpu_percent']:5.1f}%  "
+            f"threads {result['threads']:3d}  "
+            f"matches {result['matches_per_sec']:6.1f}/s  "
+            f"unhealthy {result['unhealthy']}"
+        )
+        cases.append({"name": "fleet", "params": {"rigs": rigs}, "repeat": 1, **result})
+
+    if args.output:
+        write_results(
+            args.output,
+            "orchestrator",
+            cases,
+            {"duration": args.duration, "fps": args.fps},
+        )
+        print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
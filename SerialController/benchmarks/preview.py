@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+プレビューの表示とスティックの記録のベンチマーク
+
+以前のCaptureArea.capture(cvtColorしてからPILで縮小)とPreviewRendererの処理(cv2.resizeで
+縮小してから変換)の1フレームあたりの時間と、FakeCameraを表示より速く進めたときに
+PreviewRendererが縮小せずに読み飛ばすフレーム数を計測する。
+また、以前のマウス操作の記録(dequeにリストを追加してloggingで書き出す)と
+StickRecorder.recordの1サンプルあたりの時間を比べる。
+
+    cd SerialController
+    python -m benchmarks.preview
+    python -m benchmarks.preview --size 1920x1080 --output preview.json
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import deque
+
+import cv2
+from PIL import Image
+
+from benchmarks.common import measure, print_case, write_results
+from Commands.StickRecorder import STICK_LEFT, StickRecorder
+from FakeCamera import FakeCamera, synthetic_frames
+from PreviewRenderer import PreviewRenderer
+
+
+def legacy_preview(frame, size):
+    # 以前のCaptureArea.captureと同じ処理(PhotoImageを作る手前まで)
+    image_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    return Image.fromarray(image_rgb).resize(size)
+
+
+def _parse_size(text: str) -> tuple[int, int]:
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def _legacy_record(path: str, samples: int) -> None:
+    # 以前のmouseLeftPressing/mouseLeftRelease
+    handler = logging.FileHandler(filename=path, encoding="utf-8")
+    stick_logger = logging.getLogger("benchmark_stick")
+    stick_logger.setLevel(logging.DEBUG)
+    stick_logger.addHandler(handler)
+    dq = deque()
+    for i in range(samples):
+        dq.append([i % 360, 0.5, 0.016])
+    for _ in dq:
+        stick_logger.debug(",".join(list(map(str, _))))
+    stick_logger.removeHandler(handler)
+    handler.close()
+
+
+def _skip_rate(camera: FakeCamera, size, interval: float, duration: float):
+    # Tkがinterval秒ごとにしか受け取れない場合
+    renderer = PreviewRenderer(camera, size, int(interval * 1000))
+    renderer.start()
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        renderer.take()
+        time.sleep(interval)
+    renderer.stop()
+    return renderer.stats()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--size", default="1280x720", help="カメラのフレームの大きさ")
+    parser.add_argument("--show-size", default="640x360", help="表示の大きさ")
+    parser.add_argument("--samples", type=int, default=5000, help="記録するサンプル数")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    args = parser.parse_args(argv)
+
+    size = _parse_size(args.size)
+    show_size = _parse_size(args.show_size)
+    frame = synthetic_frames(1, size)[0]
+    renderer = PreviewRenderer(None, show_size)
+
+    cases = []
+    for name, func in (
+        ("legacy", lambda: legacy_preview(frame, show_size)),
+        ("renderer", lambda: renderer._render(frame)),
+    ):
+        case = {
+            "name": "preview_frame",
+            "params": {"impl": name, "size": args.size, "show_size": args.show_size},
+            **measure(func, args.repeat),
+        }
+        print_case(case)
+        cases.append(case)
+
+    camera = FakeCamera(synthetic_frames(4, size), fps=60, advance_on_read=False)
+    stats = _skip_rate(camera, show_size, 0.05, 2.0)
+    print(
+        f"preview at 20 fps from a 60 fps camera: rendered {stats.rendered}, "
+        f"shown {stats.shown}, skipped {stats.skipped}"
+    )
+    cases.append(
+        {
+            "name": "preview_skip",
+            "params": {"camera_fps": 60, "show_fps": 20},
+            "repeat": 1,
+            "rendered": stats.rendered,
+            "shown": stats.shown,
+            "skipped": stats.skipped,
+        }
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base = os.path.join(tmp, "stick")
+        recorder = StickRecorder(base, capacity=args.samples * 2)
+
+        def record():
+            for i in range(args.samples):
+                recorder.record(STICK_LEFT, i % 360, 0.5, 0.016)
+            recorder.flush()
+
+        for name, func in (
+            ("logging", lambda: _legacy_record(base + ".log", args.samples)),
+            ("recorder", record),
+        ):
+            case = {
+                "name": "stick_record",
+                "params": {"impl": name, "samples": args.samples},
+                **measure(func, max(args.repeat // 5, 3)),
+            }
+            print_case(case)
+            cases.append(case)
+        recorder.close()
+        logging.getLogger("benchmark_stick").handlers.clear()
+
+    if args.output:
+        write_results(args.output, "preview", cases, {"repeat": args.repeat})
+        print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+シリアル送信のループバックベンチマーク
+
+VirtualController(pty)をSenderでつなぎ、KeyPress.input/inputEnd・pressRep・
+マウスのスティック操作の行を送って(同じ状態の入力を省く場合と省かない場合も比べる)、ボーレートごとに1秒あたりの入力数、
+送信から受け取り終えるまでの時間、解釈できなかった行とUSBの送信周期の間に上書きされた入力を計測する。
+回線の速度はボーレートから計算する(ptyは遅延しない)。Linux/macOSで実行する。
+--protocolsでテキストの行とバイナリフレーム(Sender.negotiateで切り替える)の転送量を比べる。
+
+    cd SerialController
+    python -m benchmarks.serial_loopback --output loopback.json
+    python -m benchmarks.serial_loopback --protocols text,binary --baudrates 9600
+"""
+
+import argparse
+import math
+import random
+import statistics
+import sys
+import time
+
+from benchmarks.common import compare, write_results
+from Commands.Keys import Button, Direction, Hat, KeyPress, Stick
+from Commands.PythonCommandBase import PythonCommand
+from Commands.Scheduler import HybridScheduler
+from Commands.Sender import Sender
+from VirtualController import VirtualController
+
+BAUDRATES = [9600, 38400, 115200, 1000000]
+PROTOCOLS = ["text", "binary"]
+
+
+class _Flag:
+    def get(self) -> bool:
+        return False
+
+
+class _TimestampedPort:
+    # 書き込んだ時刻を記録する(1回の書き込みが1行)
+    def __init__(self, port):
+        self.port = port
+        self.sent: list[float] = []
+
+    def write(self, data) -> int:
+        self.sent.append(time.perf_counter())
+        return self.port.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+
+class _Command(PythonCommand):
+    NAME = "benchmark"
+
+    def do(self) -> None:
+        pass
+
+
+def _keypress_burst(keys: KeyPress, count: int) -> None:
+    rng = random.Random(0)
+    buttons = list(Button) + list(Hat)
+    for _ in range(count):
+        btns = [rng.choice(buttons)]
+        if rng.random() < 0.3:
+            btns.append(Direction(Stick.LEFT, rng.randrange(360)))
+        keys.input(btns)
+        keys.inputEnd(btns)
+
+
+def _hold_macro(keys: KeyPress, count: int) -> None:
+    # Bを押したまま、状態の変わらない入力とAの入力を繰り返す
+    keys.hold(Button.B)
+    for _ in range(count):
+        keys.input(Button.B)
+        keys.inputEnd([])
+        keys.input(Button.A)
+        keys.inputEnd(Button.A)
+    keys.holdEnd(Button.B)
+
+
+def _press_rep(keys: KeyPress, count: int) -> None:
+    command = _Command()
+    command.keys = keys
+    command.pressRep(Button.A, count, duration=0.017, interval=0.017, wait=0)
+
+
+def _mouse_stick(sender: Sender, count: int, rate: float) -> None:
+    # CaptureArea.mouseLeftPressingと同じ形式の行をrate[Hz]で送る
+    scheduler = HybridScheduler()
+    start = time.perf_counter()
+    for i in range(count):
+        scheduler.sleep_until(start + i / rate)
+        angle = i * 7 % 360
+        mag = 0.5 + 0.5 * math.sin(i / 20)
+        sender.writeRow(
+            f"3 8 "
+            f"{hex(int(128 + mag * 127.5 * math.cos(math.radians(angle))))} "
+            f"{hex(int(128 - mag * 127.5 * math.sin(math.radians(angle))))} "
+            f"80 80",
+            is_show=False,
+        )
+
+
+def run_scenario(
+    controller: VirtualController,
+    baudrate: int,
+    name: str,
+    drive,
+    protocol: str = "text",
+) -> dict:
+    controller.reset(baudrate)
+    sender = Sender(_Flag(), if_print=False)
+    if not sender.openSerial(0, controller.port_name, baudrate):
+        raise RuntimeError(f"cannot open {controller.port_name}")
+    if protocol == "binary":
+        if not sender.negotiate():
+            sender.closeSerial()
+            raise RuntimeError("the virtual controller did not accept binary frames")
+        # ハンドシェイクの行は数えない
+        controller.reset()
+    port = _TimestampedPort(sender.ser)
+    sender.ser = port
+    try:
+        drive(sender)
+        controller.wait_for(len(port.sent), timeout=10.0)
+    finally:
+        sender.ser = port.port
+        sender.closeSerial()
+
+    stats = controller.stats()
+    reports = controller.reports
+    latencies = sorted(
+        (report.completed - sent) * 1000 for report, sent in zip(reports, port.sent)
+    )
+    bytes_per_report = (
+        stats.bytes_per_sec / stats.reports_per_sec if stats.reports_per_sec else 0.0
+    )
+    case = {
+        "name": name,
+        "params": {"baudrate": baudrate, "protocol": protocol},
+        "repeat": len(port.sent),
+        "sent": len(port.sent),
+        "received": stats.received,
+        "dropped": stats.dropped,
+        "merged": stats.merged,
+        "reports_per_sec": stats.reports_per_sec,
+        "bytes_per_report": bytes_per_report,
+        "wire_busy": stats.wire_busy,
+        "median_ms": statistics.median(latencies) if latencies else 0.0,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] if latencies else 0.0,
+        "max_ms": latencies[-1] if latencies else 0.0,
+    }
+    print(
+        f"{name:<22} {protocol:<6} {baudrate:>8} baud  sent {case['sent']:5d}"
+        f"  recv {stats.received:5d}"
+        f"  drop {stats.dropped:3d}  merged {stats.merged:5d}"
+        f"  {stats.reports_per_sec:8.0f} reports/s"
+        f" {case['bytes_per_report']:5.1f} B/report  latency median "
+        f"{case['median_ms']:8.2f} ms  p99 {case['p99_ms']:8.2f} ms"
+        f"  wire {stats.wire_busy:5.0%}"
+    )
+    return case
+
+
+def run(
+    baudrates: list[int],
+    count: int,
+    rate: float,
+    protocols: list[str] | None = None,
+) -> list[dict]:
+    cases = []
+    with VirtualController() as controller:
+        for protocol in protocols or ["text"]:
+            for baudrate in baudrates:
+                cases.extend(
+                    _run_baudrate(controller, baudrate, count, rate, protocol)
+                )
+    return cases
+
+
+def _run_baudrate(
+    controller: VirtualController,
+    baudrate: int,
+    count: int,
+    rate: float,
+    protocol: str,
+) -> list[dict]:
+    def scenario(name, drive):
+        return run_scenario(controller, baudrate, name, drive, protocol)
+
+    cases = [
+        scenario(
+            "keypress_burst",
+            lambda sender: _keypress_burst(KeyPress(sender), count),
+        )
+    ]
+    for suppress in (False, True):
+        cases.append(
+            scenario(
+                f"hold_macro({'suppress' if suppress else 'all'})",
+                lambda sender: _hold_macro(
+                    KeyPress(sender, suppress_redundant=suppress), count // 4
+                ),
+            )
+        )
+    cases.append(
+        scenario("pressRep", lambda sender: _press_rep(KeyPress(sender), 30))
+    )
+    cases.append(
+        scenario("mouse_stick", lambda sender: _mouse_stick(sender, count, rate))
+    )
+    return cases
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--baudrates",
+        default=",".join(map(str, BAUDRATES)),
+        help="ボーレート(カンマ区切り)",
+    )
+    parser.add_argument(
+        "--protocols", default="text", help="text, binary(カンマ区切り)"
+    )
+    parser.add_argument("--count", type=int, default=500, help="送る入力の数")
+    parser.add_argument(
+        "--rate", type=float, default=500, help="マウスのスティック操作を送る頻度[Hz]"
+    )
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    parser.add_argument("--compare", help="比較する以前の結果のJSONファイル")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    baudrates = [int(v) for v in args.baudrates.split(",")]
+    protocols = args.protocols.split(",")
+    for protocol in protocols:
+        if protocol not in PROTOCOLS:
+            parser.error(f"unknown protocol: {protocol}")
+    cases = run(baudrates, args.count, args.rate, protocols)
+    if args.output:
+        write_results(
+            args.output,
+            "serial_loopback",
+            cases,
+            {"count": args.count, "rate": args.rate, "protocols": protocols},
+        )
+        print(f"Results written to {args.output}")
+    if args.compare:
+        regressions = compare(cases, args.compare, args.tolerance)
+        print(f"{regressions} regression(s)")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
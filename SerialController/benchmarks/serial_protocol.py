@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+シリアル送信データ生成のベンチマーク
+
+KeyPress.input/inputEndが1レポートを送るまでの処理時間を、以前の文字列組み立て
+(OrderedDictのコピーとSendFormat.convert2str)と現在のReportEncoderで比較する。
+計測の前に、ランダムな入力でどちらも同じバイト列を送ることを確認する。
+あわせて、Directionの生成(Direction()、Direction.of、Direction.stickValues)を比較する。
+
+    cd SerialController
+    python -m benchmarks.serial_protocol --output serial.json
+"""
+
+import argparse
+import random
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+from benchmarks.common import compare, measure, print_case, write_results
+from Commands.Keys import Button, Direction, Hat, KeyPress, SendFormat, Stick
+from Commands.Sender import Sender
+from Commands.SerialProtocol import ReportEncoder, ReportState
+
+BATCH = 1000
+
+
+class _NullSerial:
+    # 送ったバイト列を最後の1件だけ残す
+    def __init__(self):
+        self.last = b""
+
+    def write(self, data) -> int:
+        self.last = data
+        return len(data)
+
+
+class _Flag:
+    def get(self) -> bool:
+        return False
+
+
+def legacy_convert2str(fmt: OrderedDict, l_changed: bool, r_changed: bool) -> str:
+    # 以前のSendFormat.convert2strと同じ処理
+    str_L = ""
+    str_R = ""
+    space = " "
+    send_btn = int(fmt["btn"]) << 2
+    if l_changed:
+        send_btn |= 0x2
+        str_L = format(fmt["lx"], "x") + space + format(fmt["ly"], "x")
+    if r_changed:
+        send_btn |= 0x1
+        str_R = format(fmt["rx"], "x") + space + format(fmt["ry"], "x")
+    str_Hat = str(int(fmt["hat"]))
+    return (
+        format(send_btn, "#06x")
+        + (space + str_Hat)
+        + (space + str_L if l_changed else "")
+        + (space + str_R if r_changed else "")
+    )
+
+
+def random_state(rng: random.Random) -> ReportState:
+    state = ReportState()
+    state.btn = rng.getrandbits(14)
+    state.hat = rng.randrange(9)
+    state.lx, state.ly, state.rx, state.ry = (rng.randrange(256) for _ in range(4))
+    state.l_changed = rng.random() < 0.5
+    state.r_changed = rng.random() < 0.5
+    return state
+
+
+def verify(count: int, seed: int = 0) -> int:
+    """
+    ランダムな状態を以前の形式とReportEncoderで変換し、異なった件数を返す。
+    ボタン・HAT・スティックの全ての値を含むように、端の値も必ず試す。
+    """
+    rng = random.Random(seed)
+    encoder = ReportEncoder()
+    states = [random_state(rng) for _ in range(count)]
+    for value in (0, 255):
+        state = ReportState()
+        state.btn = (1 << 14) - 1 if value else 0
+        state.hat = 8 if value else 0
+        state.lx = state.ly = state.rx = state.ry = value
+        state.l_changed = state.r_changed = True
+        states.append(state)
+    for v in range(256):
+        state = ReportState()
+        state.lx, state.ly, state.rx, state.ry = v, 255 - v, v, v
+        state.l_changed = state.r_changed = True
+        states.append(state)
+
+    mismatches = 0
+    for state in states:
+        expected = legacy_convert2str(
+            dict(btn=state.btn, hat=state.hat, lx=state.lx, ly=state.ly,
+                 rx=state.rx, ry=state.ry),
+            state.l_changed,
+            state.r_changed,
+        )
+        expected = (expected + "\r\n").encode("utf-8")
+        actual = bytes(encoder.encode(state.copy()))
+        if actual != expected:
+            mismatches += 1
+            print(f"mismatch: {expected!r} != {actual!r}")
+    return mismatches
+
+
+class _LegacyKeyPress:
+    # 以前のKeyPress.input/inputEndの送信までの処理(比較用)
+    def __init__(self, ser: Sender):
+        self.ser = ser
+        self.format = SendFormat()
+        self.holdButton = []
+
+    def _row(self) -> str:
+        fmt = self.format
+        row = legacy_convert2str(fmt.format, fmt.L_stick_changed, fmt.R_stick_changed)
+        fmt.L_stick_changed = False
+        fmt.R_stick_changed = False
+        return row
+
+    def input(self, btns) -> None:
+        self._pushing = OrderedDict(self.format.format)
+        if not isinstance(btns, list):
+            btns = [btns]
+        for btn in self.holdButton:
+            if btn not in btns:
+                btns.append(btn)
+        self.format.setButton([btn for btn in btns if type(btn) is Button])
+        self.format.setHat([btn for btn in btns if type(btn) is Hat])
+        self.format.setAnyDirection([btn for btn in btns if type(btn) is Direction])
+        self.ser.writeRow(self._row())
+
+    def inputEnd(self, btns) -> None:
+        self.pushing2 = OrderedDict(self.format.format)
+        if not isinstance(btns, list):
+            btns = [btns]
+        tilts = []
+        for dir in [btn for btn in btns if type(btn) is Direction]:
+            tilts.extend(dir.getTilting())
+        self.format.unsetButton([btn for btn in btns if type(btn) is Button])
+        self.format.unsetHat()
+        self.format.unsetDirection(tilts)
+        self.ser.writeRow(self._row())
+
+
+def _inputs(seed: int = 0) -> list[list]:
+    rng = random.Random(seed)
+    buttons = list(Button)
+    hats = list(Hat)
+    inputs = []
+    for _ in range(BATCH):
+        btns = [rng.choice(buttons)]
+        if rng.random() < 0.3:
+            btns.append(rng.choice(hats))
+        if rng.random() < 0.5:
+            btns.append(Direction(Stick.LEFT, rng.randrange(360)))
+        if rng.random() < 0.2:
+            btns.append(Direction(Stick.RIGHT, rng.randrange(360)))
+        inputs.append(btns)
+    return inputs
+
+
+def _sender() -> tuple[Sender, _NullSerial]:
+    ser = _NullSerial()
+    sender = Sender(_Flag(), if_print=False)
+    sender.ser = ser
+    return sender, ser
+
+
+def run(repeat: int) -> tuple[list[dict], int]:
+    inputs = _inputs()
+    cases = []
+
+    def record(name: str, params: dict, func, reports: int = BATCH) -> None:
+        case = {"name": name, "params": params, **measure(func, repeat)}
+        # 1レポートあたりの時間[us]
+        case["per_report_us"] = case["median_ms"] * 1000 / reports
+        print_case(case)
+        print(f"{'':<32} {'':<60} {case['per_report_us']:9.3f} us/report")
+        cases.append(case)
+
+    # 送信内容の一致(KeyPressを通した場合)
+    legacy_sender, legacy_ser = _sender()
+    sender, ser = _sender()
+    legacy = _LegacyKeyPress(legacy_sender)
+    current = KeyPress(sender)
+    mismatches = 0
+    for btns in inputs:
+        legacy.input(list(btns))
+        current.input(list(btns))
+        mismatches += legacy_ser.last != ser.last
+        legacy.inputEnd(list(btns))
+        current.inputEnd(list(btns))
+        mismatches += legacy_ser.last != ser.last
+    print(f"KeyPress output mismatches: {mismatches}")
+
+    def press(keypress) -> None:
+        for btns in inputs:
+            keypress.input(btns)
+            keypress.inputEnd(btns)
+
+    # input/inputEndで2レポート
+    record("keypress", {"impl": "legacy"}, lambda: press(legacy), 2 * BATCH)
+    record("keypress", {"impl": "encoder"}, lambda: press(current), 2 * BATCH)
+
+    rng = random.Random(1)
+    states = [random_state(rng) for _ in range(BATCH)]
+    encoder = ReportEncoder()
+
+    def legacy_encode() -> None:
+        for state in states:
+            fmt = OrderedDict(btn=state.btn, hat=state.hat, lx=state.lx,
+                              ly=state.ly, rx=state.rx, ry=state.ry)
+            row = legacy_convert2str(fmt, state.l_changed, state.r_changed)
+            (row + "\r\n").encode("utf-8")
+
+    def encode() -> None:
+        for state in states:
+            encoder.encode(state, clear_changed=False)
+
+    record("encode", {"impl": "legacy"}, legacy_encode)
+    record("encode", {"impl": "encoder"}, encode)
+
+    # マウスや記録したログのように、サンプルごとに角度と倒し具合が変わる場合
+    angles = [rng.uniform(-180, 180) for _ in range(BATCH)]
+    mags = [rng.random() for _ in range(BATCH)]
+    angle_array = np.array(angles)
+    mag_array = np.array(mags)
+    values = np.empty((BATCH, 2), dtype=np.uint8)
+
+    def construct() -> None:
+        for angle, mag in zip(angles, mags):
+            Direction(Stick.LEFT, angle, mag)
+
+    def interned() -> None:
+        for angle, mag in zip(angles, mags):
+            Direction.of(Stick.LEFT, angle, mag)
+
+    record("direction", {"impl": "init"}, construct)
+    record("direction", {"impl": "of"}, interned)
+    record(
+        "direction",
+        {"impl": "stickValues"},
+        lambda: Direction.stickValues(angle_array, mag_array, out=values),
+    )
+    return cases, mismatches
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--verify", type=int, default=100000, help="確認する状態の数")
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    parser.add_argument("--compare", help="比較する以前の結果のJSONファイル")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    mismatches = verify(args.verify)
+    print(f"Encoded {args.verify} random states: {mismatches} mismatch(es)")
+    if mismatches:
+        return 1
+
+    cases, mismatches = run(args.repeat)
+    if mismatches:
+        return 1
+    if args.output:
+        write_results(
+            args.output,
+            "serial_protocol",
+            cases,
+            {"batch": BATCH, "repeat": args.repeat},
+        )
+        print(f"Results written to {args.output}")
+    if args.compare:
+        regressions = compare(cases, args.compare, args.tolerance)
+        print(f"{regressions} regression(s)")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
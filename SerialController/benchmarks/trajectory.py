@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+スティックの軌跡の再生のベンチマーク
+
+記録したスティックのログ(--logを指定しない場合はランダムに作る)について、
+以前のPlayRecと同じ1行ずつの変換とTrajectory.encodeが同じ行を送ることを確認し、
+読み込みと変換の時間(CSVとバイナリ)と、time.sleepで待つ再生とTrajectoryPlayerの時刻のずれを比べる。
+
+    cd SerialController
+    python -m benchmarks.trajectory
+    python -m benchmarks.trajectory --log Logs/stick.csv --output trajectory.json
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.common import measure, print_case, write_results
+from Commands.Trajectory import Trajectory, TrajectoryPlayer
+
+
+class _TimedPort:
+    # 送られた行と送られた時刻を記録する
+    def __init__(self):
+        self.rows: list[bytes] = []
+        self.sent: list[float] = []
+        self.binary = False
+
+    def writeEncoded(self, data, is_show=False, send_at=None, coalesce=False) -> None:
+        self.sent.append(time.perf_counter())
+        self.rows.append(bytes(data))
+
+    def writeRow(self, row, is_show=False, send_at=None, coalesce=False) -> None:
+        self.writeEncoded((row + "\r\n").encode("ascii"))
+
+
+def legacy_rows(path: str) -> list[bytes]:
+    # 以前のPlayRec.doとPlayRec.LStickと同じ処理
+    with open(path) as f:
+        l_strip = [list(map(float, s.strip().split(","))) for s in f.readlines()]
+    rows = []
+    for angle, r, _ in l_strip:
+        row = (
+            f"2 8 {hex(int(128 + r * 127.5 * np.cos(np.deg2rad(angle))))} "
+            f"{hex(int(128 - r * 127.5 * np.sin(np.deg2rad(angle))))}"
+        )
+        rows.append(row)
+    return rows
+
+
+def _normalize(row: str) -> bytes:
+    # "0x"を付けた以前の行を、Joystick.cが同じ値として読む形にそろえる
+    tokens = row.split()
+    return " ".join(f"{int(t, 16):x}" for t in tokens).encode("ascii") + b"\r\n"
+
+
+def legacy_play(rows: list[list[float]], port: _TimedPort) -> float:
+    # 以前のPlayRec: 1行ずつ送ってtime.sleep(duration)
+    start = time.perf_counter()
+    for angle, r, duration in rows:
+        port.writeRow(
+            f"2 8 {hex(int(128 + r * 127.5 * np.cos(np.deg2rad(angle))))} "
+            f"{hex(int(128 - r * 127.5 * np.sin(np.deg2rad(angle))))}"
+        )
+        time.sleep(duration)
+    return time.perf_counter() - start
+
+
+def _write_random_log(path: str, samples: int, interval: float) -> None:
+    rng = random.Random(0)
+    angle = 0.0
+    with open(path, "w") as f:
+        for _ in range(samples):
+            angle = (angle + rng.uniform(-15, 15)) % 360 - 180
+            f.write(f"{angle},{rng.random()},{interval * rng.uniform(0.8, 1.2)}\n")
+
+
+def _errors(sent: list[float], planned: np.ndarray, start: float) -> np.ndarray:
+    return np.abs(np.asarray(sent[: len(planned)]) - start - planned) * 1000
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--log", help="記録したスティックのログ(CSV)")
+    parser.add_argument("--samples", type=int, default=20000, help="作るログの長さ")
+    parser.add_argument("--play", type=int, default=300, help="再生するサンプル数")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.log
+        if path is None:
+            path = os.path.join(tmp, "stick.csv")
+            _write_random_log(path, args.samples, 0.015)
+        binary_path = os.path.join(tmp, "stick.pctr")
+        trajectory = Trajectory.load(path)
+        trajectory.save(binary_path)
+
+        # 以前の1行ずつの変換と同じ行になるか
+        expected = [_normalize(row) for row in legacy_rows(path)]
+        encoded = trajectory.encode()
+        mismatches = sum(a != b for a, b in zip(expected, encoded))
+        mismatches += abs(len(expected) - len(encoded))
+        same_binary = Trajectory.load(binary_path).encode() == encoded
+        print(
+            f"{len(encoded)} samples: {mismatches} mismatch(es), "
+            f"binary log {'identical' if same_binary else 'MISMATCH'}"
+        )
+
+        cases = []
+        for name, func in (
+            ("legacy", lambda: legacy_rows(path)),
+            ("csv", lambda: Trajectory.load(path).encode()),
+            ("binary", lambda: Trajectory.load(binary_path).encode()),
+            (
+                "binary_stream",
+                lambda: [c.encode() for c in Trajectory.chunks(binary_path)],
+            ),
+        ):
+            case = {
+                "name": "load_encode",
+                "params": {"impl": name, "samples": len(trajectory)},
+                **measure(func, args.repeat),
+            }
+            print_case(case)
+            cases.append(case)
+
+        # 再生のタイミング
+        head = Trajectory(
+            trajectory.angle[: args.play],
+            trajectory.r[: args.play],
+            trajectory.duration[: args.play],
+        )
+        planned = head.times
+        rows = np.stack([head.angle, head.r, head.duration], axis=1).tolist()
+        port = _TimedPort()
+        start = time.perf_counter()
+        legacy_duration = legacy_play(rows, port)
+        legacy_errors = _errors(port.sent, planned, start)
+        port = _TimedPort()
+        start = time.perf_counter()
+        report = TrajectoryPlayer(port).play(head, start)
+        player_errors = _errors(port.sent, planned, start)
+        for name, errors, duration in (
+            ("sleep", legacy_errors, legacy_duration),
+            ("player", player_errors, report.actual_duration),
+        ):
+            print(
+                f"{name:<8} error median {np.median(errors):7.3f} ms "
+                f"max {errors.max():7.3f} ms  drift "
+                f"{(duration - head.end) * 1000:8.3f} ms"
+            )
+            cases.append(
+                {
+                    "name": "playback_error",
+                    "params": {"impl": name, "samples": len(head)},
+                    "repeat": len(errors),
+                    "median_ms": float(np.median(errors)),
+                    "max_ms": float(errors.max()),
+                    "drift_ms": (duration - head.end) * 1000,
+                }
+            )
+
+    if args.output:
+        write_results(args.output, "trajectory", cases, {"repeat": args.repeat})
+        print(f"Results written to {args.output}")
+    return 0 if mismatches == 0 and same_binary else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+待機処理のベンチマーク
+
+以前のPythonCommand.wait(0.1秒以下は空回り、それより長い場合はtime.sleep)と
+HybridSchedulerについて、待機時間ごとの締め切りからの遅れとCPU使用率を計測する。
+また、送信の処理時間を挟みながら待機を繰り返したときのずれの累積を比較する。
+
+    cd SerialController
+    python -m benchmarks.wait_scheduler --output wait.json
+"""
+
+import argparse
+import statistics
+import sys
+import time
+
+from benchmarks.common import compare, write_results
+from Commands.Scheduler import HybridScheduler
+
+DURATIONS = [0.0005, 0.002, 0.016, 0.05, 0.1, 0.2]
+
+
+def legacy_wait(wait: float) -> None:
+    # 以前のPythonCommand.waitと同じ処理
+    if float(wait) > 0.1:
+        time.sleep(wait)
+    else:
+        current_time = time.perf_counter()
+        while time.perf_counter() < current_time + wait:
+            pass
+
+
+def _overshoots(wait, duration: float, repeat: int) -> tuple[list[float], float]:
+    # 遅れ[us]のリストと、待機時間に対するCPU時間の割合
+    overshoots = []
+    cpu = time.thread_time()
+    wall = time.perf_counter()
+    for _ in range(repeat):
+        deadline = time.perf_counter() + duration
+        wait(duration)
+        overshoots.append((time.perf_counter() - deadline) * 1e6)
+    cpu = time.thread_time() - cpu
+    wall = time.perf_counter() - wall
+    return overshoots, cpu / wall if wall else 0.0
+
+
+def _drift(wait, steps: int, duration: float, work: float) -> float:
+    # 待機の間にworkの時間がかかる処理を挟み、予定からのずれ[ms]を返す
+    start = time.perf_counter()
+    for _ in range(steps):
+        end = time.perf_counter() + work
+        while time.perf_counter() < end:
+            pass
+        wait(duration)
+    return (time.perf_counter() - start - steps * duration) * 1000
+
+
+def run(repeat: int, margins: list[float]) -> list[dict]:
+    cases = []
+
+    def record(name: str, params: dict, overshoots: list[float], cpu: float) -> None:
+        overshoots.sort()
+        case = {
+            "name": name,
+            "params": params,
+            "repeat": len(overshoots),
+            # compareで使う値(遅れの中央値)
+            "median_ms": statistics.median(overshoots) / 1000,
+            "p99_us": overshoots[min(len(overshoots) - 1, int(len(overshoots) * 0.99))],
+            "max_us": overshoots[-1],
+            "cpu_ratio": cpu,
+        }
+        print(
+            f"{name:<16} {str(params):<44} overshoot median "
+            f"{case['median_ms'] * 1000:8.1f} us  p99 {case['p99_us']:8.1f} us  "
+            f"max {case['max_us']:8.1f} us  cpu {cpu:6.1%}"
+        )
+        cases.append(case)
+
+    for duration in DURATIONS:
+        count = max(3, min(repeat, int(2.0 / duration)))
+        record(
+            "legacy",
+            {"duration": duration},
+            *_overshoots(legacy_wait, duration, count),
+        )
+        record(
+            "sleep",
+            {"duration": duration},
+            *_overshoots(time.sleep, duration, count),
+        )
+        for margin in margins:
+            scheduler = HybridScheduler(spin_margin=margin)
+            record(
+                "hybrid",
+                {"duration": duration, "margin": margin},
+                *_overshoots(scheduler.sleep, duration, count),
+            )
+
+    steps, duration, work = 100, 0.02, 0.0003
+    scheduler = HybridScheduler()
+    for name, wait in [
+        ("legacy", legacy_wait),
+        ("hybrid", scheduler.sleep),
+        ("hybrid-chain", lambda d: scheduler.sleep(d, chain=True)),
+    ]:
+        drift = _drift(wait, steps, duration, work)
+        print(
+            f"drift {name:<12} {steps} waits of {duration}s with {work * 1000}ms work: "
+            f"{drift:7.2f} ms"
+        )
+        cases.append(
+            {
+                "name": "drift",
+                "params": {"impl": name, "steps": steps, "work": work},
+                "repeat": 1,
+                "median_ms": max(drift, 0.0),
+            }
+        )
+    return cases
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument(
+        "--margins", default="0.001,0.002", help="空回りする時間[s](カンマ区切り)"
+    )
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    parser.add_argument("--compare", help="比較する以前の結果のJSONファイル")
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    args = parser.parse_args(argv)
+
+    margins = [float(v) for v in args.margins.split(",")]
+    cases = run(args.repeat, margins)
+    if args.output:
+        write_results(
+            args.output,
+            "wait_scheduler",
+            cases,
+            {"repeat": args.repeat, "margins": margins},
+        )
+        print(f"Results written to {args.output}")
+    if args.compare:
+        regressions = compare(cases, args.compare, args.tolerance)
+        print(f"{regressions} regression(s)")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())